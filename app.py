@@ -1,19 +1,39 @@
 import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Socket.IO server mode: threading (one OS thread per connection), or eventlet / gevent green
+# threads for thousands of connections. Green threads need the standard library patched before
+# anything else imports socket or threading, so this runs ahead of the other imports.
+SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+if SOCKETIO_ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif SOCKETIO_ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
 import sqlite3
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, session
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask_mail import Mail, Message
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
+from functools import wraps
 import math
+import numpy as np
 from math import radians, sin, cos, sqrt, atan2
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, join_room, leave_room, rooms
 from flask_cors import CORS
 import requests
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeout
 import io
+import hashlib
+import hmac
+import secrets
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
@@ -25,15 +45,80 @@ from geopy.exc import GeocoderTimedOut
 from functools import wraps
 import random
 from flask import send_from_directory
+from db import db
+from migrations import migrate, pending, MIGRATE_ON_STARTUP
+from route_cache import route_cache
+from provider_client import get_client, provider_stats
+from geocode_cache import geocode_cache
+from route_tracker import ActiveRoute, active_routes
+from geometry import Polyline, tolerance_for_zoom
+from spatial import haversine, haversine_np, bounding_box, nearest_k
+from driver_index import driver_index
+from dispatch import DispatchEngine, DISPATCH_ENABLED, DISPATCH_ROAD_ETA_MAX_CELLS
+from eta_matrix import EtaMatrix
+from road_graph import local_router
+from speed_profiles import speed_profiles
+from gps_filter import gps_filter
+from ingest import gps_ingest, parse_batch, fix_time_ms, fix_isoformat, PROCESS, COALESCED, LIMITED
+from location_writer import location_writer
+from retention import retention
+from trajectory import trajectories, csv_chunks, ndjson_chunks, geojson_feature
 
 app = Flask(__name__)
 CORS(app)
-load_dotenv()
 
 app.secret_key = os.getenv('SECRET_KEY', 'default-secret-key-change-in-production')
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', 1024 * 1024))  # larger request bodies get 413 unread
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 OPENCAGE_API_KEY = os.getenv('OPENCAGE_API_KEY')
 TOMTOM_API_KEY = os.getenv('TOMTOM_API_KEY')
-socketio = SocketIO(app)
+
+# Several worker processes share rooms and emits through a message queue (e.g. redis://localhost:6379/0);
+# put them behind a load balancer with sticky sessions. Only one worker should run the background jobs.
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
+SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'fastaid')  # one channel per deployment sharing a queue
+BACKGROUND_JOBS = os.getenv('BACKGROUND_JOBS', 'true').lower() == 'true'  # speed profiles, retention, dispatch
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', 5001))
+SERVER_DEBUG = os.getenv('SERVER_DEBUG', 'true').lower() == 'true'  # reloader and debugger; off for workers
+socketio = SocketIO(app, async_mode=SOCKETIO_ASYNC_MODE, message_queue=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL)
+
+# Shared, bounded pool for outbound routing calls so route segments can be fetched concurrently
+ROUTING_MAX_WORKERS = int(os.getenv('ROUTING_MAX_WORKERS', 8))
+routing_executor = ThreadPoolExecutor(max_workers=ROUTING_MAX_WORKERS, thread_name_prefix='routing')
+
+# Hedged routing: if TomTom is slower than its observed p95, race OSRM against it
+ROUTE_HEDGE_ENABLED = os.getenv('ROUTE_HEDGE_ENABLED', 'true').lower() == 'true'
+ROUTE_HEDGE_PERCENTILE = float(os.getenv('ROUTE_HEDGE_PERCENTILE', 95))
+ROUTE_HEDGE_BUDGET_MS = float(os.getenv('ROUTE_HEDGE_BUDGET_MS', 1500))  # used until enough samples exist
+ROUTE_HEDGE_MIN_BUDGET_MS = float(os.getenv('ROUTE_HEDGE_MIN_BUDGET_MS', 200))
+ROUTE_HEDGE_MIN_SAMPLES = int(os.getenv('ROUTE_HEDGE_MIN_SAMPLES', 20))
+ROUTE_HEDGE_GRACE_MS = float(os.getenv('ROUTE_HEDGE_GRACE_MS', 300))
+# Separate pool so hedged calls never wait behind the segment tasks that spawned them
+hedge_executor = ThreadPoolExecutor(max_workers=ROUTING_MAX_WORKERS * 2, thread_name_prefix='route-hedge')
+
+# Driver dashboard: only requests within this radius, nearest first, at most this many
+DASHBOARD_RADIUS_KM = float(os.getenv('DASHBOARD_RADIUS_KM', 50))
+DASHBOARD_MAX_REQUESTS = int(os.getenv('DASHBOARD_MAX_REQUESTS', 100))
+
+# Admin dashboard: newest requests in the first render, then pushed changes over Socket.IO
+ADMIN_DASHBOARD_ROWS = int(os.getenv('ADMIN_DASHBOARD_ROWS', 500))
+ADMIN_POSITION_PUSH_INTERVAL = float(os.getenv('ADMIN_POSITION_PUSH_INTERVAL', 2.0))  # seconds between position pushes per request
+
+# Socket.IO rooms: events go to a request's watchers and a grid region, not to every connection
+REGION_CELL_DEG = float(os.getenv('REGION_CELL_DEG', 0.25))  # region room cell size (~28 km)
+REGION_MAX_ROOMS = int(os.getenv('REGION_MAX_ROOMS', 36))  # cells one socket may join
+TRACKING_SESSION_MAX = int(os.getenv('TRACKING_SESSION_MAX', 20))  # requests one browser session may watch
+TRACKING_TOKEN_BYTES = int(os.getenv('TRACKING_TOKEN_BYTES', 16))  # entropy of the tracking code issued at booking
+
+# Stored route geometry is simplified to this many metres of error (removes redundant points)
+ROUTE_STORE_TOLERANCE_M = float(os.getenv('ROUTE_STORE_TOLERANCE_M', 2))
+
+# Route on the offline road graph before calling TomTom/OSRM (it is always the last fallback)
+LOCAL_ROUTING_FIRST = os.getenv('LOCAL_ROUTING_FIRST', 'false').lower() == 'true'
+
+# /api/drivers/nearest?eta=true prices this many straight-line candidates per requested driver
+NEAREST_ETA_SHORTLIST_FACTOR = int(os.getenv('NEAREST_ETA_SHORTLIST_FACTOR', 3))
 
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'pdf'}
 UPLOAD_FOLDER = 'uploads'
@@ -41,158 +126,95 @@ UPLOAD_FOLDER = 'uploads'
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Database initialization
-def init_db():
-    if not os.path.exists('users.db'):
-        print("Database not found. Creating tables...")
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Ambulance Requests Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ambulance_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                patient_name TEXT,
-                contact TEXT,
-                pickup_location TEXT,
-                destination TEXT,
-                ambulance_type TEXT,
-                origin_lat REAL NOT NULL,
-                origin_lng REAL NOT NULL,
-                destination_lat REAL,
-                destination_lng REAL,
-                status TEXT DEFAULT 'Pending',
-                estimated_arrival_time TEXT,
-                estimated_completion_time TEXT,
-                pickup_lat REAL,
-                pickup_lng REAL,
-                request_time TEXT,
-                estimated_time_minutes INTEGER,
-                driver_lat REAL,
-                driver_lng REAL,
-                route_distance_km REAL,
-                route_duration_minutes REAL,
-                traffic_delay_minutes REAL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        
-        # Ambulance Locations Table (for tracking history)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ambulance_locations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ambulance_id INTEGER,
-                latitude REAL,
-                longitude REAL,
-                timestamp TEXT,
-                status TEXT,
-                last_updated TEXT,
-                FOREIGN KEY (ambulance_id) REFERENCES ambulance_requests(id)
-            )
-        ''')
-        
-        # Admins Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL,
-                password TEXT NOT NULL
-            )
-        ''')
-        
-        # NEW: Drivers Table
+# Bring the schema up to date on startup (a single schema_version read once it is current)
+if MIGRATE_ON_STARTUP:
+    migrate()
+elif pending():
+    print("Database schema is out of date; run `python migrations.py upgrade`")
+
+
+def load_driver_index():
+    """Fill the in-memory driver index from the drivers table"""
+    with db.transaction() as cursor:
+        cursor.execute('SELECT id, current_lat, current_lng, status FROM drivers')
+        driver_index.load(cursor.fetchall())
+
+
+load_driver_index()
+
+# Offline road graph for the last-resort routing provider (loads in the background if ROAD_GRAPH_PATH is set)
+local_router.load_async()
+
+# Learned speeds per grid cell and hour of week; folds in new location history in the background
+speed_profiles.load()
+if BACKGROUND_JOBS:
+    speed_profiles.start()
+
+# Batched writer for GPS position and history writes (flushes on shutdown)
+location_writer.start()
+
+# Coalesces bursty GPS senders per ambulance; hands the latest held fix on once its interval has passed
+gps_ingest.start()
+
+# Downsamples finished trips and archives old ones out of ambulance_locations (hourly, in small batches)
+if BACKGROUND_JOBS:
+    retention.start()
+
+
+def on_dispatch_assigned(assignments):
+    """
+    Called after a dispatch cycle commits: update the driver index, tell each driver and the
+    request's viewers, then route every trip the same way a manual accept does
+    """
+    for assignment in assignments:
+        driver_index.set_status(assignment['driver_id'], 'On Trip')
+        socketio.emit('dispatch_assigned', assignment,
+                      to=[request_room(assignment['request_id']), driver_room(assignment['driver_id'])])
+    for assignment in assignments:
+        try:
+            route_dispatched_request(assignment)
+        except Exception as e:
+            print(f"Routing dispatched request {assignment['request_id']} failed: {e}")
+        publish_request(assignment['request_id'])
+    print(f"Dispatch assigned {len(assignments)} request(s)")
+
+
+def route_dispatched_request(assignment):
+    """Road route, geometry and active route for a dispatched trip (dispatch itself only priced the ETA)"""
+    request_id = assignment['request_id']
+    with db.transaction() as cursor:
+        cursor.execute('SELECT origin_lat, origin_lng, destination_lat, destination_lng FROM ambulance_requests WHERE id = ?',
+                       (request_id,))
+        result = cursor.fetchone()
+    if not result:
+        return
+    patient_lat, patient_lng, hospital_lat, hospital_lng = result
+    route_info = calculate_route_info(assignment['driver_lat'], assignment['driver_lng'],
+                                      patient_lat, patient_lng, hospital_lat, hospital_lng)
+    active_routes.set(request_id, ActiveRoute(route_info, 'Started'))
+    with db.transaction() as cursor:
+        save_route_geometry(cursor, request_id, route_info)
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS drivers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT NOT NULL,
-                current_lat REAL,
-                current_lng REAL,
-                status TEXT DEFAULT 'Available',
-                last_login TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create indexes for performance
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON ambulance_requests(status)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_phone ON drivers(phone)')
-        
-        conn.commit()
-        conn.close()
-        print("Tables created successfully.")
-        
-    else:
-        print("Database already exists.")
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Check if drivers table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='drivers'")
-        if not cursor.fetchone():
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS drivers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    phone TEXT NOT NULL,
-                    current_lat REAL,
-                    current_lng REAL,
-                    status TEXT DEFAULT 'Available',
-                    last_login TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_phone ON drivers(phone)')
-            print("Created drivers table.")
-        
-        # Check and update ambulance_requests table columns
-        cursor.execute('PRAGMA table_info(ambulance_requests)')
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # EXISTING COLUMNS
-        if 'pickup_lat' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN pickup_lat REAL')
-            print("Added pickup_lat column.")
-        if 'pickup_lng' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN pickup_lng REAL')
-            print("Added pickup_lng column.")
-        if 'request_time' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN request_time TEXT')
-            print("Added request_time column.")
-        if 'estimated_time_minutes' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN estimated_time_minutes INTEGER')
-            print("Added estimated_time_minutes column.")
-        if 'status' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN status TEXT')
-            print("Added status column.")
-        
-        # NEW COLUMNS FOR DRIVER LOCATION AND ROUTE
-        if 'driver_lat' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN driver_lat REAL')
-            print("Added driver_lat column.")
-        if 'driver_lng' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN driver_lng REAL')
-            print("Added driver_lng column.")
-        if 'route_distance_km' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN route_distance_km REAL')
-            print("Added route_distance_km column.")
-        if 'route_duration_minutes' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN route_duration_minutes REAL')
-            print("Added route_duration_minutes column.")
-        
-        #  NEW COLUMN FOR TRAFFIC DELAY
-        if 'traffic_delay_minutes' not in columns:
-            cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN traffic_delay_minutes REAL')
-            print("Added traffic_delay_minutes column.")
-        
-        conn.commit()
-        conn.close()
-        print("Database schema updated successfully.")
+            UPDATE ambulance_requests SET route_distance_km = ?, route_duration_minutes = ?
+            WHERE id = ? AND status = 'Started'
+        ''', (route_info.get('total_distance_km', 0), route_info.get('total_duration_minutes', 0), request_id))
+
+
+# Many-to-many ETA tables (TomTom Matrix / OSRM table) instead of one routing call per pair
+eta_matrix = EtaMatrix(tomtom_api_key=TOMTOM_API_KEY, speed_model=speed_profiles)
 
 
-# Initialize database on startup
-init_db()
+def dispatch_eta_matrix(driver_lats, driver_lngs, patient_lats, patient_lngs):
+    """Road ETAs for dispatch batches small enough to price with matrix calls, speed-profile estimates above that"""
+    if len(driver_lats) * len(patient_lats) <= DISPATCH_ROAD_ETA_MAX_CELLS:
+        return eta_matrix(driver_lats, driver_lngs, patient_lats, patient_lngs)
+    return eta_matrix.estimate(np.column_stack([driver_lats, driver_lngs]), np.column_stack([patient_lats, patient_lngs]))[0]
+
+
+# Batch auto-dispatch: matches Available drivers to Pending requests every DISPATCH_INTERVAL seconds
+dispatch_engine = DispatchEngine(eta_matrix=dispatch_eta_matrix, on_assign=on_dispatch_assigned)
+if DISPATCH_ENABLED and BACKGROUND_JOBS:
+    dispatch_engine.start()
 
 
 
@@ -207,76 +229,61 @@ sqlite3.register_converter("datetime", convert_datetime)
 
 # GEOCODING AND DISTANCE FUNCTIONS
 
-def reverse_geocode_for_address(address):
-    """Convert address to coordinates using OpenCage"""
-    if not OPENCAGE_API_KEY:
-        raise ValueError("OPENCAGE_API_KEY is not set in environment variables.")
-    
-    url = f"https://api.opencagedata.com/geocode/v1/json?q={address}&key={OPENCAGE_API_KEY}"
-    response = requests.get(url)
+def opencage_lookup(query):
+    """Return the first OpenCage result for a query, or None"""
+    try:
+        response = get_client('opencage').get('/geocode/v1/json', params={'q': query, 'key': OPENCAGE_API_KEY})
+    except Exception as e:
+        print(f"OpenCage Error: {e}")
+        return None
     
     if response.status_code == 200:
         data = response.json()
         if data['results']:
-            lat = data['results'][0]['geometry']['lat']
-            lng = data['results'][0]['geometry']['lng']
-            return lat, lng
-        else:
-            return None, None
-    else:
-        print(f"Error: {response.status_code}")
-        return None, None
+            return data['results'][0]
+        return None
+    print(f"Error: {response.status_code}")
+    return None
+
+def reverse_geocode_for_address(address):
+    """Convert address to coordinates using OpenCage"""
+    if not OPENCAGE_API_KEY:
+        raise ValueError("OPENCAGE_API_KEY is not set in environment variables.")
+    return get_coordinates(address)
 
 def get_coordinates(location):
-    """Get coordinates from address using OpenCage"""
+    """Get coordinates from address using OpenCage (cached by normalized address)"""
+    cached = geocode_cache.get_forward(location)
+    if cached:
+        return cached
+    
     if not OPENCAGE_API_KEY:
         return None, None
     
-    url = f"https://api.opencagedata.com/geocode/v1/json?q={location}&key={OPENCAGE_API_KEY}"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        data = response.json()
-        if data['results']:
-            lat = data['results'][0]['geometry']['lat']
-            lng = data['results'][0]['geometry']['lng']
-            return lat, lng
+    result = opencage_lookup(location)
+    if result:
+        lat = result['geometry']['lat']
+        lng = result['geometry']['lng']
+        geocode_cache.put_forward(location, lat, lng)
+        return lat, lng
     return None, None
 
 def reverse_geocode(lat, lng):
-    """Convert coordinates to address using OpenCage"""
+    """Convert coordinates to address using OpenCage (cached by rounded coordinates)"""
+    cached = geocode_cache.get_reverse(lat, lng)
+    if cached:
+        return cached
+    
     if not OPENCAGE_API_KEY:
         return "Unknown Location"
     
-    url = f"https://api.opencagedata.com/geocode/v1/json?q={lat}+{lng}&key={OPENCAGE_API_KEY}"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        data = response.json()
-        if data['results']:
-            address = data['results'][0]['formatted']
-            return address
+    result = opencage_lookup(f"{lat},{lng}")
+    if result:
+        address = result['formatted']
+        geocode_cache.put_reverse(lat, lng, address)
+        return address
     return "Unknown Location"
 
-# Haversine formula for distance calculation
-def haversine(lat1, lon1, lat2, lon2):
-    """Calculate distance between two coordinates using Haversine formula"""
-    R = 6371  # Earth radius in kilometers
-    
-    lat1 = radians(lat1)
-    lon1 = radians(lon1)
-    lat2 = radians(lat2)
-    lon2 = radians(lon2)
-    
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    
-    distance = R * c
-    return distance
-
 # TRAFFIC-AWARE ROUTING FUNCTIONS
 
 def get_route_via_tomtom(start_lat, start_lng, end_lat, end_lng):
@@ -288,8 +295,24 @@ def get_route_via_tomtom(start_lat, start_lng, end_lat, end_lng):
         print("TomTom API key not found, falling back to OSRM")
         return get_route_via_osrm(start_lat, start_lng, end_lat, end_lng)
     
+    cached = route_cache.get('tomtom', start_lat, start_lng, end_lat, end_lng)
+    if cached:
+        return cached
+    
+    if ROUTE_HEDGE_ENABLED:
+        return get_route_hedged(start_lat, start_lng, end_lat, end_lng)
+    
+    route_result = fetch_tomtom_route(start_lat, start_lng, end_lat, end_lng)
+    if route_result['success']:
+        return route_result
+    
+    print(f"{route_result['error']}, falling back to OSRM")
+    return get_route_via_osrm(start_lat, start_lng, end_lat, end_lng)
+
+def fetch_tomtom_route(start_lat, start_lng, end_lat, end_lng):
+    """Single TomTom routing call without any fallback. Returns a route dict with 'success'."""
     try:
-        url = f"https://api.tomtom.com/routing/1/calculateRoute/{start_lat},{start_lng}:{end_lat},{end_lng}/json"
+        path = f"/routing/1/calculateRoute/{start_lat},{start_lng}:{end_lat},{end_lng}/json"
         params = {
             'key': TOMTOM_API_KEY,
             'traffic': 'true',  # Include live traffic
@@ -298,7 +321,7 @@ def get_route_via_tomtom(start_lat, start_lng, end_lat, end_lng):
             'departAt': 'now'  # Current time for traffic data
         }
         
-        response = requests.get(url, params=params, timeout=10)
+        response = get_client('tomtom').get(path, params=params)
         
         if response.status_code == 200:
             data = response.json()
@@ -307,11 +330,12 @@ def get_route_via_tomtom(start_lat, start_lng, end_lat, end_lng):
                 route = data['routes'][0]
                 summary = route['summary']
                 
-                # Extract coordinates
-                coordinates = []
-                for leg in route['legs']:
-                    for point in leg['points']:
-                        coordinates.append([point['latitude'], point['longitude']])
+                # Extract coordinates into a compact array-backed polyline
+                coordinates = Polyline.from_coordinates(
+                    (point['latitude'], point['longitude'])
+                    for leg in route['legs']
+                    for point in leg['points']
+                )
                 
                 # Get distance and duration (with traffic)
                 distance_km = summary['lengthInMeters'] / 1000
@@ -320,7 +344,7 @@ def get_route_via_tomtom(start_lat, start_lng, end_lat, end_lng):
                 
                 print(f"TomTom route calculated: {distance_km:.2f} km, {duration_minutes:.2f} min (traffic delay: {traffic_delay_seconds/60:.1f} min)")
                 
-                return {
+                route_result = {
                     'coordinates': coordinates,
                     'distance_km': round(distance_km, 2),
                     'duration_minutes': round(duration_minutes, 2),
@@ -328,22 +352,73 @@ def get_route_via_tomtom(start_lat, start_lng, end_lat, end_lng):
                     'traffic_aware': True,
                     'success': True
                 }
+                route_cache.put('tomtom', start_lat, start_lng, end_lat, end_lng, route_result)
+                return route_result
         
-        print(f"TomTom API error: {response.status_code}, falling back to OSRM")
-        return get_route_via_osrm(start_lat, start_lng, end_lat, end_lng)
+        return {'success': False, 'error': f"TomTom API error: {response.status_code}"}
     
     except Exception as e:
-        print(f"TomTom Error: {e}, falling back to OSRM")
+        return {'success': False, 'error': f"TomTom Error: {e}"}
+
+def hedge_budget_seconds():
+    """How long TomTom gets before OSRM is fired in parallel, driven by TomTom's observed latency"""
+    latency = get_client('tomtom').latency
+    budget = None
+    if latency.samples >= ROUTE_HEDGE_MIN_SAMPLES:
+        budget = latency.percentile(ROUTE_HEDGE_PERCENTILE)
+    if budget is None:
+        budget = ROUTE_HEDGE_BUDGET_MS / 1000
+    return max(ROUTE_HEDGE_MIN_BUDGET_MS / 1000, budget)
+
+def get_route_hedged(start_lat, start_lng, end_lat, end_lng):
+    """
+    Hedged routing: give TomTom its latency budget, then race OSRM against it.
+    The first good answer wins, but a traffic-aware TomTom answer is preferred
+    if it arrives within the grace window after OSRM.
+    """
+    tomtom_future = hedge_executor.submit(fetch_tomtom_route, start_lat, start_lng, end_lat, end_lng)
+    try:
+        tomtom_result = tomtom_future.result(timeout=hedge_budget_seconds())
+    except FuturesTimeout:
+        tomtom_result = None
+    
+    if tomtom_result is not None:
+        if tomtom_result['success']:
+            return tomtom_result
+        print(f"{tomtom_result['error']}, falling back to OSRM")
         return get_route_via_osrm(start_lat, start_lng, end_lat, end_lng)
+    
+    # TomTom is slower than usual: fire OSRM in parallel
+    print("TomTom over latency budget, hedging with OSRM")
+    osrm_future = hedge_executor.submit(get_route_via_osrm, start_lat, start_lng, end_lat, end_lng)
+    pending = {tomtom_future, osrm_future}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        if tomtom_future in done and tomtom_future.result()['success']:
+            return tomtom_future.result()
+        if osrm_future in done and osrm_future.result()['success']:
+            if tomtom_future in pending:
+                try:
+                    tomtom_result = tomtom_future.result(timeout=ROUTE_HEDGE_GRACE_MS / 1000)
+                    if tomtom_result['success']:
+                        return tomtom_result
+                except FuturesTimeout:
+                    pass
+            return osrm_future.result()
+    return osrm_future.result()
 
 def get_route_via_osrm(start_lat, start_lng, end_lat, end_lng):
     """
     Fallback: Get route from OSRM (no traffic, but free)
     Returns: list of coordinates along the road, actual distance, duration
     """
+    cached = route_cache.get('osrm', start_lat, start_lng, end_lat, end_lng)
+    if cached:
+        return cached
+    
     try:
-        url = f"https://router.project-osrm.org/route/v1/driving/{start_lng},{start_lat};{end_lng},{end_lat}?overview=full&geometries=geojson"
-        response = requests.get(url, timeout=5)
+        path = f"/route/v1/driving/{start_lng},{start_lat};{end_lng},{end_lat}"
+        response = get_client('osrm').get(path, params={'overview': 'full', 'geometries': 'geojson'})
         
         if response.status_code == 200:
             data = response.json()
@@ -351,7 +426,7 @@ def get_route_via_osrm(start_lat, start_lng, end_lat, end_lng):
                 route = data['routes'][0]
                 
                 # Get coordinates from GeoJSON
-                coordinates = [[coord[1], coord[0]] for coord in route['geometry']['coordinates']]
+                coordinates = Polyline.from_coordinates((coord[1], coord[0]) for coord in route['geometry']['coordinates'])
                 
                 # Distance in meters to km, duration in seconds to minutes
                 distance_km = route['distance'] / 1000
@@ -359,30 +434,53 @@ def get_route_via_osrm(start_lat, start_lng, end_lat, end_lng):
                 
                 print(f"OSRM fallback route: {distance_km:.2f} km, {duration_minutes:.2f} min (no traffic data)")
                 
-                return {
+                route_result = {
                     'coordinates': coordinates,
                     'distance_km': round(distance_km, 2),
                     'duration_minutes': round(duration_minutes, 2),
                     'traffic_aware': False,
                     'success': True
                 }
-        return {'success': False, 'error': 'Unable to get route'}
+                route_cache.put('osrm', start_lat, start_lng, end_lat, end_lng, route_result)
+                return route_result
+        print("OSRM returned no route, trying the local road graph")
     except Exception as e:
         print(f"OSRM Error: {e}")
-        return {'success': False, 'error': str(e)}
+    return get_route_via_local(start_lat, start_lng, end_lat, end_lng)
+
+def get_route_via_local(start_lat, start_lng, end_lat, end_lng):
+    """
+    Last provider: A* with landmarks on the offline road graph (no traffic, no network).
+    Fails fast when no graph is configured, so callers drop to the haversine estimate.
+    """
+    route_result = local_router.route(start_lat, start_lng, end_lat, end_lng)
+    if route_result['success']:
+        print(f"Local road graph route: {route_result['distance_km']:.2f} km, {route_result['duration_minutes']:.2f} min (no traffic data)")
+    return route_result
+
+def get_route(start_lat, start_lng, end_lat, end_lng):
+    """Route one segment through the provider chain (local graph first when LOCAL_ROUTING_FIRST is set)"""
+    if LOCAL_ROUTING_FIRST and local_router.ready:
+        route_result = local_router.route(start_lat, start_lng, end_lat, end_lng)
+        if route_result['success']:
+            return route_result
+    return get_route_via_tomtom(start_lat, start_lng, end_lat, end_lng)
 
 
 def calculate_route_info(driver_lat, driver_lng, patient_lat, patient_lng, hospital_lat, hospital_lng):
     """
     Calculate optimal route with LIVE TRAFFIC: Driver (A) â†’ Patient (B) â†’ Hospital (H)
-    Uses TomTom (free, traffic-aware) with OSRM fallback
+    Uses TomTom (free, traffic-aware) with OSRM and local road graph fallback
     """
     try:
         print(f"\nCalculating route: Driver({driver_lat}, {driver_lng}) â†’ Patient({patient_lat}, {patient_lng}) â†’ Hospital({hospital_lat}, {hospital_lng})")
         
-        # Try TomTom first (with live traffic), fallback to OSRM if unavailable
-        segment1 = get_route_via_tomtom(driver_lat, driver_lng, patient_lat, patient_lng)
-        segment2 = get_route_via_tomtom(patient_lat, patient_lng, hospital_lat, hospital_lng)
+        # Try TomTom first (with live traffic), fallback to OSRM if unavailable.
+        # Both segments are fetched concurrently so we wait for the slowest one, not the sum.
+        future1 = routing_executor.submit(get_route, driver_lat, driver_lng, patient_lat, patient_lng)
+        future2 = routing_executor.submit(get_route, patient_lat, patient_lng, hospital_lat, hospital_lng)
+        segment1 = future1.result()
+        segment2 = future2.result()
         
         if segment1['success'] and segment2['success']:
             total_distance = segment1['distance_km'] + segment2['distance_km']
@@ -416,77 +514,160 @@ def calculate_route_info(driver_lat, driver_lng, patient_lat, patient_lng, hospi
         else:
             # Fallback to haversine if both APIs fail
             print("Both routing APIs failed, using Haversine fallback")
-            distance_to_patient = haversine(driver_lat, driver_lng, patient_lat, patient_lng)
-            distance_to_hospital = haversine(patient_lat, patient_lng, hospital_lat, hospital_lng)
-            total_distance = distance_to_patient + distance_to_hospital
-            
-            avg_speed_kmh = 40
-            total_duration_minutes = (total_distance / avg_speed_kmh) * 60
-            
-            return {
-                'total_distance_km': round(total_distance, 2),
-                'total_duration_minutes': round(total_duration_minutes, 2),
-                'traffic_delay_minutes': 0,
-                'traffic_aware': False,
-                'route_coordinates': [],
-                'segment_1': {
-                    'from': 'Driver',
-                    'to': 'Patient',
-                    'distance_km': round(distance_to_patient, 2),
-                    'duration_minutes': round((distance_to_patient / avg_speed_kmh) * 60, 2)
-                },
-                'segment_2': {
-                    'from': 'Patient',
-                    'to': 'Hospital',
-                    'distance_km': round(distance_to_hospital, 2),
-                    'duration_minutes': round((distance_to_hospital / avg_speed_kmh) * 60, 2)
-                }
-            }
+            return haversine_route_info(driver_lat, driver_lng, patient_lat, patient_lng, hospital_lat, hospital_lng)
     except Exception as e:
         print(f"Route calculation error: {e}")
-        distance_to_patient = haversine(driver_lat, driver_lng, patient_lat, patient_lng)
-        distance_to_hospital = haversine(patient_lat, patient_lng, hospital_lat, hospital_lng)
-        total_distance = distance_to_patient + distance_to_hospital
-        
-        avg_speed_kmh = 40
-        total_duration_minutes = (total_distance / avg_speed_kmh) * 60
-        
-        return {
-            'total_distance_km': round(total_distance, 2),
-            'total_duration_minutes': round(total_duration_minutes, 2),
-            'traffic_delay_minutes': 0,
-            'traffic_aware': False
+        return haversine_route_info(driver_lat, driver_lng, patient_lat, patient_lng, hospital_lat, hospital_lng)
+
+def calculate_hospital_route_info(driver_lat, driver_lng, hospital_lat, hospital_lng):
+    """
+    Route for the 'Patient Received' phase: the patient is on board, so only Driver -> Hospital
+    is routed. Same shape as calculate_route_info, with an empty first segment.
+    """
+    try:
+        segment = get_route(driver_lat, driver_lng, hospital_lat, hospital_lng)
+    except Exception as e:
+        print(f"Route calculation error: {e}")
+        segment = {'success': False}
+    if not segment['success']:
+        distance = haversine(driver_lat, driver_lng, hospital_lat, hospital_lng)
+        segment = {
+            'distance_km': round(distance, 2),
+            'duration_minutes': round(speed_profiles.segment_minutes(driver_lat, driver_lng, hospital_lat, hospital_lng, distance), 2),
+            'coordinates': []
+        }
+    
+    return {
+        'total_distance_km': round(segment['distance_km'], 2),
+        'total_duration_minutes': round(segment['duration_minutes'], 2),
+        'traffic_delay_minutes': round(segment.get('traffic_delay_minutes', 0), 2),
+        'traffic_aware': segment.get('traffic_aware', False),
+        'route_coordinates': segment['coordinates'],
+        'segment_1': {
+            'from': 'Driver',
+            'to': 'Patient',
+            'distance_km': 0.0,
+            'duration_minutes': 0.0
+        },
+        'segment_2': {
+            'from': 'Driver',
+            'to': 'Hospital',
+            'distance_km': segment['distance_km'],
+            'duration_minutes': segment['duration_minutes'],
+            'coordinates': segment['coordinates']
+        }
+    }
+
+def haversine_route_info(driver_lat, driver_lng, patient_lat, patient_lng, hospital_lat, hospital_lng):
+    """Straight-line route estimate used when no routing provider answers, timed with learned speed profiles"""
+    distance_to_patient = haversine(driver_lat, driver_lng, patient_lat, patient_lng)
+    distance_to_hospital = haversine(patient_lat, patient_lng, hospital_lat, hospital_lng)
+    total_distance = distance_to_patient + distance_to_hospital
+    
+    minutes_to_patient = speed_profiles.segment_minutes(driver_lat, driver_lng, patient_lat, patient_lng, distance_to_patient)
+    minutes_to_hospital = speed_profiles.segment_minutes(patient_lat, patient_lng, hospital_lat, hospital_lng, distance_to_hospital)
+    total_duration_minutes = minutes_to_patient + minutes_to_hospital
+    
+    return {
+        'total_distance_km': round(total_distance, 2),
+        'total_duration_minutes': round(total_duration_minutes, 2),
+        'traffic_delay_minutes': 0,
+        'traffic_aware': False,
+        'route_coordinates': [],
+        'segment_1': {
+            'from': 'Driver',
+            'to': 'Patient',
+            'distance_km': round(distance_to_patient, 2),
+            'duration_minutes': round(minutes_to_patient, 2)
+        },
+        'segment_2': {
+            'from': 'Patient',
+            'to': 'Hospital',
+            'distance_km': round(distance_to_hospital, 2),
+            'duration_minutes': round(minutes_to_hospital, 2)
         }
+    }
+
+def gps_time_ms(data):
+    """Optional Geolocation `timestamp` (ms since epoch) of a fix; None when missing or out of range"""
+    try:
+        return fix_time_ms(data.get('timestamp'))
+    except (TypeError, ValueError, OverflowError):
+        return None
 
-def calculate_speed(lat1, lon1, lat2, lon2, time1, time2):
-    """Calculate speed between two points"""
-    distance_km = haversine(lat1, lon1, lat2, lon2)
-    time_diff = (time2 - time1).total_seconds() / 3600  # hours
+def gps_timestamp(data):
+    """Fix time in seconds from an optional Geolocation `timestamp`; None means now"""
+    ms = gps_time_ms(data)
+    return ms / 1000 if ms is not None else None
+
+def live_route_info(request_id, status, driver_lat, driver_lng, patient_lat, patient_lng, hospital_lat, hospital_lng):
+    """
+    Route info for a live GPS fix. Snaps the fix onto the request's active route and
+    derives remaining distance/ETA locally; only re-routes when the driver leaves the
+    corridor, the phase changes or the traffic data goes stale. Once the patient is on
+    board, re-routes cover Driver -> Hospital only.
+    """
+    route = active_routes.get(request_id)
+    if route and route.is_fresh(status):
+        route_info = route.progress(driver_lat, driver_lng)
+        if route_info:
+            active_routes.reused += 1
+            return route_info
     
-    if time_diff > 0:
-        speed_kmh = distance_km / time_diff
-        return speed_kmh
-    return 0
+    active_routes.rerouted += 1
+    if status == 'Patient Received':
+        route_info = calculate_hospital_route_info(driver_lat, driver_lng, hospital_lat, hospital_lng)
+    else:
+        route_info = calculate_route_info(driver_lat, driver_lng, patient_lat, patient_lng, hospital_lat, hospital_lng)
+    active_routes.set(request_id, ActiveRoute(route_info, status))
+    return route_info
 
 # DATABASE HELPER FUNCTIONS
 
-def insert_ambulance_request(user_id, patient_name, contact, pickup_location, destination, ambulance_type, origin_lat, origin_lng, destination_lat, destination_lng):
+def insert_ambulance_request(user_id, patient_name, contact, pickup_location, destination, ambulance_type, origin_lat, origin_lng, destination_lat, destination_lng, tracking_token=None):
     if destination_lat is None or destination_lng is None:
         flash('Destination coordinates are missing.', 'danger')
         return None
     
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO ambulance_requests 
-        (user_id, patient_name, contact, pickup_location, destination, ambulance_type, origin_lat, origin_lng, destination_lat, destination_lng)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, patient_name, contact, pickup_location, destination, ambulance_type, origin_lat, origin_lng, destination_lat, destination_lng))
-    conn.commit()
-    request_id = cursor.lastrowid
-    conn.close()
+    with db.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO ambulance_requests 
+            (user_id, patient_name, contact, pickup_location, destination, ambulance_type, origin_lat, origin_lng, destination_lat, destination_lng, tracking_token)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, patient_name, contact, pickup_location, destination, ambulance_type, origin_lat, origin_lng, destination_lat, destination_lng, tracking_token))
+        request_id = cursor.lastrowid
     return request_id
 
+def set_driver_status(cursor, driver_id, status):
+    """Update a driver's status in the database and in the in-memory index"""
+    if driver_id is None:
+        return
+    cursor.execute('UPDATE drivers SET status = ? WHERE id = ?', (status, driver_id))
+    driver_index.set_status(driver_id, status)
+
+
+def save_route_geometry(cursor, request_id, route_info):
+    """Store the route's segment polylines (encoded) so map pages never re-fetch them"""
+    segment_1 = route_info.get('segment_1') or {}
+    segment_2 = route_info.get('segment_2') or {}
+    if not segment_1.get('coordinates') and not segment_2.get('coordinates'):
+        return
+    
+    cursor.execute('''
+        INSERT OR REPLACE INTO route_geometry
+        (request_id, segment_1, segment_2, segment_1_distance_km, segment_1_duration_minutes,
+         segment_2_distance_km, segment_2_duration_minutes, traffic_aware, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        request_id,
+        Polyline.from_coordinates(segment_1.get('coordinates') or []).simplify(ROUTE_STORE_TOLERANCE_M).encode(),
+        Polyline.from_coordinates(segment_2.get('coordinates') or []).simplify(ROUTE_STORE_TOLERANCE_M).encode(),
+        segment_1.get('distance_km'), segment_1.get('duration_minutes'),
+        segment_2.get('distance_km'), segment_2.get('duration_minutes'),
+        1 if route_info.get('traffic_aware') else 0,
+        datetime.now().isoformat()
+    ))
+
 # MAIN ROUTES
 
 @app.route('/')
@@ -522,14 +703,18 @@ def booking():
         destination_lat, destination_lng = get_coordinates(destination)
 
         if origin_lat and destination_lat:
+            tracking_token = secrets.token_urlsafe(TRACKING_TOKEN_BYTES)
             request_id = insert_ambulance_request(
                 None, patient_name, contact, pickup_location, destination,
-                ambulance_type, origin_lat, origin_lng, destination_lat, destination_lng
+                ambulance_type, origin_lat, origin_lng, destination_lat, destination_lng,
+                tracking_token
             )
 
             if request_id:
-                flash('Ambulance booking request submitted successfully!', 'success')
-                return redirect(url_for('tracking_detail', request_id=request_id))
+                publish_request(request_id, new=True)
+                allow_tracking(request_id, tracking_token)
+                flash('Ambulance booking request submitted successfully! Keep your tracking code to follow the ambulance live.', 'success')
+                return redirect(url_for('tracking_detail', request_id=request_id, token=tracking_token))
         else:
             flash('Unable to geocode addresses. Please check the locations or try again.', 'danger')
         
@@ -539,20 +724,27 @@ def booking():
 def tracking_search():
     if request.method == 'POST':
         request_id = request.form.get('request_id')
+        tracking_token = (request.form.get('tracking_token') or '').strip()
         if request_id:
-            return redirect(url_for('tracking_detail', request_id=request_id))
+            return redirect(url_for('tracking_detail', request_id=request_id, token=tracking_token or None))
     return render_template('tracking_search.html', title='Track Ambulance')
 
 @app.route('/tracking/<int:request_id>')
 def tracking_detail(request_id):
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM ambulance_requests WHERE id = ?', (request_id,))
-    request_data = cursor.fetchone()
-    conn.close()
-    
-    if request_data:
-        return render_template('tracking_result.html', request=request_data, title='Track Ambulance')
+    with db.transaction() as cursor:
+        # The template indexes the row by position, so the access columns ride along at the end
+        cursor.execute('SELECT *, user_id, tracking_token FROM ambulance_requests WHERE id = ?', (request_id,))
+        row = cursor.fetchone()
+    
+    if row:
+        request_data, access = row[:-2], row[-2:]
+        # Only the booking's tracking code (from the booking redirect, a shared link or the search form) unlocks live updates
+        tracking_token = request.args.get('token')
+        if token_matches(access[1], tracking_token):
+            allow_tracking(request_id, tracking_token)
+        live = can_watch_request(request_id, access)
+        return render_template('tracking_result.html', request=request_data, title='Track Ambulance',
+                               live=live, tracking_token=session_tracking_token(request_id) if live else None)
     else:
         flash('Request not found.', 'danger')
         return redirect(url_for('tracking_search'))
@@ -573,11 +765,9 @@ def admin_login_post():
         session['is_main_admin'] = True
         return redirect(url_for('admin_dashboard'))
     
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM admins WHERE username = ?', (username,))
-    admin = cursor.fetchone()
-    conn.close()
+    with db.transaction() as cursor:
+        cursor.execute('SELECT * FROM admins WHERE username = ?', (username,))
+        admin = cursor.fetchone()
     
     if admin and check_password_hash(admin[2], password):
         session['logged_in'] = True
@@ -587,84 +777,297 @@ def admin_login_post():
     flash('Invalid credentials', 'danger')
     return redirect(url_for('admin_login'))
 
+def admin_api(view):
+    """
+    Guard an admin-only JSON endpoint. Only the admin login above sets 'logged_in' (drivers get
+    'driver_logged_in'), so a driver session is refused with 403 and no session at all with 401.
+    """
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        if not session.get('logged_in'):
+            if session.get('driver_logged_in'):
+                return jsonify({'error': 'Admin only'}), 403
+            return jsonify({'error': 'Not logged in'}), 401
+        return view(*args, **kwargs)
+    return guarded
+
+# SOCKET.IO ROOMS
+# Clients join the rooms they care about and every emit is scoped to a room, so fan-out grows
+# with interested viewers rather than connections x ambulances:
+#   request:<id>     tracking and navigation pages for one request (location, status, dispatch)
+#   driver:<id>      a driver's own dashboard (trips auto-dispatch assigns to them)
+#   region:<i>:<j>   driver dashboards over a REGION_CELL_DEG grid cell (new and changed requests)
+#   admins           the admin dashboard
+# Joins are authorized from the Flask session, which the Socket.IO connection carries.
+
+ADMINS_ROOM = 'admins'
+
+
+def request_room(request_id):
+    return f'request:{request_id}'
+
+
+def driver_room(driver_id):
+    return f'driver:{driver_id}'
+
+
+def region_room(lat, lng):
+    return f'region:{math.floor(lat / REGION_CELL_DEG)}:{math.floor(lng / REGION_CELL_DEG)}'
+
+
+def region_rooms(lat, lng, radius_km):
+    """Rooms of every grid cell overlapping the radius around a point"""
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    return [f'region:{i}:{j}'
+            for i in range(math.floor(min_lat / REGION_CELL_DEG), math.floor(max_lat / REGION_CELL_DEG) + 1)
+            for j in range(math.floor(min_lng / REGION_CELL_DEG), math.floor(max_lng / REGION_CELL_DEG) + 1)]
+
+
+def token_matches(stored, given):
+    return bool(stored) and isinstance(given, str) and hmac.compare_digest(stored, given)
+
+
+def allow_tracking(request_id, tracking_token):
+    """Let this browser session watch a request live (it has shown the request's tracking code)"""
+    watched = [entry for entry in session.get('tracking', [])
+               if isinstance(entry, list) and entry[0] != request_id]
+    session['tracking'] = watched[-(TRACKING_SESSION_MAX - 1):] + [[request_id, tracking_token]]
+
+
+def session_tracking_token(request_id):
+    for entry in session.get('tracking', []):
+        if isinstance(entry, list) and entry[0] == request_id:
+            return entry[1]
+    return None
+
+
+def can_watch_request(request_id, access=None):
+    """Admins, the assigned driver and holders of the tracking code; `access` is the request's (user_id, tracking_token) if already read"""
+    if session.get('logged_in'):
+        return True
+    tracking_token = session_tracking_token(request_id)
+    driver_id = session.get('driver_id')
+    if tracking_token is None and driver_id is None:
+        return False
+    if access is None:
+        with db.transaction() as cursor:
+            cursor.execute('SELECT user_id, tracking_token FROM ambulance_requests WHERE id = ?', (request_id,))
+            access = cursor.fetchone()
+    if access is None:
+        return False
+    return (driver_id is not None and access[0] == driver_id) or token_matches(access[1], tracking_token)
+
+
+def room_request_id(data):
+    try:
+        return int((data or {}).get('request_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+@socketio.on('join_request')
+def handle_join_request(data):
+    request_id = room_request_id(data)
+    if request_id is None or not can_watch_request(request_id):
+        return {'joined': False}
+    join_room(request_room(request_id))
+    return {'joined': True}
+
+
+@socketio.on('leave_request')
+def handle_leave_request(data):
+    request_id = room_request_id(data)
+    if request_id is not None:
+        leave_room(request_room(request_id))
+    return {'left': request_id is not None}
+
+
+@socketio.on('join_region')
+def handle_join_region(data=None):
+    """Drivers join the cells around their pinned position; admins may name a point and radius"""
+    data = data or {}
+    if session.get('logged_in'):
+        try:
+            lat, lng = float(data['lat']), float(data['lng'])
+            radius_km = min(float(data.get('radius_km', DASHBOARD_RADIUS_KM)), DASHBOARD_RADIUS_KM)
+        except (KeyError, TypeError, ValueError):
+            return {'joined': False}
+    elif session.get('driver_logged_in') and session.get('driver_lat') is not None:
+        lat, lng, radius_km = session['driver_lat'], session['driver_lng'], DASHBOARD_RADIUS_KM
+    else:
+        return {'joined': False}
+    handle_leave_region()
+    cells = region_rooms(lat, lng, radius_km)[:REGION_MAX_ROOMS]
+    for room in cells:
+        join_room(room)
+    return {'joined': True, 'rooms': len(cells)}
+
+
+@socketio.on('leave_region')
+def handle_leave_region():
+    for room in rooms():
+        if room.startswith('region:'):
+            leave_room(room)
+    return {'left': True}
+
+
+@socketio.on('join_driver')
+def handle_join_driver():
+    """A logged-in driver's own room, where auto-dispatch announces their assignments"""
+    if not session.get('driver_logged_in') or session.get('driver_id') is None:
+        return {'joined': False}
+    join_room(driver_room(session['driver_id']))
+    return {'joined': True}
+
+
+@socketio.on('join_admins')
+def handle_join_admins():
+    """Subscribe an admin dashboard to pushes; the Socket.IO session carries the Flask login"""
+    if not session.get('logged_in'):
+        return {'joined': False}
+    join_room(ADMINS_ROOM)
+    return {'joined': True}
+
+
+@socketio.on('leave_admins')
+def handle_leave_admins():
+    leave_room(ADMINS_ROOM)
+    return {'left': True}
+
+
+@app.route('/api/socket/rooms')
+@admin_api
+def api_socket_rooms():
+    """Rooms and subscribers in this process, by kind (admin only)"""
+    stats = {}
+    for room, members in socketio.server.manager.rooms.get('/', {}).items():
+        if room is None or not isinstance(room, str) or room in members:
+            continue  # the per-connection rooms every socket is in
+        kind = stats.setdefault(room.split(':')[0], {'rooms': 0, 'members': 0})
+        kind['rooms'] += 1
+        kind['members'] += len(members)
+    return jsonify(stats)
+
+
+# ADMIN DASHBOARD PUSH
+# The dashboard page renders once from a snapshot; after that every change a handler commits is
+# pushed to the 'admins' Socket.IO room (full row on status/assignment changes, a small position
+# event at most every ADMIN_POSITION_PUSH_INTERVAL per request) instead of the page reloading.
+
+ADMIN_ROW_QUERY = '''
+    SELECT ar.id, ar.patient_name, ar.contact, ar.pickup_location, ar.destination, ar.status,
+           ar.origin_lat, ar.origin_lng,
+           ar.route_distance_km, ar.route_duration_minutes, ar.traffic_delay_minutes,
+           d.id AS driver_id, d.name AS driver_name
+    FROM ambulance_requests ar
+    LEFT JOIN drivers d ON ar.user_id = d.id
+'''
+
+admin_position_pushed = {}  # request_id -> monotonic time of the last admin_position push
+admin_push_lock = threading.Lock()
+
+
+def dashboard_bucket(status):
+    """Stat card a request status counts towards: new, started, received, reached (or the status itself)"""
+    if not status:
+        return 'new'
+    value = str(status).lower().replace('_', ' ').replace('-', ' ').replace('.', '').strip()
+    if value in ('new', 'pending', 'queue', 'waiting', 'unknown', ''):
+        return 'new'
+    if value in ('started', 'in progress', 'on the way', 'en route'):
+        return 'started'
+    if value in ('patient received', 'received'):
+        return 'received'
+    if value in ('patient reached', 'reached', 'completed', 'done'):
+        return 'reached'
+    return value
+
+
+def admin_rows(cursor, request_id=None):
+    """Dashboard rows as dicts, newest first: one request, or the newest ADMIN_DASHBOARD_ROWS"""
+    if request_id is None:
+        cursor.execute(ADMIN_ROW_QUERY + ' ORDER BY ar.id DESC LIMIT ?', (ADMIN_DASHBOARD_ROWS,))
+    else:
+        cursor.execute(ADMIN_ROW_QUERY + ' WHERE ar.id = ?', (request_id,))
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    for row in rows:
+        row['bucket'] = dashboard_bucket(row['status'])
+    return rows
+
+
+def admin_counts(cursor):
+    """Stat card totals over every request (not just the rendered rows)"""
+    counts = {'total': 0, 'new': 0, 'started': 0, 'received': 0, 'reached': 0}
+    cursor.execute('SELECT status, COUNT(*) FROM ambulance_requests GROUP BY status')
+    for status, count in cursor.fetchall():
+        counts['total'] += count
+        bucket = dashboard_bucket(status)
+        if bucket in counts:
+            counts[bucket] += count
+    return counts
+
+
+def admin_snapshot():
+    with db.transaction() as cursor:
+        return {'requests': admin_rows(cursor), 'counts': admin_counts(cursor), 'limit': ADMIN_DASHBOARD_ROWS}
+
+
+def publish_request(request_id, new=False):
+    """
+    Announce a committed booking, status change or assignment: the row and stat counts to admins,
+    and new_request / status_update to the request's watchers and its pickup region.
+    """
+    with db.transaction() as cursor:
+        rows = admin_rows(cursor, request_id)
+        counts = admin_counts(cursor)
+    if not rows:
+        return
+    row = rows[0]
+    if row['bucket'] == 'reached':
+        with admin_push_lock:
+            admin_position_pushed.pop(request_id, None)
+    socketio.emit('admin_request', {'request': row, 'counts': counts}, to=ADMINS_ROOM)
+
+    update = {'ambulance_id': request_id, 'status': row['status'], 'driver_id': row['driver_id']}
+    region = None
+    if row['origin_lat'] is not None and row['origin_lng'] is not None:
+        region = region_room(row['origin_lat'], row['origin_lng'])
+    if new:
+        if region:
+            socketio.emit('new_request', dict(update, latitude=row['origin_lat'], longitude=row['origin_lng']), to=region)
+    else:
+        socketio.emit('status_update', update, to=[request_room(request_id), region] if region else request_room(request_id))
+
+
+def push_admin_position(request_id, driver_lat, driver_lng, route_distance_km=None, route_duration_minutes=None):
+    """Push a driver position to admins, throttled per request so 1 Hz pings don't flood the dashboard"""
+    now = time.monotonic()
+    with admin_push_lock:
+        if now - admin_position_pushed.get(request_id, float('-inf')) < ADMIN_POSITION_PUSH_INTERVAL:
+            return
+        admin_position_pushed[request_id] = now
+    socketio.emit('admin_position', {
+        'id': request_id,
+        'driver_lat': driver_lat,
+        'driver_lng': driver_lng,
+        'route_distance_km': route_distance_km,
+        'route_duration_minutes': route_duration_minutes,
+    }, to=ADMINS_ROOM)
+
+
 @app.route('/admin/dashboard')
 def admin_dashboard():
     if not session.get('logged_in'):
         return redirect(url_for('admin_login'))
+    return render_template('admin_dashboard.html', snapshot=admin_snapshot(), title='Admin Dashboard')
 
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    
-    # Get all requests with driver information using LEFT JOIN
-    cursor.execute('''
-        SELECT 
-            ar.*,
-            d.id as driver_id,
-            d.name as driver_name,
-            d.phone as driver_phone,
-            d.current_lat as driver_lat,
-            d.current_lng as driver_lng,
-            d.status as driver_status
-        FROM ambulance_requests ar
-        LEFT JOIN drivers d ON ar.user_id = d.id
-        ORDER BY ar.id DESC
-    ''')
-    all_requests = cursor.fetchall()
-    conn.close()
-    
-    #  DEBUG: Print to verify column index
-    if all_requests:
-        print("=" * 60)
-        print("DEBUG: Admin Dashboard Column Info")
-        print("=" * 60)
-        print(f"Total columns: {len(all_requests[0])}")
-        print(f"Sample request ID: {all_requests[0][0]}")
-        
-        # Print all column values for first request
-        for idx, val in enumerate(all_requests[0]):
-            print(f"  Index [{idx}]: {val}")
-        
-        # Check traffic delay column
-        if len(all_requests[0]) > 22:
-            print(f"\n Traffic delay (index 22): {all_requests[0][22]}")
-        else:
-            print(f"\n Traffic delay column not found! Only {len(all_requests[0])} columns")
-        print("=" * 60)
-    
-    # Helper function to normalize status values
-    def norm(val):
-        if not val:
-            return "unknown"
-        v = str(val).lower().strip().replace("_", " ").replace("-", " ").replace(".", "")
-        v = v.strip()
-        if v in ["pending", "queue", "waiting", "unknown", ""]:
-            return "new"
-        if v == "new":
-            return "new"
-        if v in ["started", "in progress", "on the way", "en route"]:
-            return "started"
-        if v in ["patient received", "received"]:
-            return "patient received"
-        if v in ["patient reached", "reached", "completed", "done"]:
-            return "patient reached"
-        return v
-    
-    # Filter requests by status (using original column index)
-    new_requests = [r for r in all_requests if norm(r[11]) == 'new']
-    on_the_way = [r for r in all_requests if norm(r[11]) == 'started']
-    patient_received = [r for r in all_requests if norm(r[11]) == 'patient received']
-    patient_reached = [r for r in all_requests if norm(r[11]) == 'patient reached']
-    
-    return render_template(
-        'admin_dashboard.html',
-        all_requests=all_requests,
-        new_requests=new_requests,
-        on_the_way=on_the_way,
-        patient_received=patient_received,
-        patient_reached=patient_reached,
-        requests=all_requests,
-        title='Admin Dashboard'
-    )
+
+@app.route('/api/admin/dashboard')
+@admin_api
+def api_admin_dashboard():
+    """Current dashboard snapshot, for a page catching up after a dropped socket (admin only)"""
+    return jsonify(admin_snapshot())
 
 
 @app.route('/admin/logout')
@@ -678,11 +1081,9 @@ def update_status(req_id):
         return redirect(url_for('admin_login'))
     new_status = request.form.get('status')
     new_status = new_status.strip()
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE ambulance_requests SET status = ? WHERE id = ?', (new_status, req_id))
-    conn.commit()
-    conn.close()
+    with db.transaction() as cursor:
+        cursor.execute('UPDATE ambulance_requests SET status = ? WHERE id = ?', (new_status, req_id))
+    publish_request(req_id)
     flash(f'Status updated to {new_status} for request {req_id}', 'success')
     return redirect(url_for('admin_dashboard'))
 
@@ -707,18 +1108,17 @@ def update_driver_location(req_id):
         return redirect(url_for('admin_dashboard'))
     
     # Get patient and hospital locations
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT origin_lat, origin_lng, destination_lat, destination_lng 
-        FROM ambulance_requests WHERE id = ?
-    ''', (req_id,))
-    result = cursor.fetchone()
+    with db.transaction() as cursor:
+        cursor.execute('''
+            SELECT origin_lat, origin_lng, destination_lat, destination_lng 
+            FROM ambulance_requests WHERE id = ?
+        ''', (req_id,))
+        result = cursor.fetchone()
     
     if result:
         patient_lat, patient_lng, hospital_lat, hospital_lng = result
         
-        # Calculate route info with LIVE TRAFFIC
+        # Calculate route info with LIVE TRAFFIC (no connection held during provider calls)
         route_info = calculate_route_info(
             driver_lat, driver_lng,
             patient_lat, patient_lng,
@@ -726,23 +1126,22 @@ def update_driver_location(req_id):
         )
         
         # Update database
-        cursor.execute('''
-            UPDATE ambulance_requests 
-            SET driver_lat = ?, driver_lng = ?, 
-                route_distance_km = ?, route_duration_minutes = ?
-            WHERE id = ?
-        ''', (driver_lat, driver_lng, 
-              route_info['total_distance_km'], 
-              route_info['total_duration_minutes'], 
-              req_id))
-        
-        conn.commit()
-        conn.close()
+        with db.transaction() as cursor:
+            save_route_geometry(cursor, req_id, route_info)
+            cursor.execute('''
+                UPDATE ambulance_requests 
+                SET driver_lat = ?, driver_lng = ?, 
+                    route_distance_km = ?, route_duration_minutes = ?
+                WHERE id = ?
+            ''', (driver_lat, driver_lng, 
+                  route_info['total_distance_km'], 
+                  route_info['total_duration_minutes'], 
+                  req_id))
+        publish_request(req_id)
         
         traffic_info = f" (Traffic delay: {route_info.get('traffic_delay_minutes', 0):.1f} min)" if route_info.get('traffic_aware') else ""
         flash(f' Driver location updated! Total route: {route_info["total_distance_km"]} km, ETA: {route_info["total_duration_minutes"]:.0f} minutes{traffic_info}', 'success')
     else:
-        conn.close()
         flash('Request not found', 'danger')
     
     return redirect(url_for('admin_dashboard'))
@@ -750,11 +1149,9 @@ def update_driver_location(req_id):
 @app.route('/view_route/<int:request_id>')
 def view_route(request_id):
     """Display interactive map with driver, patient, and hospital locations"""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM ambulance_requests WHERE id = ?', (request_id,))
-    request_data = cursor.fetchone()
-    conn.close()
+    with db.transaction() as cursor:
+        cursor.execute('SELECT * FROM ambulance_requests WHERE id = ?', (request_id,))
+        request_data = cursor.fetchone()
     
     if request_data:
         # Convert tuple to list to allow modifications
@@ -794,22 +1191,79 @@ def contact_admin():
 
 # API ROUTES
 
+def simplify_encoded(encoded, zoom):
+    """Re-simplify a stored polyline to roughly one pixel of error at the given zoom"""
+    polyline = Polyline.decode(encoded or '')
+    if len(polyline) < 3:
+        return encoded
+    return polyline.simplify(tolerance_for_zoom(max(0, min(zoom, 22)), polyline[0][0])).encode()
+
+@app.route('/api/route/<int:request_id>')
+def api_route_geometry(request_id):
+    """
+    Stored route geometry (encoded polylines) for map pages, with ETag revalidation.
+    Optional ?zoom=<0-22> simplifies the polylines for that map zoom level.
+    """
+    zoom = request.args.get('zoom', type=int)
+    
+    with db.transaction() as cursor:
+        cursor.execute('''
+            SELECT segment_1, segment_2, segment_1_distance_km, segment_1_duration_minutes,
+                   segment_2_distance_km, segment_2_duration_minutes, traffic_aware, updated_at
+            FROM route_geometry WHERE request_id = ?
+        ''', (request_id,))
+        row = cursor.fetchone()
+    
+    if not row:
+        return jsonify({'error': 'No route stored for this request'}), 404
+    
+    segment_1, segment_2, seg1_km, seg1_min, seg2_km, seg2_min, traffic_aware, updated_at = row
+    etag = hashlib.sha1(f"{request_id}:{updated_at}:{zoom}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if zoom is not None:
+            segment_1 = simplify_encoded(segment_1, zoom)
+            segment_2 = simplify_encoded(segment_2, zoom)
+        response = jsonify({
+            'request_id': request_id,
+            'encoding': 'polyline5',
+            'traffic_aware': bool(traffic_aware),
+            'updated_at': updated_at,
+            'segment_1': {'polyline': segment_1, 'distance_km': seg1_km, 'duration_minutes': seg1_min},
+            'segment_2': {'polyline': segment_2, 'distance_km': seg2_km, 'duration_minutes': seg2_min}
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/api/ambulance_location/<int:ambulance_id>')
 def get_ambulance_location(ambulance_id):
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT al.latitude, al.longitude, al.status, ar.patient_name, 
-                   ar.pickup_lat, ar.pickup_lng, ar.destination_lat, ar.destination_lng,
-                   ar.driver_lat, ar.driver_lng
-            FROM ambulance_locations al
-            JOIN ambulance_requests ar ON al.ambulance_id = ar.id
-            WHERE al.ambulance_id = ?
-            ORDER BY al.timestamp DESC LIMIT 1
-        ''', (ambulance_id,))
-        data = cursor.fetchone()
-        conn.close()
+        with db.transaction() as cursor:
+            cursor.execute('''
+                SELECT al.latitude, al.longitude, al.status, ar.patient_name, 
+                       ar.pickup_lat, ar.pickup_lng, ar.destination_lat, ar.destination_lng,
+                       ar.driver_lat, ar.driver_lng
+                FROM ambulance_locations al
+                JOIN ambulance_requests ar ON al.ambulance_id = ar.id
+                WHERE al.ambulance_id = ?
+                ORDER BY al.timestamp DESC LIMIT 1
+            ''', (ambulance_id,))
+            data = cursor.fetchone()
+            if not data:
+                # Archived trips only exist in trip_tracks; their last point is the final position
+                track, _ = trajectories.stored(cursor, ambulance_id)
+                if track is not None and len(track):
+                    cursor.execute('''
+                        SELECT patient_name, pickup_lat, pickup_lng, destination_lat, destination_lng,
+                               driver_lat, driver_lng
+                        FROM ambulance_requests WHERE id = ?
+                    ''', (ambulance_id,))
+                    request_row = cursor.fetchone()
+                    if request_row:
+                        data = (float(track.lats[-1]), float(track.lngs[-1]),
+                                track.statuses[track.codes[-1]]) + tuple(request_row)
         
         if data:
             latitude, longitude, status, patient_name, pickup_lat, pickup_lng, destination_lat, destination_lng, driver_lat, driver_lng = data
@@ -830,6 +1284,56 @@ def get_ambulance_location(ambulance_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/trips/<int:request_id>/track')
+@admin_api
+def api_trip_track(request_id):
+    """
+    Replay one trip's GPS track (admin only): stored columns plus any live rows not stored yet.
+    ?format=json (columns, default) | csv | geojson | binary (the columnar blob, see trajectory.Track.decode),
+    optional ?from=&to= window in epoch milliseconds.
+    """
+    output = request.args.get('format', 'json')
+    if output not in ('json', 'csv', 'geojson', 'binary'):
+        return jsonify({'error': 'format must be json, csv, geojson or binary'}), 400
+
+    track = trajectories.get(request_id)
+    if track is None:
+        return jsonify({'error': 'No track recorded for this request'}), 404
+    track = track.window(request.args.get('from', type=int), request.args.get('to', type=int))
+
+    if output == 'binary':
+        return Response(track.encode(), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment;filename=trip_{request_id}.trk'})
+    if output == 'csv':
+        return Response(csv_chunks([(request_id, track)]), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment;filename=trip_{request_id}.csv'})
+    if output == 'geojson':
+        return jsonify(geojson_feature(request_id, track))
+    return jsonify({'request_id': request_id, **track.to_columns()})
+
+@app.route('/api/trips/export')
+@admin_api
+def api_trips_export():
+    """
+    Stream stored trip tracks for audits and analytics (admin only).
+    ?format=ndjson (one line of columns per trip, default) | csv; pick trips with ?ids=1,2,3
+    or by start time with ?since=&until= (ISO). Tracks are read in batches as the response streams.
+    """
+    output = request.args.get('format', 'ndjson')
+    if output not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    try:
+        ids = request.args.get('ids')
+        request_ids = [int(i) for i in ids.split(',') if i.strip()] if ids else None
+    except ValueError:
+        return jsonify({'error': 'ids must be comma-separated integers'}), 400
+
+    tracks = trajectories.iter_tracks(request_ids, request.args.get('since'), request.args.get('until'))
+    if output == 'csv':
+        return Response(csv_chunks(tracks), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment;filename=trip_tracks.csv'})
+    return Response(ndjson_chunks(tracks), mimetype='application/x-ndjson')
+
 
 
 @app.route('/download_pdf/<int:req_id>')
@@ -837,11 +1341,9 @@ def download_pdf(req_id):
     if not session.get('logged_in'):
         return redirect(url_for('admin_login'))
     
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM ambulance_requests WHERE id = ?', (req_id,))
-    request_data = cursor.fetchone()
-    conn.close()
+    with db.transaction() as cursor:
+        cursor.execute('SELECT * FROM ambulance_requests WHERE id = ?', (req_id,))
+        request_data = cursor.fetchone()
     
     if not request_data:
         flash('Request not found', 'danger')
@@ -901,48 +1403,71 @@ def download_pdf(req_id):
 
 # SOCKETIO EVENTS
 
-@socketio.on('update_location')
-def handle_location_update(data):
-    ambulance_id = data.get('ambulance_id')
-    latitude = data.get('latitude')
-    longitude = data.get('longitude')
-    
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE ambulance_locations 
-        SET latitude = ?, longitude = ?, last_updated = ? 
-        WHERE ambulance_id = ?
-    ''', (latitude, longitude, datetime.now(), ambulance_id))
-    conn.commit()
-    
-    # Calculate distance and ETA
-    cursor.execute('SELECT destination_lat, destination_lng FROM ambulance_requests WHERE id = ?', (ambulance_id,))
-    destination = cursor.fetchone()
+def process_ambulance_fix(ambulance_id, data):
+    """Full handling of one update_location fix: smoothing, live position, arrival, ETA and room emits"""
+    # Smooth the raw fix; distance checks and ETA below use the filtered position
+    fix = gps_filter.update(ambulance_id, data.get('latitude'), data.get('longitude'),
+                            gps_timestamp(data), data.get('accuracy'))
+    latitude = fix['lat']
+    longitude = fix['lng']
+    
+    # Write first and emit after the commit, so listeners never see uncommitted state
+    reached = False
+    with db.transaction() as cursor:
+        # Calculate distance and ETA
+        cursor.execute('SELECT destination_lat, destination_lng, status FROM ambulance_requests WHERE id = ?', (ambulance_id,))
+        destination = cursor.fetchone()
+        
+        if destination:
+            dest_lat, dest_lng, status = destination
+            distance_km = haversine(latitude, longitude, dest_lat, dest_lng)
+            
+            if distance_km < 0.2:  # Within 200 meters
+                cursor.execute('UPDATE ambulance_requests SET status = ? WHERE id = ?', ('Patient Reached', ambulance_id))
+                reached = True
     
     if destination:
-        dest_lat, dest_lng = destination
-        distance_km = haversine(latitude, longitude, dest_lat, dest_lng)
-        
-        if distance_km < 0.2:  # Within 200 meters
-            cursor.execute('UPDATE ambulance_requests SET status = ? WHERE id = ?', ('Patient Reached', ambulance_id))
-            conn.commit()
-            emit('status_update', {'ambulance_id': ambulance_id, 'status': 'Patient Reached'}, broadcast=True)
+        # Each fix is a new history row; the newest row is the live position
+        location_writer.add_history(ambulance_id, latitude, longitude, datetime.now().isoformat(), status)
+        if reached:
+            gps_filter.drop(ambulance_id)
+            gps_ingest.drop(ambulance_id)
+            publish_request(ambulance_id)
+        else:
+            push_admin_position(ambulance_id, latitude, longitude)
         
-        # Calculate ETA (assuming average speed of 60 km/h)
-        speed_kmh = 60
-        eta_minutes = (distance_km / speed_kmh) * 60
+        # ETA from the observed speeds along the way for this hour of the week
+        eta_minutes = speed_profiles.segment_minutes(latitude, longitude, dest_lat, dest_lng, distance_km)
         
-        emit('location_update', {
+        socketio.emit('location_update', {
             'ambulance_id': ambulance_id,
             'latitude': latitude,
             'longitude': longitude,
             'distance_km': round(distance_km, 2),
-            'eta_minutes': round(eta_minutes, 2)
-        }, broadcast=True)
-    
-    conn.close()
+            'eta_minutes': round(eta_minutes, 2),
+            'speed_kmh': fix['speed_kmh'],
+            'heading': fix['heading']
+        }, to=request_room(ambulance_id))
+
+
+@socketio.on('update_location')
+def handle_location_update(data):
+    # Same ids as the HTTP path (int), so both share one ingest slot and Kalman track per ambulance
+    try:
+        ambulance_id = int(data['ambulance_id'])
+        latitude, longitude = float(data['latitude']), float(data['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return {'status': 'invalid'}
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return {'status': 'invalid'}
+    data = dict(data, ambulance_id=ambulance_id, latitude=latitude, longitude=longitude)
+    
+    # Coalesced per ambulance and rate limited per connection before any of the work above
+    outcome = gps_ingest.submit(ambulance_id, f'sid:{request.sid}', latitude, longitude,
+                                process_ambulance_fix, data)
+    if outcome == PROCESS:
+        process_ambulance_fix(ambulance_id, data)
+    return {'status': outcome}
 
 @app.route('/admin/simulate_movement/<int:ambulance_id>')
 def simulate_movement(ambulance_id):
@@ -950,10 +1475,9 @@ def simulate_movement(ambulance_id):
         return redirect(url_for('admin_login'))
     
     # Get current request details
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT origin_lat, origin_lng, destination_lat, destination_lng FROM ambulance_requests WHERE id = ?', (ambulance_id,))
-    request_data = cursor.fetchone()
+    with db.transaction() as cursor:
+        cursor.execute('SELECT origin_lat, origin_lng, destination_lat, destination_lng FROM ambulance_requests WHERE id = ?', (ambulance_id,))
+        request_data = cursor.fetchone()
     
     if request_data:
         start_lat, start_lng, end_lat, end_lng = request_data
@@ -964,15 +1488,9 @@ def simulate_movement(ambulance_id):
             sim_lat = start_lat + (end_lat - start_lat) * progress + random.uniform(-0.001, 0.001)
             sim_lng = start_lng + (end_lng - start_lng) * progress + random.uniform(-0.001, 0.001)
             
-            cursor.execute('''
-                INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (ambulance_id, sim_lat, sim_lng, datetime.now().isoformat(), 'En Route'))
-            
-            conn.commit()
+            location_writer.add_history(ambulance_id, sim_lat, sim_lng, datetime.now().isoformat(), 'En Route')
             time.sleep(2)  # Wait 2 seconds between updates
         
-        conn.close()
         flash('Movement simulation completed!', 'success')
     
     return redirect(url_for('admin_dashboard'))
@@ -992,34 +1510,30 @@ def driver_login():
         driver_lng = request.form.get('driver_lng')
         
         if driver_name and driver_phone and driver_lat and driver_lng:
-            conn = sqlite3.connect('users.db')
-            cursor = conn.cursor()
-            
-            # Check if driver exists by phone
-            cursor.execute('SELECT id FROM drivers WHERE phone = ?', (driver_phone,))
-            existing_driver = cursor.fetchone()
-            
-            if existing_driver:
-                # Update existing driver location and login time
-                driver_id = existing_driver[0]
-                cursor.execute('''
-                    UPDATE drivers 
-                    SET name = ?, current_lat = ?, current_lng = ?, 
-                        last_login = ?, status = 'Available'
-                    WHERE id = ?
-                ''', (driver_name, float(driver_lat), float(driver_lng), 
-                      datetime.now().isoformat(), driver_id))
-            else:
-                # Create new driver record
-                cursor.execute('''
-                    INSERT INTO drivers (name, phone, current_lat, current_lng, last_login, status)
-                    VALUES (?, ?, ?, ?, ?, 'Available')
-                ''', (driver_name, driver_phone, float(driver_lat), float(driver_lng), 
-                      datetime.now().isoformat()))
-                driver_id = cursor.lastrowid
-            
-            conn.commit()
-            conn.close()
+            with db.transaction() as cursor:
+                # Check if driver exists by phone
+                cursor.execute('SELECT id FROM drivers WHERE phone = ?', (driver_phone,))
+                existing_driver = cursor.fetchone()
+                
+                if existing_driver:
+                    # Update existing driver location and login time
+                    driver_id = existing_driver[0]
+                    cursor.execute('''
+                        UPDATE drivers 
+                        SET name = ?, current_lat = ?, current_lng = ?, 
+                            last_login = ?, status = 'Available'
+                        WHERE id = ?
+                    ''', (driver_name, float(driver_lat), float(driver_lng), 
+                          datetime.now().isoformat(), driver_id))
+                else:
+                    # Create new driver record
+                    cursor.execute('''
+                        INSERT INTO drivers (name, phone, current_lat, current_lng, last_login, status)
+                        VALUES (?, ?, ?, ?, ?, 'Available')
+                    ''', (driver_name, driver_phone, float(driver_lat), float(driver_lng), 
+                          datetime.now().isoformat()))
+                    driver_id = cursor.lastrowid
+            driver_index.upsert(driver_id, float(driver_lat), float(driver_lng), 'Available')
             
             # Store in session
             session['driver_logged_in'] = True
@@ -1039,45 +1553,48 @@ def driver_login():
 
 @app.route('/driver/dashboard')
 def driver_dashboard():
-    """Show all pending/assigned requests for driver - SORTED BY DISTANCE"""
+    """Show the nearest pending/assigned requests for driver - SORTED BY DISTANCE"""
     if not session.get('driver_logged_in'):
         return redirect(url_for('driver_login'))
     
     driver_lat = session.get('driver_lat')
     driver_lng = session.get('driver_lng')
     
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
+    with db.transaction() as cursor:
+        if driver_lat and driver_lng:
+            # Only load requests inside a bounding box around the driver (plus any without coordinates)
+            min_lat, max_lat, min_lng, max_lng = bounding_box(driver_lat, driver_lng, DASHBOARD_RADIUS_KM)
+            cursor.execute('''
+                SELECT * FROM ambulance_requests 
+                WHERE status IN ('Pending', 'Started', 'Patient Received')
+                  AND ((origin_lat BETWEEN ? AND ? AND origin_lng BETWEEN ? AND ?)
+                       OR origin_lat IS NULL OR origin_lng IS NULL)
+                ORDER BY id DESC
+            ''', (min_lat, max_lat, min_lng, max_lng))
+        else:
+            # Get all requests that need drivers
+            cursor.execute('''
+                SELECT * FROM ambulance_requests 
+                WHERE status IN ('Pending', 'Started', 'Patient Received')
+                ORDER BY id DESC
+            ''')
+        available_requests = cursor.fetchall()
     
-    # Get all requests that need drivers
-    cursor.execute('''
-        SELECT * FROM ambulance_requests 
-        WHERE status IN ('Pending', 'Started', 'Patient Received')
-        ORDER BY id DESC
-    ''')
-    available_requests = cursor.fetchall()
-    conn.close()
-    
-    # Calculate distance and sort by nearest
+    # Calculate distance and keep the nearest requests
     if driver_lat and driver_lng:
-        requests_with_distance = []
-        for req in available_requests:
-            patient_lat = req[7]  # origin_lat (pickup location)
-            patient_lng = req[8]  # origin_lng
-            
-            if patient_lat and patient_lng:
-                # Calculate distance using Haversine
-                distance_km = haversine(driver_lat, driver_lng, patient_lat, patient_lng)
-                requests_with_distance.append((req, distance_km))
-            else:
-                requests_with_distance.append((req, 999))  # Unknown distance goes to end
+        patient_lats = np.array([req[7] if req[7] else np.nan for req in available_requests], dtype=np.float64)  # origin_lat
+        patient_lngs = np.array([req[8] if req[8] else np.nan for req in available_requests], dtype=np.float64)  # origin_lng
         
-        # Sort by distance (nearest first)
-        requests_with_distance.sort(key=lambda x: x[1])
+        # Vectorized Haversine over all candidates at once
+        all_distances = haversine_np(driver_lat, driver_lng, patient_lats, patient_lngs)
+        unknown = np.isnan(all_distances)
+        all_distances[~unknown & (all_distances > DASHBOARD_RADIUS_KM)] = np.inf  # Box corners outside the radius
+        all_distances[unknown] = 999  # Unknown distance goes to end
         
-        # Extract just the request data
-        available_requests = [req[0] for req in requests_with_distance]
-        distances = [req[1] for req in requests_with_distance]
+        # Top-k nearest without sorting the whole list
+        nearest = nearest_k(all_distances, min(DASHBOARD_MAX_REQUESTS, int(np.isfinite(all_distances).sum())))
+        available_requests = [available_requests[i] for i in nearest]
+        distances = [float(all_distances[i]) for i in nearest]
     else:
         distances = [None] * len(available_requests)
     
@@ -1091,12 +1608,9 @@ def driver_dashboard():
 def api_get_driver_initial_location(driver_id):
     """Get driver's pinned location (not GPS-tracked location)"""
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT current_lat, current_lng FROM drivers WHERE id = ?', (driver_id,))
-        result = cursor.fetchone()
-        conn.close()
+        with db.transaction() as cursor:
+            cursor.execute('SELECT current_lat, current_lng FROM drivers WHERE id = ?', (driver_id,))
+            result = cursor.fetchone()
         
         if result:
             return jsonify({
@@ -1118,36 +1632,36 @@ def driver_accept_request(request_id):
     driver_lat = session.get('driver_lat')
     driver_lng = session.get('driver_lng')
     
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT origin_lat, origin_lng, destination_lat, destination_lng FROM ambulance_requests WHERE id = ?', (request_id,))
-    result = cursor.fetchone()
+    with db.transaction() as cursor:
+        cursor.execute('SELECT origin_lat, origin_lng, destination_lat, destination_lng FROM ambulance_requests WHERE id = ?', (request_id,))
+        result = cursor.fetchone()
     
     if result:
         patient_lat, patient_lng, hospital_lat, hospital_lng = result
         
         # Calculate route with TRAFFIC
         route_info = calculate_route_info(driver_lat, driver_lng, patient_lat, patient_lng, hospital_lat, hospital_lng)
+        active_routes.set(request_id, ActiveRoute(route_info, 'Started'))
         
         #  SAVE TRAFFIC DELAY TO DATABASE
         traffic_delay = route_info.get('traffic_delay_minutes', 0)
         
-        cursor.execute('''
-            UPDATE ambulance_requests 
-            SET driver_lat = ?, driver_lng = ?, 
-                route_distance_km = ?, route_duration_minutes = ?,
-                status = 'Started', user_id = ?
-            WHERE id = ?
-        ''', (
-            driver_lat, driver_lng,
-            route_info.get('total_distance_km', 0),
-            route_info.get('total_duration_minutes', 0),
-            driver_id, request_id
-        ))
-        
-        conn.commit()
-        conn.close()
+        with db.transaction() as cursor:
+            save_route_geometry(cursor, request_id, route_info)
+            cursor.execute('''
+                UPDATE ambulance_requests 
+                SET driver_lat = ?, driver_lng = ?, 
+                    route_distance_km = ?, route_duration_minutes = ?,
+                    status = 'Started', user_id = ?
+                WHERE id = ?
+            ''', (
+                driver_lat, driver_lng,
+                route_info.get('total_distance_km', 0),
+                route_info.get('total_duration_minutes', 0),
+                driver_id, request_id
+            ))
+            set_driver_status(cursor, driver_id, 'On Trip')
+        publish_request(request_id)
         
         # Flash message with traffic info
         if traffic_delay > 0:
@@ -1164,11 +1678,9 @@ def driver_navigate(request_id):
     if not session.get('driver_logged_in'):
         return redirect(url_for('driver_login'))
     
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM ambulance_requests WHERE id = ?', (request_id,))
-    request_data = cursor.fetchone()
-    conn.close()
+    with db.transaction() as cursor:
+        cursor.execute('SELECT * FROM ambulance_requests WHERE id = ?', (request_id,))
+        request_data = cursor.fetchone()
     
     if request_data:
         return render_template('driver_navigate.html', 
@@ -1194,11 +1706,14 @@ def driver_update_status(request_id, status):
     if status not in valid_statuses:
         return jsonify({'error': 'Invalid status'}), 400
     
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute("UPDATE ambulance_requests SET status = ? WHERE id = ?", (status, request_id))
-    conn.commit()
-    conn.close()
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE ambulance_requests SET status = ? WHERE id = ?", (status, request_id))
+        if status == 'Patient Reached':
+            set_driver_status(cursor, session.get('driver_id'), 'Available')
+    
+    if status == 'Patient Reached':
+        active_routes.drop(request_id)
+    publish_request(request_id)
     
     return jsonify({'success': True, 'status': status})
 
@@ -1206,6 +1721,10 @@ def driver_update_status(request_id, status):
 @app.route('/driver/logout')
 def driver_logout():
     """Driver logout - clear session"""
+    driver_id = session.pop('driver_id', None)
+    if driver_id is not None:
+        with db.transaction() as cursor:
+            set_driver_status(cursor, driver_id, 'Offline')
     session.pop('driver_logged_in', None)
     session.pop('driver_name', None)
     session.pop('driver_phone', None)
@@ -1215,6 +1734,128 @@ def driver_logout():
     return redirect(url_for('driver_login'))
 
 
+def process_driver_fix(request_id, data, fix=None):
+    """
+    Full handling of one driver fix (data has lat/lng, optional timestamp/accuracy and the driver_id
+    from the session): smoothing, live routing, status changes, batched writes and room emits.
+    A batch upload passes its newest fix already smoothed, with its history row already written.
+    Returns the driver page's response, or None when the request does not exist.
+    """
+    batched = fix is not None
+    if not batched:
+        # Smooth the raw fix so GPS jitter doesn't trigger arrivals or re-routes
+        fix = gps_filter.update(request_id, data.get('lat'), data.get('lng'), gps_timestamp(data), data.get('accuracy'))
+    driver_lat = fix['lat']
+    driver_lng = fix['lng']
+    
+    # Get patient and hospital locations
+    with db.transaction() as cursor:
+        cursor.execute('''
+            SELECT origin_lat, origin_lng, destination_lat, destination_lng, status
+            FROM ambulance_requests WHERE id = ?
+        ''', (request_id,))
+        result = cursor.fetchone()
+    
+    if result:
+        patient_lat, patient_lng, hospital_lat, hospital_lng, status = result
+        new_status = None
+        
+        # Calculate route based on current phase
+        if status == 'Started':
+            # Phase 1: Driver â†’ Patient
+            route_info = live_route_info(
+                request_id, status,
+                driver_lat, driver_lng,
+                patient_lat, patient_lng,
+                hospital_lat, hospital_lng
+            )
+            eta_to_patient = route_info['segment_1']['duration_minutes']
+            
+            # Auto-update status if very close to patient (within 100m)
+            distance_to_patient = haversine(driver_lat, driver_lng, patient_lat, patient_lng)
+            if distance_to_patient < 0.1:  # 100 meters
+                new_status = 'Patient Received'
+            
+            response_data = {
+                'phase': 'to_patient',
+                'eta_minutes': round(eta_to_patient, 1),
+                'distance_km': route_info['segment_1']['distance_km'],
+                'traffic_delay': route_info.get('traffic_delay_minutes', 0)
+            }
+        
+        elif status == 'Patient Received':
+            # Phase 2: Patient location â†’ Hospital
+            route_info = live_route_info(
+                request_id, status,
+                driver_lat, driver_lng,
+                patient_lat, patient_lng,
+                hospital_lat, hospital_lng
+            )
+            eta_to_hospital = route_info['segment_2']['duration_minutes']
+            
+            # Auto-complete if very close to hospital (within 100m)
+            distance_to_hospital = haversine(driver_lat, driver_lng, hospital_lat, hospital_lng)
+            if distance_to_hospital < 0.1:
+                new_status = 'Patient Reached'
+                gps_filter.drop(request_id)
+                gps_ingest.drop(request_id)
+            
+            response_data = {
+                'phase': 'to_hospital',
+                'eta_minutes': round(eta_to_hospital, 1),
+                'distance_km': route_info['segment_2']['distance_km'],
+                'traffic_delay': route_info.get('traffic_delay_minutes', 0)
+            }
+        else:
+            active_routes.drop(request_id)
+            gps_filter.drop(request_id)
+            gps_ingest.drop(request_id)
+            return {'phase': 'completed'}
+        
+        response_data['speed_kmh'] = fix['speed_kmh']
+        response_data['heading'] = fix['heading']
+        
+        # Status changes and fresh geometry are written right away (route computed above, no connection held)
+        driver_id = data.get('driver_id')
+        fresh_route = route_info and not route_info.get('from_active_route')
+        if new_status or fresh_route:
+            with db.transaction() as cursor:
+                if new_status:
+                    cursor.execute('UPDATE ambulance_requests SET status = ? WHERE id = ?', (new_status, request_id))
+                    if new_status == 'Patient Reached':
+                        set_driver_status(cursor, driver_id, 'Available')
+                if fresh_route:
+                    save_route_geometry(cursor, request_id, route_info)
+        
+        # Position and history go through the batched writer
+        location_writer.set_request_position(request_id, driver_lat, driver_lng,
+                                             route_info.get('total_distance_km', 0),
+                                             route_info.get('total_duration_minutes', 0))
+        socketio.emit('location_update', dict(response_data, ambulance_id=request_id,
+                                              latitude=driver_lat, longitude=driver_lng),
+                      to=request_room(request_id))
+        if new_status:
+            publish_request(request_id)
+        else:
+            push_admin_position(request_id, driver_lat, driver_lng,
+                                route_info.get('total_distance_km', 0),
+                                route_info.get('total_duration_minutes', 0))
+        if not batched:
+            # Stamped with the device time, as a batch upload would be, so a queued retry of this fix is skipped
+            fix_ms = gps_time_ms(data)
+            timestamp = fix_isoformat(fix_ms) if fix_ms is not None else datetime.now().isoformat()
+            location_writer.add_history(request_id, driver_lat, driver_lng, timestamp, status)
+        
+        # Keep the driver's own position current for dispatch queries
+        if driver_id is not None:
+            location_writer.set_driver_position(driver_id, driver_lat, driver_lng)
+            driver_index.upsert(driver_id, driver_lat, driver_lng)
+        
+        gps_ingest.remember(request_id, response_data)
+        return response_data
+    return None
+
+
 # API for real-time location updates from driver
 @app.route('/api/driver/location/<int:request_id>', methods=['POST'])
 def api_update_driver_location(request_id):
@@ -1227,97 +1868,231 @@ def api_update_driver_location(request_id):
         return jsonify({'error': 'Missing coordinates'}), 400
     
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Get patient and hospital locations
-        cursor.execute('''
-            SELECT origin_lat, origin_lng, destination_lat, destination_lng, status
-            FROM ambulance_requests WHERE id = ?
-        ''', (request_id,))
-        result = cursor.fetchone()
+        # Coalesced per request and rate limited per driver; only admitted fixes do the full work
+        driver_id = session.get('driver_id')
+        data = dict(data, driver_id=driver_id)
+        device = f'driver:{driver_id}' if driver_id is not None else f'ip:{request.remote_addr}'
+        outcome = gps_ingest.submit(request_id, device, driver_lat, driver_lng, process_driver_fix, data)
+        if outcome == LIMITED:
+            return jsonify({'error': 'Too many location updates', 'retry_after': round(1 / gps_ingest.device_rate, 2)}), 429
+        if outcome == COALESCED:
+            return jsonify(dict(gps_ingest.last_result(request_id) or {}, coalesced=True))
         
-        if result:
-            patient_lat, patient_lng, hospital_lat, hospital_lng, status = result
-            
-            # Calculate route based on current phase
-            if status == 'Started':
-                # Phase 1: Driver â†’ Patient
-                route_info = calculate_route_info(
-                    driver_lat, driver_lng,
-                    patient_lat, patient_lng,
-                    hospital_lat, hospital_lng
-                )
-                eta_to_patient = route_info['segment_1']['duration_minutes']
-                
-                # Auto-update status if very close to patient (within 100m)
-                distance_to_patient = haversine(driver_lat, driver_lng, patient_lat, patient_lng)
-                if distance_to_patient < 0.1:  # 100 meters
-                    cursor.execute("UPDATE ambulance_requests SET status = 'Patient Received' WHERE id = ?", (request_id,))
-                
-                response_data = {
-                    'phase': 'to_patient',
-                    'eta_minutes': round(eta_to_patient, 1),
-                    'distance_km': route_info['segment_1']['distance_km'],
-                    'traffic_delay': route_info.get('traffic_delay_minutes', 0)
-                }
+        response_data = process_driver_fix(request_id, data)
+        if response_data is None:
+            return jsonify({'error': 'Request not found'}), 404
+        return jsonify(response_data)
             
-            elif status == 'Patient Received':
-                # Phase 2: Patient location â†’ Hospital
-                route_info = calculate_route_info(
-                    driver_lat, driver_lng,
-                    patient_lat, patient_lng,
-                    hospital_lat, hospital_lng
-                )
-                eta_to_hospital = route_info['segment_2']['duration_minutes']
-                
-                # Auto-complete if very close to hospital (within 100m)
-                distance_to_hospital = haversine(driver_lat, driver_lng, hospital_lat, hospital_lng)
-                if distance_to_hospital < 0.1:
-                    cursor.execute("UPDATE ambulance_requests SET status = 'Patient Reached' WHERE id = ?", (request_id,))
-                
-                response_data = {
-                    'phase': 'to_hospital',
-                    'eta_minutes': round(eta_to_hospital, 1),
-                    'distance_km': route_info['segment_2']['distance_km'],
-                    'traffic_delay': route_info.get('traffic_delay_minutes', 0)
-                }
-            else:
-                response_data = {'phase': 'completed'}
+    except Exception as e:
+        print(f"Error updating driver location: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/driver/location/<int:request_id>/batch', methods=['POST'])
+def api_upload_driver_locations(request_id):
+    """
+    Fixes a driver's phone queued while offline, in one upload (JSON, MessagePack or a TRK1 track
+    blob, see parse_batch). All of them become history rows with their own timestamps in one
+    transaction; only the newest runs live routing, arrival checks and emits.
+    Only the driver assigned to the request may upload.
+    """
+    driver_id = session.get('driver_id')
+    if driver_id is None:
+        return jsonify({'error': 'Not logged in'}), 401
+    with db.transaction() as cursor:
+        cursor.execute('SELECT user_id FROM ambulance_requests WHERE id = ?', (request_id,))
+        result = cursor.fetchone()
+    if not result:
+        return jsonify({'error': 'Request not found'}), 404
+    if result[0] != driver_id:
+        return jsonify({'error': 'Not assigned to this request'}), 403
+    
+    # MAX_CONTENT_LENGTH only guards form parsing on older Werkzeug; get_data() reads raw bodies
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': f'At most {MAX_REQUEST_BYTES} bytes per upload'}), 413
+    
+    # An empty bucket is refused before the body is read; the full cost is charged per fix once it is parsed
+    device = f'driver:{driver_id}'
+    if not gps_ingest.can_batch(device):
+        return jsonify({'error': 'Too many location updates', 'retry_after': round(1 / gps_ingest.device_rate, 2)}), 429
+    try:
+        fixes = parse_batch(request.get_data(), request.content_type)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not gps_ingest.admit_batch(device, len(fixes)):
+        return jsonify({'error': 'Too many location updates',
+                        'retry_after': round(gps_ingest.batch_cost(len(fixes)) / gps_ingest.device_rate, 2)}), 429
+    
+    try:
+        # Live fixes still buffered in the writer must be in the table before the duplicate check
+        location_writer.flush()
+        with db.transaction() as cursor:
+            cursor.execute('SELECT status FROM ambulance_requests WHERE id = ?', (request_id,))
+            result = cursor.fetchone()
+            if not result:
+                return jsonify({'error': 'Request not found'}), 404
+            status = result[0]
             
-            # Update driver location in database
-            cursor.execute('''
-                UPDATE ambulance_requests
-                SET driver_lat = ?, driver_lng = ?,
-                    route_distance_km = ?, route_duration_minutes = ?
-                WHERE id = ?
-            ''', (driver_lat, driver_lng,
-                  route_info.get('total_distance_km', 0),
-                  route_info.get('total_duration_minutes', 0),
-                  request_id))
+            # A retried upload may repeat fixes that are already stored, live or from an earlier upload
+            rows = [(request_id, lat, lng, fix_isoformat(ms), status, ms, accuracy)
+                    for ms, lat, lng, accuracy in fixes]
+            if rows:
+                cursor.execute('''
+                    SELECT timestamp FROM ambulance_locations
+                    WHERE ambulance_id = ? AND timestamp BETWEEN ? AND ?
+                ''', (request_id, rows[0][3], rows[-1][3]))
+                stored = {row[0] for row in cursor.fetchall()}
+                rows = [row for row in rows if row[3] not in stored]
             
-            # Also log to ambulance_locations table for history
-            cursor.execute('''
+            # Fixes newer than the live track are smoothed in order; older ones are kept as history only
+            since = gps_filter.last_time(request_id)
+            newest = None
+            for i, (_, lat, lng, timestamp, _, ms, accuracy) in enumerate(rows):
+                if since is None or ms / 1000 > since:
+                    newest = gps_filter.update(request_id, lat, lng, ms / 1000, accuracy)
+                    rows[i] = (request_id, newest['lat'], newest['lng'], timestamp, status, ms, accuracy)
+            cursor.executemany('''
                 INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status)
                 VALUES (?, ?, ?, ?, ?)
-            ''', (request_id, driver_lat, driver_lng, datetime.now().isoformat(), status))
-            
-            conn.commit()
-            conn.close()
-            
-            return jsonify(response_data)
-        else:
-            conn.close()
-            return jsonify({'error': 'Request not found'}), 404
-            
+            ''', [row[:5] for row in rows])
+        
+        response_data = {'accepted': len(rows), 'duplicates': len(fixes) - len(rows)}
+        if newest is not None:
+            _, lat, lng, _, _, ms, accuracy = rows[-1]
+            data = {'lat': lat, 'lng': lng, 'timestamp': ms, 'accuracy': accuracy, 'driver_id': driver_id}
+            response_data.update(process_driver_fix(request_id, data, fix=newest) or {})
+        return jsonify(response_data)
+    
     except Exception as e:
-        print(f"Error updating driver location: {e}")
+        print(f"Error storing driver location batch: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/route_cache/stats')
+@admin_api
+def api_route_cache_stats():
+    """Route cache hit/miss counters and active-route reuse (admin only)"""
+    return jsonify(dict(route_cache.stats(), **active_routes.stats()))
+
+@app.route('/api/providers/stats')
+@admin_api
+def api_provider_stats():
+    """Per-provider call, retry and circuit breaker counters (admin only)"""
+    return jsonify(provider_stats())
+
+@app.route('/api/geocode_cache/stats')
+@admin_api
+def api_geocode_cache_stats():
+    """Geocode cache hit/miss counters (admin only)"""
+    return jsonify(geocode_cache.stats())
+
+@app.route('/api/drivers/nearest')
+@admin_api
+def api_nearest_drivers():
+    """k nearest drivers to a point from the in-memory index (admin only)"""
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        k = min(int(request.args.get('k', 5)), 100)
+        max_km = request.args.get('max_km', type=float)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat and lng are required'}), 400
+    status = request.args.get('status', 'Available')
+    if request.args.get('eta') != 'true':
+        return jsonify({'drivers': driver_index.nearest(lat, lng, k=k, status=status, max_km=max_km)})
+    
+    # Re-rank a wider straight-line shortlist by road ETA with one matrix call
+    candidates = driver_index.nearest(lat, lng, k=k * NEAREST_ETA_SHORTLIST_FACTOR, status=status, max_km=max_km)
+    if candidates:
+        minutes, km, _ = eta_matrix.compute([[d['lat'], d['lng']] for d in candidates], [[lat, lng]])
+        for driver, eta_minutes, road_km in zip(candidates, minutes[:, 0], km[:, 0]):
+            driver['eta_minutes'] = round(float(eta_minutes), 2)
+            driver['road_km'] = round(float(road_km), 2)
+        candidates.sort(key=lambda d: d['eta_minutes'])
+    return jsonify({'drivers': candidates[:k]})
+
+@app.route('/api/db/stats')
+@admin_api
+def api_db_stats():
+    """Connection pool and transaction counters (admin only)"""
+    return jsonify(db.stats())
+
+@app.route('/api/location_writer/stats')
+@admin_api
+def api_location_writer_stats():
+    """Pending, collapsed and flushed GPS writes (admin only)"""
+    return jsonify(location_writer.stats())
+
+@app.route('/api/retention/stats')
+@admin_api
+def api_retention_stats():
+    """Downsampled and archived trips, reclaimed pages and database size (admin only)"""
+    return jsonify(retention.stats())
+
+@app.route('/api/trajectories/stats')
+@admin_api
+def api_trajectory_stats():
+    """Stored trip tracks and their encoded size (admin only)"""
+    return jsonify(trajectories.stats())
+
+@app.route('/api/gps_filter/stats')
+@admin_api
+def api_gps_filter_stats():
+    """Tracked ambulances and rejected GPS fixes (admin only)"""
+    return jsonify(gps_filter.stats())
+
+@app.route('/api/ingest/stats')
+@admin_api
+def api_ingest_stats():
+    """GPS fixes received, processed, coalesced, skipped as stationary and rate limited (admin only)"""
+    return jsonify(gps_ingest.stats())
+
+@app.route('/api/speed_profiles/stats')
+@admin_api
+def api_speed_profiles_stats():
+    """Speed profile coverage and rebuild progress (admin only)"""
+    return jsonify(speed_profiles.stats())
+
+@app.route('/api/road_graph/stats')
+@admin_api
+def api_road_graph_stats():
+    """Local road graph size and routing counters (admin only)"""
+    return jsonify(local_router.stats())
+
+@app.route('/api/eta_matrix/stats')
+@admin_api
+def api_eta_matrix_stats():
+    """ETA matrix provider calls and row cache counters (admin only)"""
+    return jsonify(eta_matrix.stats())
+
+@app.route('/api/dispatch/stats')
+@admin_api
+def api_dispatch_stats():
+    """Dispatch engine cycle counters and the last cycle's timings (admin only)"""
+    return jsonify(dispatch_engine.stats())
+
+@app.route('/api/dispatch/run', methods=['POST'])
+@admin_api
+def api_dispatch_run():
+    """Run one dispatch cycle now (admin only)"""
+    assignments = dispatch_engine.run_cycle()
+    return jsonify({'assignments': assignments, 'cycle': dispatch_engine.last_cycle})
+
+@app.route('/api/drivers/index/stats')
+@admin_api
+def api_driver_index_stats():
+    """Driver spatial index counters (admin only)"""
+    return jsonify(driver_index.stats())
+
 @app.route('/manifest.json')
 def manifest():
     return send_from_directory('static', 'manifest.json')
 
+@app.route('/service_worker.js')
+def service_worker():
+    """Served from the root so the worker's scope covers /api/, where it queues GPS fixes while offline"""
+    response = send_from_directory('static/js', 'service_worker.js')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # RUN APPLICATION
 
 
@@ -1327,18 +2102,21 @@ if __name__ == '__main__':
     print("=" * 70)
     print()
     print(" Server is running on:")
-    print(f"   Main Website:      http://127.0.0.1:5001")
-    print(f"   Driver Login:      http://127.0.0.1:5001/driver/login")
-    print(f"   Admin Dashboard:   http://127.0.0.1:5001/admin")
-    print(f"   Book Ambulance:    http://127.0.0.1:5001/booking")
+    print(f"   Main Website:      http://127.0.0.1:{SERVER_PORT}")
+    print(f"   Driver Login:      http://127.0.0.1:{SERVER_PORT}/driver/login")
+    print(f"   Admin Dashboard:   http://127.0.0.1:{SERVER_PORT}/admin")
+    print(f"   Book Ambulance:    http://127.0.0.1:{SERVER_PORT}/booking")
     print()
-    print(f"   Network Access:    http://192.168.1.102:5001")
+    print(f"   Network Access:    http://192.168.1.102:{SERVER_PORT}")
+    print(f"   Socket.IO mode:    {SOCKETIO_ASYNC_MODE}" + (f", message queue {SOCKETIO_MESSAGE_QUEUE}" if SOCKETIO_MESSAGE_QUEUE else ""))
     print()
     print("=" * 70)
     print("Press CTRL+C to stop the server")
     print("=" * 70)
     print()
     
-    socketio.run(app, debug=True, host='0.0.0.0', port=5001)
+    # Werkzeug only serves threading mode; it refuses to start without a terminal unless allowed
+    options = {'allow_unsafe_werkzeug': True} if SOCKETIO_ASYNC_MODE == 'threading' else {}
+    socketio.run(app, debug=SERVER_DEBUG, host=SERVER_HOST, port=SERVER_PORT, **options)
 
 
@@ -0,0 +1,154 @@
+"""
+Benchmark: concurrent GPS-ping writes against SQLite.
+Compares the old pattern (a new sqlite3.connect per request, default rollback journal)
+with the pooled WAL connections from db.py, using the same write transaction per ping
+(update the request, append location history, move the driver) plus concurrent readers,
+and with the batched LocationWriter (one transaction per flush instead of per ping).
+
+Run from the project root:
+    python benchmarks/bench_db.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from location_writer import LocationWriter  # noqa: E402
+
+REQUESTS = 200
+PINGS_PER_WRITER = 200
+READS_PER_READER = 400
+
+
+def create_schema(path):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE ambulance_requests (id INTEGER PRIMARY KEY, driver_lat REAL, driver_lng REAL,
+            route_distance_km REAL, route_duration_minutes REAL, status TEXT);
+        CREATE TABLE ambulance_locations (id INTEGER PRIMARY KEY AUTOINCREMENT, ambulance_id INTEGER,
+            latitude REAL, longitude REAL, timestamp TEXT, status TEXT);
+        CREATE TABLE drivers (id INTEGER PRIMARY KEY, current_lat REAL, current_lng REAL);
+    ''')
+    conn.executemany("INSERT INTO ambulance_requests (id, status) VALUES (?, 'Started')",
+                     [(i,) for i in range(REQUESTS)])
+    conn.executemany('INSERT INTO drivers (id) VALUES (?)', [(i,) for i in range(REQUESTS)])
+    conn.commit()
+    conn.close()
+
+
+def write_ping(cursor, request_id, lat, lng):
+    cursor.execute('UPDATE ambulance_requests SET driver_lat = ?, driver_lng = ? WHERE id = ?', (lat, lng, request_id))
+    cursor.execute('''
+        INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status)
+        VALUES (?, ?, ?, ?, 'Started')
+    ''', (request_id, lat, lng, datetime.now().isoformat()))
+    cursor.execute('UPDATE drivers SET current_lat = ?, current_lng = ? WHERE id = ?', (lat, lng, request_id))
+
+
+def read_request(cursor, request_id):
+    cursor.execute('SELECT * FROM ambulance_requests WHERE id = ?', (request_id,))
+    return cursor.fetchone()
+
+
+class Legacy:
+    """What the handlers did before db.py: connect, work, commit, close"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, request_id, lat, lng):
+        conn = sqlite3.connect(self.path)
+        write_ping(conn.cursor(), request_id, lat, lng)
+        conn.commit()
+        conn.close()
+
+    def read(self, request_id):
+        conn = sqlite3.connect(self.path)
+        read_request(conn.cursor(), request_id)
+        conn.close()
+
+
+class Pooled:
+    def __init__(self, path):
+        self.db = Database(path)
+
+    def write(self, request_id, lat, lng):
+        with self.db.transaction() as cursor:
+            write_ping(cursor, request_id, lat, lng)
+
+    def read(self, request_id):
+        with self.db.transaction() as cursor:
+            read_request(cursor, request_id)
+
+
+class Batched(Pooled):
+    def __init__(self, path):
+        super().__init__(path)
+        self.writer = LocationWriter(database=self.db, enabled=True)
+        self.writer.start()
+
+    def write(self, request_id, lat, lng):
+        self.writer.set_request_position(request_id, lat, lng, None, None)
+        self.writer.add_history(request_id, lat, lng, datetime.now().isoformat(), 'Started')
+        self.writer.set_driver_position(request_id, lat, lng)
+
+    def finish(self):
+        self.writer.stop()
+        return self.db.stats()['transactions'] - self.reads
+
+
+def run(store, writers, readers):
+    errors = []
+
+    def writer(n):
+        for i in range(PINGS_PER_WRITER):
+            try:
+                store.write((n * PINGS_PER_WRITER + i) % REQUESTS, 12.97 + i * 1e-5, 77.59 + i * 1e-5)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    def reader(n):
+        for i in range(READS_PER_READER):
+            try:
+                store.read((n + i) % REQUESTS)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    store.reads = readers * READS_PER_READER
+    transactions = store.finish() if hasattr(store, 'finish') else writers * PINGS_PER_WRITER
+    elapsed = time.perf_counter() - started  # includes the final flush
+    return writers * PINGS_PER_WRITER / elapsed, len(errors), transactions
+
+
+def main():
+    print(f"{PINGS_PER_WRITER} pings per writer, {READS_PER_READER} reads per reader")
+    print(f"{'writers':>8} {'readers':>8} {'legacy pings/s':>15} {'pooled WAL pings/s':>19} "
+          f"{'batched pings/s':>16} {'commits/ping':>13} {'lock errors':>12}")
+    for writers, readers in ((1, 0), (4, 0), (8, 4), (16, 8)):
+        results = []
+        for store_class in (Legacy, Pooled, Batched):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'bench.db')
+                create_schema(path)
+                results.append(run(store_class(path), writers, readers))
+        (legacy_rate, _, _), (pooled_rate, _, _), (batched_rate, _, commits) = results
+        errors = '/'.join(str(r[1]) for r in results)
+        print(f"{writers:>8} {readers:>8} {legacy_rate:>15.0f} {pooled_rate:>19.0f} {batched_rate:>16.0f} "
+              f"{commits / (writers * PINGS_PER_WRITER):>13.3f} {errors:>12}")
+
+
+if __name__ == '__main__':
+    main()
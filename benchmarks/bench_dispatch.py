@@ -0,0 +1,93 @@
+"""
+Benchmark: dispatch assignment on synthetic fleets.
+Compares the Hungarian solver with the greedy mode (time and total ETA), then runs
+full DispatchEngine cycles (load, ETA matrix, solve, one-transaction commit) on a scratch database.
+
+Run from the project root:
+    python benchmarks/bench_dispatch.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from dispatch import DispatchEngine, greedy_assignment, hungarian, straight_line_eta  # noqa: E402
+
+CITY = (12.9716, 77.5946)
+SPREAD_DEG = 0.25   # ~55 km wide service area
+HUNGARIAN_LIMIT = 1000  # skip the exact solver above this size, it gets slow
+
+
+def random_points(rng, n):
+    return rng.uniform([CITY[0] - SPREAD_DEG, CITY[1] - SPREAD_DEG],
+                       [CITY[0] + SPREAD_DEG, CITY[1] + SPREAD_DEG], size=(n, 2))
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def bench_solvers(rng):
+    print(f"{'drivers':>8} {'requests':>9} {'hungarian ms':>13} {'greedy ms':>10} "
+          f"{'optimal min':>12} {'greedy min':>11} {'gap':>7}")
+    for drivers, requests in ((50, 50), (200, 150), (400, 400), (800, 600), (1000, 1000), (2000, 2000)):
+        d = random_points(rng, drivers)
+        r = random_points(rng, requests)
+        eta = straight_line_eta(d[:, 0], d[:, 1], r[:, 0], r[:, 1])
+
+        (g_rows, g_cols), greedy_s = timed(greedy_assignment, eta)
+        greedy_total = eta[g_rows, g_cols].sum()
+        if max(drivers, requests) <= HUNGARIAN_LIMIT:
+            (h_rows, h_cols), hungarian_s = timed(hungarian, eta)
+            optimal_total = eta[h_rows, h_cols].sum()
+            print(f"{drivers:>8} {requests:>9} {hungarian_s * 1000:>13.1f} {greedy_s * 1000:>10.1f} "
+                  f"{optimal_total:>12.0f} {greedy_total:>11.0f} {greedy_total / optimal_total - 1:>6.1%}")
+        else:
+            print(f"{drivers:>8} {requests:>9} {'-':>13} {greedy_s * 1000:>10.1f} {'-':>12} {greedy_total:>11.0f} {'-':>7}")
+
+
+def bench_cycles(rng):
+    print()
+    print(f"{'drivers':>8} {'requests':>9} {'method':>10} {'assigned':>9} {'solve ms':>9} {'cycle ms':>9}")
+    for drivers, requests in ((100, 80), (500, 400), (2000, 1500)):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            conn = sqlite3.connect(db_path)
+            conn.execute('CREATE TABLE drivers (id INTEGER PRIMARY KEY, current_lat REAL, current_lng REAL, status TEXT)')
+            conn.execute('''
+                CREATE TABLE ambulance_requests (
+                    id INTEGER PRIMARY KEY, user_id INTEGER, origin_lat REAL, origin_lng REAL,
+                    driver_lat REAL, driver_lng REAL, route_distance_km REAL,
+                    route_duration_minutes REAL, status TEXT
+                )
+            ''')
+            conn.executemany("INSERT INTO drivers (current_lat, current_lng, status) VALUES (?, ?, 'Available')",
+                             random_points(rng, drivers).tolist())
+            conn.executemany("INSERT INTO ambulance_requests (origin_lat, origin_lng, status) VALUES (?, ?, 'Pending')",
+                             random_points(rng, requests).tolist())
+            conn.commit()
+            conn.close()
+
+            engine = DispatchEngine(database=Database(db_path))
+            assignments = engine.run_cycle()
+            cycle = engine.last_cycle
+            print(f"{drivers:>8} {requests:>9} {cycle['method']:>10} {len(assignments):>9} "
+                  f"{cycle['solve_ms']:>9.1f} {cycle['total_ms']:>9.1f}")
+
+
+def main():
+    rng = np.random.default_rng(1)
+    bench_solvers(rng)
+    bench_cycles(rng)
+
+
+if __name__ == '__main__':
+    main()
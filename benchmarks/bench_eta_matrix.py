@@ -0,0 +1,101 @@
+"""
+Benchmark: N x M single-pair OSRM route calls vs. batched OSRM table calls through EtaMatrix,
+against a local stub OSRM server with a fixed per-request latency (no internet needed).
+
+Run from the project root:
+    python benchmarks/bench_eta_matrix.py
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial import haversine  # noqa: E402
+
+CITY = (12.9716, 77.5946)
+STUB_LATENCY_MS = 20
+SPEED_MPS = 40 / 3.6
+
+
+class StubOSRM(BaseHTTPRequestHandler):
+    """Answers /route and /table like osrm-routed, using straight-line distance at 40 km/h"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(STUB_LATENCY_MS / 1000)
+        url = urlsplit(self.path)
+        service, coordinates = url.path.split('/')[1], url.path.split('/')[-1]
+        points = [tuple(float(v) for v in pair.split(','))[::-1] for pair in coordinates.split(';')]
+        if service == 'route':
+            metres = haversine(*points[0], *points[1]) * 1000
+            body = {'code': 'Ok', 'routes': [{
+                'distance': metres, 'duration': metres / SPEED_MPS,
+                'geometry': {'coordinates': [[lng, lat] for lat, lng in points]}
+            }]}
+        else:
+            query = parse_qs(url.query)
+            sources = [int(i) for i in query['sources'][0].split(';')]
+            destinations = [int(i) for i in query['destinations'][0].split(';')]
+            distances = [[haversine(*points[s], *points[d]) * 1000 for d in destinations] for s in sources]
+            body = {'code': 'Ok', 'distances': distances,
+                    'durations': [[m / SPEED_MPS for m in row] for row in distances]}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubOSRM)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['OSRM_BASE_URL'] = f"http://127.0.0.1:{server.server_port}"
+
+    from eta_matrix import EtaMatrix  # noqa: E402  (reads OSRM_BASE_URL on first client use)
+    from provider_client import get_client  # noqa: E402
+
+    rng = np.random.default_rng(1)
+    print(f"stub latency {STUB_LATENCY_MS} ms per request")
+    print(f"{'origins':>8} {'dests':>6} {'pairwise calls':>15} {'pairwise ms':>12} "
+          f"{'table calls':>12} {'table ms':>9} {'cached ms':>10}")
+    for n_origins, n_destinations in ((5, 5), (10, 10), (20, 15), (30, 20)):
+        origins = rng.uniform(np.subtract(CITY, 0.2), np.add(CITY, 0.2), size=(n_origins, 2))
+        destinations = rng.uniform(np.subtract(CITY, 0.2), np.add(CITY, 0.2), size=(n_destinations, 2))
+
+        client = get_client('osrm')
+        started = time.perf_counter()
+        pairwise = np.empty((n_origins, n_destinations))
+        for i, (o_lat, o_lng) in enumerate(origins):
+            for j, (d_lat, d_lng) in enumerate(destinations):
+                route = client.get(f"/route/v1/driving/{o_lng},{o_lat};{d_lng},{d_lat}").json()['routes'][0]
+                pairwise[i, j] = route['duration'] / 60
+        pairwise_s = time.perf_counter() - started
+
+        matrix = EtaMatrix()
+        started = time.perf_counter()
+        minutes, _, sources = matrix.compute(origins, destinations)
+        table_s = time.perf_counter() - started
+        assert sources.get('osrm') == minutes.size and np.allclose(minutes, pairwise)
+
+        started = time.perf_counter()
+        matrix.compute(origins, destinations)
+        cached_s = time.perf_counter() - started
+
+        print(f"{n_origins:>8} {n_destinations:>6} {n_origins * n_destinations:>15} {pairwise_s * 1000:>12.0f} "
+              f"{matrix.calls['osrm']:>12} {table_s * 1000:>9.0f} {cached_s * 1000:>10.1f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: raw vs. Kalman-filtered GPS on synthetic ambulance traces.
+Each trace drives past a patient at a closest approach of 150 m (never a real arrival),
+with Gaussian fix noise plus occasional multipath jumps. Reports position error, false
+100 m arrivals and per-fix cost.
+
+Run from the project root:
+    python benchmarks/bench_gps_filter.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gps_filter import GpsFilter, M_PER_DEG_LAT  # noqa: E402
+from spatial import haversine_np  # noqa: E402
+
+CITY = (12.9716, 77.5946)
+TRACES = 200
+FIXES = 180           # one fix per second
+SPEED_MS = 40 / 3.6
+PASS_DISTANCE_M = 150
+ARRIVAL_KM = 0.1
+JUMP_PROBABILITY = 0.02
+JUMP_M = 250
+
+
+def trace(rng, noise_m):
+    """True and observed (lat, lng) arrays for a straight drive past the patient"""
+    m_per_deg_lng = M_PER_DEG_LAT * np.cos(np.radians(CITY[0]))
+    north = (np.arange(FIXES) - FIXES / 2) * SPEED_MS
+    east = np.full(FIXES, PASS_DISTANCE_M, dtype=float)
+    true = np.column_stack([CITY[0] + north / M_PER_DEG_LAT, CITY[1] + east / m_per_deg_lng])
+    noise = rng.normal(0, noise_m, size=(FIXES, 2))
+    jumps = rng.random(FIXES) < JUMP_PROBABILITY
+    noise[jumps] += rng.normal(0, JUMP_M, size=(int(jumps.sum()), 2))
+    observed = true + noise / [M_PER_DEG_LAT, m_per_deg_lng]
+    return true, observed
+
+
+def main():
+    rng = np.random.default_rng(1)
+    print(f"{TRACES} traces x {FIXES} fixes, closest approach {PASS_DISTANCE_M} m, "
+          f"{JUMP_PROBABILITY:.0%} multipath jumps of ~{JUMP_M} m")
+    print(f"{'noise m':>8} {'raw err m':>10} {'kf err m':>9} {'raw false arr':>14} {'kf false arr':>13} "
+          f"{'speed err km/h':>15} {'us/fix':>7}")
+    for noise_m in (5, 15, 30, 50):
+        raw_err, kf_err, speed_err = [], [], []
+        raw_false = kf_false = 0
+        elapsed = 0.0
+        for n in range(TRACES):
+            true, observed = trace(rng, noise_m)
+            gps = GpsFilter(default_accuracy_m=noise_m)
+            smoothed = np.empty_like(observed)
+            speeds = np.empty(FIXES)
+            started = time.perf_counter()
+            for i, (lat, lng) in enumerate(observed):
+                fix = gps.update(n, lat, lng, t=i)
+                smoothed[i] = fix['lat'], fix['lng']
+                speeds[i] = fix['speed_kmh']
+            elapsed += time.perf_counter() - started
+
+            raw_km = haversine_np(true[:, 0], true[:, 1], observed[:, 0], observed[:, 1])
+            kf_km = haversine_np(true[:, 0], true[:, 1], smoothed[:, 0], smoothed[:, 1])
+            raw_err.append(raw_km[10:] * 1000)
+            kf_err.append(kf_km[10:] * 1000)
+            speed_err.append(np.abs(speeds[10:] - SPEED_MS * 3.6))
+            raw_false += bool((haversine_np(observed[:, 0], observed[:, 1], CITY[0], CITY[1]) < ARRIVAL_KM).any())
+            kf_false += bool((haversine_np(smoothed[:, 0], smoothed[:, 1], CITY[0], CITY[1]) < ARRIVAL_KM).any())
+
+        print(f"{noise_m:>8} {np.mean(raw_err):>10.1f} {np.mean(kf_err):>9.1f} {raw_false:>14} {kf_false:>13} "
+              f"{np.mean(speed_err):>15.1f} {elapsed / (TRACES * FIXES) * 1e6:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark: scalar haversine loop + full sort (old driver_dashboard)
+vs. vectorized haversine_np + argpartition top-k (new driver_dashboard).
+
+Run from the project root:
+    python benchmarks/bench_haversine.py
+"""
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial import haversine, haversine_np, nearest_k  # noqa: E402
+
+DRIVER = (12.9716, 77.5946)
+TOP_K = 100
+REPEATS = 5
+
+
+def scalar_rank(lats, lngs):
+    ranked = sorted(
+        ((haversine(DRIVER[0], DRIVER[1], lat, lng), i) for i, (lat, lng) in enumerate(zip(lats, lngs))),
+        key=lambda x: x[0]
+    )
+    return [i for _, i in ranked[:TOP_K]]
+
+
+def vector_rank(lats, lngs):
+    distances = haversine_np(DRIVER[0], DRIVER[1], lats, lngs)
+    return nearest_k(distances, TOP_K)
+
+
+def best_of(fn, *args):
+    best = float('inf')
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    random.seed(1)
+    print(f"{'requests':>10} {'scalar ms':>12} {'vector ms':>12} {'speedup':>9}")
+    for n in (1_000, 10_000, 50_000, 100_000):
+        lats = [DRIVER[0] + random.uniform(-0.5, 0.5) for _ in range(n)]
+        lngs = [DRIVER[1] + random.uniform(-0.5, 0.5) for _ in range(n)]
+        lat_array = np.array(lats)
+        lng_array = np.array(lngs)
+
+        assert list(scalar_rank(lats, lngs)[:10]) == list(vector_rank(lat_array, lng_array)[:10])
+
+        scalar = best_of(scalar_rank, lats, lngs)
+        vector = best_of(vector_rank, lat_array, lng_array)
+        print(f"{n:>10} {scalar * 1000:>12.2f} {vector * 1000:>12.2f} {scalar / vector:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
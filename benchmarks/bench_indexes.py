@@ -0,0 +1,82 @@
+"""
+Benchmark: hot-path queries before and after the indexes added by migration 5.
+Builds a scratch database at schema version 4, fills it with synthetic history,
+times the queries, applies migration 5 and times them again.
+
+Run from the project root:
+    python benchmarks/bench_indexes.py
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+REQUESTS = 50000
+DRIVERS = 2000
+LOCATIONS = 500000
+REPEAT = 200
+
+QUERIES = {
+    'latest fix for an ambulance': (
+        'SELECT latitude, longitude FROM ambulance_locations WHERE ambulance_id = ? ORDER BY timestamp DESC LIMIT 1',
+        lambda rng: (int(rng.integers(1, REQUESTS)),)),
+    'requests of a driver': (
+        'SELECT id, status FROM ambulance_requests WHERE user_id = ?',
+        lambda rng: (int(rng.integers(1, DRIVERS)),)),
+    'available drivers': (
+        "SELECT id, current_lat, current_lng FROM drivers WHERE status = 'Available'",
+        lambda rng: ()),
+}
+
+
+def fill(database, rng):
+    start = datetime(2026, 1, 1)
+    with database.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO ambulance_requests (user_id, origin_lat, origin_lng, status) VALUES (?, 12.97, 77.59, 'Patient Reached')
+        ''', [(int(u),) for u in rng.integers(1, DRIVERS, REQUESTS)])
+        cursor.executemany("INSERT INTO drivers (name, phone, status) VALUES ('d', '0', ?)",
+                           [(s,) for s in rng.choice(['Available', 'On Trip', 'Offline'], DRIVERS, p=[0.1, 0.2, 0.7])])
+        cursor.executemany('''
+            INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status)
+            VALUES (?, 12.97, 77.59, ?, 'Started')
+        ''', [(int(a), (start + timedelta(seconds=int(i))).isoformat())
+              for i, a in enumerate(rng.integers(1, REQUESTS, LOCATIONS))])
+
+
+def time_queries(database, rng):
+    results = {}
+    with database.transaction() as cursor:
+        for label, (sql, params) in QUERIES.items():
+            started = time.perf_counter()
+            for _ in range(REPEAT):
+                cursor.execute(sql, params(rng)).fetchall()
+            results[label] = (time.perf_counter() - started) / REPEAT * 1000
+    return results
+
+
+def main():
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, 'bench.db'))
+        migrate(database, target=4)
+        fill(database, rng)
+        before = time_queries(database, rng)
+        migrate(database)
+        after = time_queries(database, rng)
+    print(f"{REQUESTS} requests, {DRIVERS} drivers, {LOCATIONS} location rows")
+    print(f"{'query':<30} {'before ms':>10} {'after ms':>9} {'speedup':>8}")
+    for label in QUERIES:
+        print(f"{label:<30} {before[label]:>10.3f} {after[label]:>9.3f} {before[label] / after[label]:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
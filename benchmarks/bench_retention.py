@@ -0,0 +1,170 @@
+"""
+Benchmark: ambulance_locations growth with and without the retention engine.
+Simulates TRIPS_PER_DAY one-hertz trips a day for DAYS days into two scratch databases;
+one runs a retention pass after every simulated day. Reports live rows, file size and the
+latest-fix query as history accumulates, the shape error of downsampled trips, and the
+worst insert latency a concurrent writer saw during a retention pass.
+
+Run from the project root:
+    python benchmarks/bench_retention.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+from retention import LocationRetention  # noqa: E402
+from trajectory import TrajectoryStore  # noqa: E402
+
+DAYS = 60
+TRIPS_PER_DAY = 20
+PINGS_PER_TRIP = 600      # ten minutes at 1 Hz
+SPEED_MS = 11
+NOISE_M = 3
+REPORT_EVERY = 15
+M_PER_DEG = 111320
+
+
+def trip_track(rng, start):
+    """Piecewise-straight drive (a turn every 20-60 s) with GPS noise, as lat/lng arrays"""
+    headings = np.repeat(rng.uniform(0, 2 * np.pi, PINGS_PER_TRIP // 20 + 1), rng.integers(20, 60, PINGS_PER_TRIP // 20 + 1))
+    headings = headings[:PINGS_PER_TRIP]
+    north = np.cumsum(np.cos(headings) * SPEED_MS) + rng.normal(0, NOISE_M, PINGS_PER_TRIP)
+    east = np.cumsum(np.sin(headings) * SPEED_MS) + rng.normal(0, NOISE_M, PINGS_PER_TRIP)
+    lat = start[0] + north / M_PER_DEG
+    lng = start[1] + east / (M_PER_DEG * np.cos(np.radians(start[0])))
+    return lat, lng
+
+
+def simulate_day(database, rng, day, first_id):
+    rows = []
+    for trip in range(TRIPS_PER_DAY):
+        request_id = first_id + trip
+        started = day + timedelta(hours=8, minutes=30 * trip)
+        lat, lng = trip_track(rng, (12.97 + rng.normal(0, 0.05), 77.59 + rng.normal(0, 0.05)))
+        for i in range(PINGS_PER_TRIP):
+            status = 'En Route' if i < PINGS_PER_TRIP // 2 else 'Patient Received'
+            rows.append((request_id, float(lat[i]), float(lng[i]), (started + timedelta(seconds=i)).isoformat(), status))
+    with database.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO ambulance_requests (id, origin_lat, origin_lng, status) VALUES (?, 12.97, 77.59, 'Patient Reached')
+        ''', [(first_id + trip,) for trip in range(TRIPS_PER_DAY)])
+        cursor.executemany('''
+            INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status) VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        # Stand-in for the speed profile rebuild having caught up
+        cursor.execute('''
+            INSERT OR REPLACE INTO speed_profile_state (name, value)
+            VALUES ('last_location_id', (SELECT MAX(id) FROM ambulance_locations))
+        ''')
+
+
+def measure(database, last_request_id):
+    with database.transaction() as cursor:
+        live = cursor.execute('SELECT COUNT(*) FROM ambulance_locations').fetchone()[0]
+        started = time.perf_counter()
+        for ambulance_id in range(last_request_id - 200, last_request_id):
+            cursor.execute('''
+                SELECT latitude, longitude FROM ambulance_locations WHERE ambulance_id = ?
+                ORDER BY timestamp DESC LIMIT 1
+            ''', (ambulance_id,)).fetchall()
+        query_ms = (time.perf_counter() - started) / 200 * 1000
+        page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+        pages = cursor.execute('PRAGMA page_count').fetchone()[0]
+    with database.connection() as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    return live, page_size * pages / 1e6, query_ms
+
+
+def shape_error(database, request_id, original):
+    """Max distance (m) from an original ping to the downsampled live rows, on a local flat projection"""
+    with database.transaction() as cursor:
+        kept = np.array(cursor.execute('''
+            SELECT latitude, longitude FROM ambulance_locations WHERE ambulance_id = ? ORDER BY timestamp, id
+        ''', (request_id,)).fetchall())
+    scale = np.array([M_PER_DEG, M_PER_DEG * np.cos(np.radians(original[0, 0]))])
+    points = original * scale
+    a, b = kept[:-1] * scale, kept[1:] * scale
+    ab = b - a
+    t = np.clip(((points[:, None] - a) * ab).sum(-1) / np.maximum((ab * ab).sum(-1), 1e-9), 0, 1)
+    nearest = a + t[..., None] * ab
+    return len(kept), float(np.sqrt(((points[:, None] - nearest) ** 2).sum(-1)).min(axis=1).max())
+
+
+def writer_latency(database, retention, now):
+    """Insert one ping every 5 ms while a retention pass runs; returns (pass ms, max insert ms, inserts)"""
+    latencies = []
+    done = threading.Event()
+
+    def writer():
+        while not done.is_set():
+            started = time.perf_counter()
+            with database.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status)
+                    VALUES (0, 12.97, 77.59, ?, 'En Route')
+                ''', (now.isoformat(),))
+            latencies.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.005)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    started = time.perf_counter()
+    retention.run(now)
+    elapsed = (time.perf_counter() - started) * 1000
+    done.set()
+    thread.join()
+    return elapsed, max(latencies), len(latencies)
+
+
+def main():
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = Database(os.path.join(tmp, 'plain.db'))
+        kept = Database(os.path.join(tmp, 'retained.db'))
+        migrate(plain)
+        migrate(kept)
+        store = TrajectoryStore(kept)
+        retention = LocationRetention(kept, store, archive_after_days=30, downsample_after_hours=6, batch_pause=0.01)
+        print(f"{DAYS} days x {TRIPS_PER_DAY} trips x {PINGS_PER_TRIP} pings, archive after 30 days")
+        print(f"{'day':>4} {'rows':>9} {'MB':>7} {'fix ms':>7} | {'rows':>8} {'MB':>6} {'fix ms':>7}   (no retention | retention)")
+
+        first_day = datetime(2026, 1, 1)
+        request_id = 1
+        for d in range(DAYS):
+            day = first_day + timedelta(days=d)
+            simulate_day(plain, np.random.default_rng(d), day, request_id)
+            simulate_day(kept, np.random.default_rng(d), day, request_id)
+            request_id += TRIPS_PER_DAY
+            retention.run(day + timedelta(days=1))
+            if (d + 1) % REPORT_EVERY == 0:
+                p_rows, p_mb, p_ms = measure(plain, request_id)
+                k_rows, k_mb, k_ms = measure(kept, request_id)
+                print(f"{d + 1:>4} {p_rows:>9} {p_mb:>7.1f} {p_ms:>7.3f} | {k_rows:>8} {k_mb:>6.1f} {k_ms:>7.3f}")
+
+        stats, tracks = retention.stats(), store.stats()
+        print(f"trip_tracks: {tracks['tracks']} trips, {tracks['points']} points, {tracks['bytes_per_point']} bytes/point; "
+              f"auto_vacuum {stats['auto_vacuum']}, {stats['pages_vacuumed']} pages reclaimed")
+
+        # One more day, then a pass that downsamples it while another thread keeps writing
+        simulate_day(kept, rng, first_day + timedelta(days=DAYS), request_id)
+        with kept.transaction() as cursor:
+            original = np.array(cursor.execute('SELECT latitude, longitude FROM ambulance_locations WHERE ambulance_id = ?',
+                                               (request_id,)).fetchall())
+        elapsed, worst, inserts = writer_latency(kept, retention, first_day + timedelta(days=DAYS + 1))
+        print(f"retention pass {elapsed:.0f} ms; concurrent writer: {inserts} inserts, worst {worst:.1f} ms")
+        count, error_m = shape_error(kept, request_id, original)
+        print(f"downsampled trip: {len(original)} -> {count} pings, max deviation {error_m:.1f} m "
+              f"(tolerance {retention.tolerance_m:.0f} m)")
+
+
+if __name__ == '__main__':
+    main()
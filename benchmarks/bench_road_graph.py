@@ -0,0 +1,55 @@
+"""
+Benchmark: offline road-graph routing on a synthetic street grid.
+Compares plain Dijkstra with A* + landmarks (ALT) on the same queries, then times full
+route() calls (snapping + search + geometry) the way the app uses them.
+
+Run from the project root:
+    python benchmarks/bench_road_graph.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from road_graph import RoadGraph  # noqa: E402
+
+QUERIES = 50
+
+
+def main():
+    rng = random.Random(1)
+    print(f"{'grid':>9} {'nodes':>7} {'landmark s':>11} {'dijkstra ms':>12} {'settled':>8} "
+          f"{'alt ms':>7} {'settled':>8} {'route() ms':>11}")
+    for size in (50, 100, 200):
+        graph = RoadGraph.grid(size, size)
+        started = time.perf_counter()
+        graph.add_landmarks()
+        landmark_s = time.perf_counter() - started
+
+        pairs = [(rng.randrange(graph.node_count), rng.randrange(graph.node_count)) for _ in range(QUERIES)]
+        totals = {'dijkstra': 0.0, 'alt': 0.0, 'dijkstra_settled': 0, 'alt_settled': 0}
+        for source, target in pairs:
+            started = time.perf_counter()
+            plain = graph.shortest_path(source, target, use_landmarks=False)
+            totals['dijkstra'] += time.perf_counter() - started
+            started = time.perf_counter()
+            alt = graph.shortest_path(source, target)
+            totals['alt'] += time.perf_counter() - started
+            assert abs(plain[0] - alt[0]) <= 1e-3 * max(1.0, plain[0])
+            totals['dijkstra_settled'] += plain[2]
+            totals['alt_settled'] += alt[2]
+
+        started = time.perf_counter()
+        for source, target in pairs:
+            assert graph.route(graph.lat[source], graph.lng[source], graph.lat[target], graph.lng[target])['success']
+        route_ms = (time.perf_counter() - started) * 1000 / QUERIES
+
+        print(f"{size}x{size:<5} {graph.node_count:>7} {landmark_s:>11.1f} "
+              f"{totals['dijkstra'] * 1000 / QUERIES:>12.1f} {totals['dijkstra_settled'] // QUERIES:>8} "
+              f"{totals['alt'] * 1000 / QUERIES:>7.1f} {totals['alt_settled'] // QUERIES:>8} {route_ms:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
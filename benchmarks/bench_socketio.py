@@ -0,0 +1,197 @@
+"""
+Benchmark: how many concurrent tracking clients one server process holds.
+Starts app.py on a scratch database in the chosen Socket.IO async mode, then adds clients in
+steps. Each client opens a tracking page, connects over long-polling and joins its request room.
+At every step a driver publishes one position per request, and the script reports delivered
+updates, delivery latency and the server's memory and threads.
+
+Run from the project root:
+    python benchmarks/bench_socketio.py                      # threading mode
+    python benchmarks/bench_socketio.py --async-mode eventlet --steps 500,1000,2000,4000
+
+Multi-worker runs need a message queue shared by the workers (one port each, BACKGROUND_JOBS
+on only one of them):
+    python benchmarks/bench_socketio.py --workers 4 --message-queue redis://localhost:6379/0
+"""
+import argparse
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+REQUESTS = 50
+BASE_PORT = 5600
+ROUNDS = 3
+ROUND_WAIT = 2.0  # seconds allowed after a round for its updates to arrive
+
+
+def fill(path):
+    database = Database(path)
+    migrate(database)
+    with database.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO ambulance_requests (patient_name, origin_lat, origin_lng, destination_lat, destination_lng, status)
+            VALUES (?, 12.97, 77.59, 13.07, 77.69, 'Started')
+        ''', [(f'bench {i}',) for i in range(REQUESTS)])
+    database.close_all()
+
+
+def start_workers(args, db_path):
+    workers = []
+    for worker in range(args.workers):
+        env = dict(os.environ, DB_PATH=db_path, SERVER_PORT=str(BASE_PORT + worker), SERVER_HOST='127.0.0.1',
+                   SERVER_DEBUG='false', SOCKETIO_ASYNC_MODE=args.async_mode,
+                   SOCKETIO_MESSAGE_QUEUE=args.message_queue or '',
+                   BACKGROUND_JOBS='true' if worker == 0 else 'false', DISPATCH_ENABLED='false')
+        workers.append(subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    for worker in range(args.workers):
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', BASE_PORT + worker), timeout=1).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError(f'worker {worker} did not start')
+                time.sleep(0.2)
+    return workers
+
+
+def proc_status(pid):
+    fields = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            fields[key] = value.split()[0] if value.split() else ''
+    return int(fields.get('VmRSS', 0)) / 1024, int(fields.get('Threads', 0))
+
+
+class Viewer:
+    """One tracking page: session cookie from the page, then a polling Socket.IO connection"""
+
+    def __init__(self, url, request_id):
+        self.request_id = request_id
+        self.received = []
+        session = requests.Session()
+        session.get(f'{url}/tracking/{request_id}', timeout=30)
+        self.client = socketio.Client(http_session=session, reconnection=False)
+        self.client.on('location_update', lambda data: self.received.append(time.perf_counter()))
+        try:
+            self.client.connect(url, transports=['polling'], wait_timeout=30)
+            if not self.client.call('join_request', {'request_id': request_id}, timeout=30).get('joined'):
+                raise RuntimeError('join refused')
+        except Exception:
+            self.client.disconnect()
+            raise
+
+
+def publish_round(driver, round_index):
+    """One position per request, spread over a second like drivers pinging at 1 Hz; returns send times"""
+    sent = {}
+    for request_id in range(1, REQUESTS + 1):
+        sent[request_id] = time.perf_counter()
+        try:
+            driver.emit('update_location', {'ambulance_id': request_id, 'latitude': 12.97 + round_index * 1e-4,
+                                            'longitude': 77.59})
+        except socketio.exceptions.BadNamespaceError:
+            break  # dropped; the caller reports it
+        time.sleep(1 / REQUESTS)
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--async-mode', default='threading', choices=['threading', 'eventlet', 'gevent'])
+    parser.add_argument('--steps', default='100,250,500,1000', help='total clients at each step')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--message-queue', default=None)
+    args = parser.parse_args()
+    if args.workers > 1 and not args.message_queue:
+        parser.error('--workers > 1 needs --message-queue')
+
+    logging.getLogger('engineio.client').setLevel(logging.CRITICAL)  # per-client disconnect noise at the limit
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        fill(db_path)
+        workers = start_workers(args, db_path)
+        urls = [f'http://127.0.0.1:{BASE_PORT + worker}' for worker in range(args.workers)]
+        viewers, failures = [], 0
+        pool = ThreadPoolExecutor(max_workers=32)
+        driver = socketio.Client(reconnection=False)
+        driver.connect(urls[0], transports=['polling'])
+        lock = threading.Lock()
+
+        def add_viewer(i):
+            nonlocal failures
+            try:
+                viewer = Viewer(urls[i % len(urls)], i % REQUESTS + 1)
+                with lock:
+                    viewers.append(viewer)
+            except Exception:
+                with lock:
+                    failures += 1
+
+        print(f"{args.async_mode} mode, {args.workers} worker(s), {REQUESTS} requests watched")
+        print(f"{'clients':>8} {'failed':>7} {'connect s':>10} {'delivered':>10} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'RSS MB':>8} {'threads':>8}")
+        try:
+            for target in (int(step) for step in args.steps.split(',')):
+                started = time.perf_counter()
+                list(pool.map(add_viewer, range(len(viewers) + failures, target)))
+                connect_s = time.perf_counter() - started
+
+                latencies, expected, delivered = [], 0, 0
+                for round_index in range(ROUNDS):
+                    for viewer in viewers:
+                        viewer.received.clear()
+                    if not driver.connected:
+                        break
+                    sent = publish_round(driver, round_index)
+                    time.sleep(ROUND_WAIT)
+                    for viewer in viewers:
+                        expected += 1
+                        if viewer.received and viewer.request_id in sent:
+                            delivered += 1
+                            latencies.append((viewer.received[0] - sent[viewer.request_id]) * 1000)
+                rss, threads = (sum(v) for v in zip(*(proc_status(w.pid) for w in workers)))
+                p50, p95 = np.percentile(latencies, [50, 95]) if latencies else (float('nan'),) * 2
+                print(f"{len(viewers):>8} {failures:>7} {connect_s:>10.1f} {delivered / max(expected, 1):>10.1%} "
+                      f"{p50:>8.0f} {p95:>8.0f} {rss:>8.0f} {threads:>8}")
+                if not driver.connected:
+                    print("stopping: the publishing driver's own connection timed out")
+                    break
+                if failures > 0.05 * target or delivered < 0.95 * expected:
+                    print("stopping: this node is past its connection limit")
+                    break
+        finally:
+            for viewer in viewers:
+                try:
+                    viewer.client.disconnect()
+                except Exception:
+                    pass
+            if driver.connected:
+                driver.disconnect()
+            pool.shutdown()
+            for worker in workers:
+                worker.terminate()
+                worker.wait()
+
+
+if __name__ == '__main__':
+    main()
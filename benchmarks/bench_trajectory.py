@@ -0,0 +1,111 @@
+"""
+Benchmark: loading thousands of trip paths from ambulance_locations rows vs. trip_tracks blobs.
+Fills a scratch database with TRIPS one-hertz trips, stores each as a columnar track, then
+loads every trip into NumPy arrays (epoch ms, lat, lng) both ways. Also reports storage per point.
+
+Run from the project root:
+    python benchmarks/bench_trajectory.py
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+from trajectory import Track, TrajectoryStore, epoch_ms  # noqa: E402
+
+TRIPS = 2000
+PINGS_PER_TRIP = 600
+STATUSES = ['En Route', 'Patient Received', 'Patient Reached']
+
+
+def fill(database, rng):
+    start = datetime(2026, 1, 1)
+    for first in range(0, TRIPS, 200):
+        rows = []
+        for request_id in range(first + 1, first + 201):
+            started = start + timedelta(minutes=15 * request_id)
+            lat = 12.97 + np.cumsum(rng.normal(0, 5e-5, PINGS_PER_TRIP))
+            lng = 77.59 + np.cumsum(rng.normal(0, 5e-5, PINGS_PER_TRIP))
+            for i in range(PINGS_PER_TRIP):
+                rows.append((request_id, float(lat[i]), float(lng[i]), (started + timedelta(seconds=i)).isoformat(),
+                             STATUSES[i * len(STATUSES) // PINGS_PER_TRIP]))
+        with database.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status) VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+
+
+def file_bytes(database):
+    with database.connection() as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+
+def load_rows(database):
+    """Every trip as arrays, the way a row-level audit script would build them"""
+    trips = {}
+    with database.transaction() as cursor:
+        cursor.execute('''
+            SELECT ambulance_id, latitude, longitude, timestamp, status FROM ambulance_locations
+            ORDER BY ambulance_id, timestamp
+        ''')
+        for ambulance_id, lat, lng, timestamp, status in cursor:
+            trips.setdefault(ambulance_id, []).append((epoch_ms(timestamp), lat, lng, status))
+    return {request_id: (np.array([p[0] for p in points]), np.array([p[1] for p in points]),
+                         np.array([p[2] for p in points])) for request_id, points in trips.items()}
+
+
+def load_tracks(store):
+    return {request_id: (track.times_ms, track.lats, track.lngs) for request_id, track in store.iter_tracks()}
+
+
+def main():
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, 'bench.db'))
+        migrate(database)
+        empty = file_bytes(database)
+        fill(database, rng)
+        with_rows = file_bytes(database)
+
+        store = TrajectoryStore(database)
+        started = time.perf_counter()
+        for first in range(1, TRIPS + 1, 200):
+            with database.transaction() as cursor:
+                rows = []
+                for request_id in range(first, first + 200):
+                    points = store.live_points(cursor, request_id)
+                    rows.append(store.encode(request_id, Track.from_points([p[1:] for p in points]), points[-1][0]))
+                store.save_many(cursor, rows)
+        encode_s = time.perf_counter() - started
+        with_tracks = file_bytes(database)
+
+        points = TRIPS * PINGS_PER_TRIP
+        print(f"{TRIPS} trips x {PINGS_PER_TRIP} pings ({points} points)")
+        print(f"storage: ambulance_locations rows {(with_rows - empty) / points:.1f} bytes/point, "
+              f"trip_tracks {(with_tracks - with_rows) / points:.2f} bytes/point ({store.stats()['bytes_per_point']} encoded)")
+        print(f"encode: {encode_s:.1f}s ({points / encode_s / 1e3:.0f}k points/s)")
+
+        print(f"{'load all trips':<16} {'seconds':>8} {'k points/s':>11}")
+        results = {}
+        for label, load in (('row scan', lambda: load_rows(database)), ('trip_tracks', lambda: load_tracks(store))):
+            started = time.perf_counter()
+            results[label] = load()
+            elapsed = time.perf_counter() - started
+            print(f"{label:<16} {elapsed:>8.2f} {points / elapsed / 1e3:>11.0f}")
+
+        rows, tracks = results['row scan'], results['trip_tracks']
+        assert rows.keys() == tracks.keys()
+        worst = max(np.abs(rows[k][1] - tracks[k][1]).max() for k in rows)
+        print(f"max coordinate difference {worst:.1e} deg (1e-5 storage precision)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+# DATABASE CONFIG
+DB_PATH = os.getenv('DB_PATH', 'users.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))  # idle connections kept open between requests
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))  # wait this long for a write lock
+DB_CACHED_STATEMENTS = int(os.getenv('DB_CACHED_STATEMENTS', 256))  # prepared statements kept per connection
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')  # NORMAL is durable across app crashes in WAL mode
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 8192))  # page cache per connection
+DB_AUTO_VACUUM = os.getenv('DB_AUTO_VACUUM', 'INCREMENTAL')  # applies to new files; `python migrations.py vacuum` converts old ones
+
+
+class Database:
+    """
+    Pooled SQLite connections configured for concurrent use: WAL journaling (readers never
+    block the writer), synchronous=NORMAL, a busy timeout instead of immediate
+    "database is locked" errors, and a per-connection prepared-statement cache.
+
+    Use transaction() for everything:
+
+        with db.transaction() as cursor:
+            cursor.execute(...)
+
+    The block commits on success and rolls back on an exception. A thread that opens
+    a transaction inside another one joins the outer transaction on the same connection.
+    """
+
+    def __init__(self, path=DB_PATH, pool_size=DB_POOL_SIZE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+                 cached_statements=DB_CACHED_STATEMENTS, synchronous=DB_SYNCHRONOUS,
+                 cache_size_kb=DB_CACHE_SIZE_KB, auto_vacuum=DB_AUTO_VACUUM):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.auto_vacuum = auto_vacuum
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.transactions = 0
+        self.rollbacks = 0
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                               cached_statements=self.cached_statements, check_same_thread=False)
+        # Must precede journal_mode: on a new file it only sticks before the header is written
+        conn.execute(f'PRAGMA auto_vacuum={self.auto_vacuum}')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={self.busy_timeout_ms}')
+        conn.execute(f'PRAGMA cache_size=-{self.cache_size_kb}')
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def _checkout(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+        with self._lock:
+            self.reused += 1
+        return conn
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """This thread's current connection, or a pooled one for the duration of the block"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Cursor inside one transaction. immediate=True takes the write lock up front
+        (BEGIN IMMEDIATE), for read-then-write blocks that must not interleave with other writers.
+        """
+        with self.connection() as conn:
+            depth = getattr(self._local, 'depth', 0)
+            if depth:
+                # Nested block: the outermost transaction commits
+                self._local.depth = depth + 1
+                try:
+                    yield conn.cursor()
+                finally:
+                    self._local.depth = depth
+                return
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.cursor()
+            self._local.depth = 1
+            try:
+                yield cursor
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                with self._lock:
+                    self.rollbacks += 1
+                raise
+            finally:
+                self._local.depth = 0
+                cursor.close()
+                with self._lock:
+                    self.transactions += 1
+
+    def close_all(self):
+        """Close idle pooled connections (connections in use are closed when checked back in)"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def stats(self):
+        with self._lock:
+            return {'path': self.path, 'idle_connections': self._idle.qsize(), 'opened': self.opened,
+                    'reused': self.reused, 'transactions': self.transactions, 'rollbacks': self.rollbacks}
+
+
+db = Database()
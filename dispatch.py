@@ -0,0 +1,291 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from db import db
+from spatial import haversine_matrix, haversine_np
+
+
+# DISPATCH CONFIG
+DISPATCH_ENABLED = os.getenv('DISPATCH_ENABLED', 'false').lower() == 'true'
+DISPATCH_INTERVAL = float(os.getenv('DISPATCH_INTERVAL', 5))  # seconds between cycles
+DISPATCH_MAX_ETA_MINUTES = float(os.getenv('DISPATCH_MAX_ETA_MINUTES', 60))  # never assign a driver further than this
+DISPATCH_MAX_BATCH = int(os.getenv('DISPATCH_MAX_BATCH', 2000))  # oldest Pending requests considered per cycle
+DISPATCH_GREEDY_THRESHOLD = int(os.getenv('DISPATCH_GREEDY_THRESHOLD', 600))  # above this many rows or columns use greedy
+DISPATCH_GREEDY_CANDIDATES = int(os.getenv('DISPATCH_GREEDY_CANDIDATES', 16))  # nearest columns per row tried first by greedy
+DISPATCH_SPEED_KMH = float(os.getenv('DISPATCH_SPEED_KMH', 40))  # straight-line speed for the default ETA estimate
+DISPATCH_ROAD_ETA_MAX_CELLS = int(os.getenv('DISPATCH_ROAD_ETA_MAX_CELLS', 2500))  # larger batches use straight-line ETAs
+
+
+def straight_line_eta(driver_lats, driver_lngs, patient_lats, patient_lngs):
+    """ETA matrix in minutes (drivers x requests) from great-circle distance at DISPATCH_SPEED_KMH"""
+    return haversine_matrix(driver_lats, driver_lngs, patient_lats, patient_lngs) / DISPATCH_SPEED_KMH * 60
+
+
+# ASSIGNMENT SOLVERS
+
+def hungarian(cost):
+    """
+    Minimum-cost assignment for a rectangular cost matrix (Hungarian method with potentials,
+    shortest augmenting paths). Every row is matched when rows <= columns, otherwise every column.
+    Costs must be finite. Returns (rows, cols) index arrays.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    # 1-based rows/columns; column 0 is the virtual start of each augmenting path
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=np.intp)   # row matched to each column, 0 = free
+    way = np.zeros(m + 1, dtype=np.intp)
+    for row in range(1, n + 1):
+        match[0] = row
+        col0 = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[col0] = True
+            row0 = match[col0]
+            free = ~used[1:]
+            slack = cost[row0 - 1] - u[row0] - v[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = col0
+
+            candidates = np.where(free, min_slack[1:], np.inf)
+            col1 = int(np.argmin(candidates)) + 1
+            delta = candidates[col1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+            col0 = col1
+            if match[col0] == 0:
+                break
+        # Flip the augmenting path
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+
+    cols = np.nonzero(match[1:])[0]
+    rows = match[1:][cols] - 1
+    order = np.argsort(rows)
+    rows, cols = rows[order], cols[order]
+    if transposed:
+        rows, cols = cols, rows
+        order = np.argsort(rows)
+        rows, cols = rows[order], cols[order]
+    return rows, cols
+
+
+def greedy_assignment(cost, candidates=DISPATCH_GREEDY_CANDIDATES):
+    """
+    Cheapest-pair-first assignment over each row's `candidates` cheapest columns, repeated on
+    whatever is left unmatched. Far cheaper than the Hungarian method on big batches, at the price of
+    a higher total ETA (see benchmarks/bench_dispatch.py). Infinite costs are never matched. Returns (rows, cols).
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    rows_left = np.arange(cost.shape[0])
+    cols_left = np.arange(cost.shape[1])
+    rows, cols = [], []
+    while rows_left.size and cols_left.size:
+        sub = cost[np.ix_(rows_left, cols_left)]
+        k = min(candidates, sub.shape[1])
+        nearest = np.argpartition(sub, k - 1, axis=1)[:, :k] if k < sub.shape[1] else \
+            np.broadcast_to(np.arange(k), sub.shape)
+        pair_rows = np.repeat(np.arange(sub.shape[0]), k)
+        pair_cols = nearest.ravel()
+        values = sub[pair_rows, pair_cols]
+        finite = np.nonzero(np.isfinite(values))[0]
+        if finite.size == 0:
+            break
+        order = finite[np.argsort(values[finite], kind='stable')]
+
+        row_used = np.zeros(sub.shape[0], dtype=bool)
+        col_used = np.zeros(sub.shape[1], dtype=bool)
+        for index in order:
+            row, col = pair_rows[index], pair_cols[index]
+            if row_used[row] or col_used[col]:
+                continue
+            row_used[row] = col_used[col] = True
+            rows.append(rows_left[row])
+            cols.append(cols_left[col])
+        rows_left = rows_left[~row_used]
+        cols_left = cols_left[~col_used]
+    order = np.argsort(rows, kind='stable')
+    return np.array(rows, dtype=np.intp)[order], np.array(cols, dtype=np.intp)[order]
+
+
+def solve_assignment(cost, max_cost=np.inf, greedy_threshold=DISPATCH_GREEDY_THRESHOLD):
+    """
+    Assign rows to columns minimising total cost, never using a pair that costs more than max_cost.
+    Returns (rows, cols, method).
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), 'none'
+    allowed = np.isfinite(cost) & (cost <= max_cost)
+
+    if max(cost.shape) > greedy_threshold:
+        rows, cols = greedy_assignment(np.where(allowed, cost, np.inf))
+        return rows, cols, 'greedy'
+
+    # Forbidden pairs get a cost larger than any full assignment of allowed pairs, then are dropped
+    finite_max = cost[allowed].max() if allowed.any() else 0.0
+    forbidden = (finite_max + 1.0) * min(cost.shape) + 1.0
+    rows, cols = hungarian(np.where(allowed, cost, forbidden))
+    keep = allowed[rows, cols]
+    return rows[keep], cols[keep], 'hungarian'
+
+
+# DISPATCH ENGINE
+
+class DispatchEngine:
+    """
+    Periodically matches Available drivers to Pending requests.
+    Each cycle builds an ETA matrix (drivers x requests), solves it, and writes all
+    assignments in one transaction. `on_assign` is called with the committed assignments.
+    """
+
+    def __init__(self, database=db, eta_matrix=straight_line_eta, interval=DISPATCH_INTERVAL,
+                 max_eta_minutes=DISPATCH_MAX_ETA_MINUTES, on_assign=None):
+        self.db = database
+        self.eta_matrix = eta_matrix
+        self.interval = interval
+        self.max_eta_minutes = max_eta_minutes
+        self.on_assign = on_assign
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()   # one cycle at a time
+        self.cycles = 0
+        self.assigned = 0
+        self.conflicts = 0
+        self.last_cycle = {}
+
+    def load_batch(self, cursor):
+        cursor.execute('''
+            SELECT id, current_lat, current_lng FROM drivers
+            WHERE status = 'Available' AND current_lat IS NOT NULL AND current_lng IS NOT NULL
+        ''')
+        drivers = cursor.fetchall()
+        cursor.execute('''
+            SELECT id, origin_lat, origin_lng FROM ambulance_requests
+            WHERE status = 'Pending' AND origin_lat IS NOT NULL AND origin_lng IS NOT NULL
+            ORDER BY id LIMIT ?
+        ''', (DISPATCH_MAX_BATCH,))
+        requests = cursor.fetchall()
+        return drivers, requests
+
+    def run_cycle(self):
+        """Run one dispatch cycle; returns the list of committed assignments"""
+        with self._lock:
+            started = time.perf_counter()
+            with self.db.transaction() as cursor:
+                drivers, requests = self.load_batch(cursor)
+            if not drivers or not requests:
+                self._record(started, len(drivers), len(requests), 'none', 0, 0)
+                return []
+
+            # No connection is held while the ETA matrix is priced
+            driver_coords = np.array([d[1:] for d in drivers], dtype=np.float64)
+            patient_coords = np.array([r[1:] for r in requests], dtype=np.float64)
+            eta = self.eta_matrix(driver_coords[:, 0], driver_coords[:, 1],
+                                  patient_coords[:, 0], patient_coords[:, 1])
+            solve_started = time.perf_counter()
+            rows, cols, method = solve_assignment(eta, self.max_eta_minutes)
+            solve_ms = (time.perf_counter() - solve_started) * 1000
+
+            with self.db.transaction(immediate=True) as cursor:
+                assignments = self._commit(cursor, drivers, requests, rows, cols, eta)
+
+            self._record(started, len(drivers), len(requests), method, len(assignments), solve_ms)
+        if assignments and self.on_assign:
+            self.on_assign(assignments)
+        return assignments
+
+    def _commit(self, cursor, drivers, requests, rows, cols, eta):
+        """
+        Write every assignment inside the caller's BEGIN IMMEDIATE transaction;
+        pairs claimed meanwhile (manual accept) are skipped. Only the priced ETA is stored here:
+        route_distance_km is left for on_assign to fill in from the road route.
+        """
+        assignments = []
+        distances = haversine_np(
+            np.array([drivers[r][1] for r in rows], dtype=np.float64),
+            np.array([drivers[r][2] for r in rows], dtype=np.float64),
+            [requests[c][1] for c in cols], [requests[c][2] for c in cols]
+        )
+        for (row, col), distance_km in zip(zip(rows, cols), distances):
+            driver_id, driver_lat, driver_lng = drivers[row]
+            request_id = requests[col][0]
+            cursor.execute("UPDATE drivers SET status = 'On Trip' WHERE id = ? AND status = 'Available'",
+                           (driver_id,))
+            if cursor.rowcount == 0:
+                self.conflicts += 1
+                continue
+            cursor.execute('''
+                UPDATE ambulance_requests
+                SET driver_lat = ?, driver_lng = ?, route_duration_minutes = ?,
+                    status = 'Started', user_id = ?
+                WHERE id = ? AND status = 'Pending'
+            ''', (driver_lat, driver_lng, round(float(eta[row, col]), 2), driver_id, request_id))
+            if cursor.rowcount == 0:
+                cursor.execute("UPDATE drivers SET status = 'Available' WHERE id = ?", (driver_id,))
+                self.conflicts += 1
+                continue
+            assignments.append({
+                'request_id': request_id,
+                'driver_id': driver_id,
+                'driver_lat': driver_lat,
+                'driver_lng': driver_lng,
+                'eta_minutes': round(float(eta[row, col]), 2),
+                'straight_line_km': round(float(distance_km), 2)
+            })
+        return assignments
+
+    def _record(self, started, drivers, requests, method, assigned, solve_ms):
+        self.cycles += 1
+        self.assigned += assigned
+        self.last_cycle = {
+            'at': datetime.now().isoformat(),
+            'drivers': drivers,
+            'requests': requests,
+            'method': method,
+            'assigned': assigned,
+            'solve_ms': round(solve_ms, 2),
+            'total_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_cycle()
+            except Exception as e:
+                print(f"Dispatch cycle failed: {e}")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='dispatch', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            'enabled': self._thread is not None and self._thread.is_alive(),
+            'interval': self.interval,
+            'cycles': self.cycles,
+            'assigned': self.assigned,
+            'conflicts': self.conflicts,
+            'last_cycle': self.last_cycle
+        }
@@ -0,0 +1,165 @@
+import os
+import threading
+from math import floor, cos, radians
+
+from spatial import haversine
+
+
+# DRIVER INDEX CONFIG
+DRIVER_INDEX_CELL_DEG = float(os.getenv('DRIVER_INDEX_CELL_DEG', 0.01))  # ~1.1 km grid cells
+KM_PER_DEGREE = 111.32
+
+
+class DriverIndex:
+    """
+    In-memory grid index of driver positions, bucketed by driver status.
+    Each status keeps its own {cell: set(driver_id)} map, so a nearest-Available query
+    never looks at drivers who are on a trip or offline.
+    """
+
+    def __init__(self, cell_deg=DRIVER_INDEX_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._drivers = {}   # driver_id -> (lat, lng, status, cell)
+        self._cells = {}     # status -> {cell: set(driver_id)}
+        self._lock = threading.RLock()
+
+    def _cell(self, lat, lng):
+        return floor(lat / self.cell_deg), floor(lng / self.cell_deg)
+
+    def _unlink(self, driver_id):
+        entry = self._drivers.pop(driver_id, None)
+        if entry is None:
+            return None
+        _, _, status, cell = entry
+        bucket = self._cells.get(status, {}).get(cell)
+        if bucket is not None:
+            bucket.discard(driver_id)
+            if not bucket:
+                del self._cells[status][cell]
+        return entry
+
+    def _link(self, driver_id, lat, lng, status):
+        cell = self._cell(lat, lng)
+        self._drivers[driver_id] = (lat, lng, status, cell)
+        self._cells.setdefault(status, {}).setdefault(cell, set()).add(driver_id)
+
+    def upsert(self, driver_id, lat, lng, status=None):
+        """Add or move a driver. Keeps the current status when `status` is None."""
+        if lat is None or lng is None:
+            return
+        with self._lock:
+            previous = self._unlink(driver_id)
+            if status is None:
+                status = previous[2] if previous else 'Available'
+            self._link(driver_id, float(lat), float(lng), status)
+
+    def set_status(self, driver_id, status):
+        with self._lock:
+            previous = self._unlink(driver_id)
+            if previous:
+                self._link(driver_id, previous[0], previous[1], status)
+
+    def remove(self, driver_id):
+        with self._lock:
+            self._unlink(driver_id)
+
+    def get(self, driver_id):
+        with self._lock:
+            entry = self._drivers.get(driver_id)
+            return None if entry is None else {'lat': entry[0], 'lng': entry[1], 'status': entry[2]}
+
+    def load(self, rows):
+        """Bulk load (driver_id, lat, lng, status) rows, e.g. from the drivers table at startup"""
+        with self._lock:
+            for driver_id, lat, lng, status in rows:
+                if lat is not None and lng is not None:
+                    self._unlink(driver_id)
+                    self._link(driver_id, float(lat), float(lng), status or 'Available')
+
+    @staticmethod
+    def _ring(center_row, center_col, ring):
+        """Cells on the square ring `ring` steps away from the center cell"""
+        if ring == 0:
+            yield center_row, center_col
+            return
+        for col in range(center_col - ring, center_col + ring + 1):
+            yield center_row - ring, col
+            yield center_row + ring, col
+        for row in range(center_row - ring + 1, center_row + ring):
+            yield row, center_col - ring
+            yield row, center_col + ring
+
+    def nearest(self, lat, lng, k=5, status='Available', max_km=None):
+        """
+        The k nearest drivers with the given status as a list of
+        {'driver_id', 'lat', 'lng', 'status', 'distance_km'}, nearest first.
+        Searches rings of grid cells outward and stops once no unseen cell can hold a closer driver.
+        """
+        with self._lock:
+            cells = self._cells.get(status)
+            if not cells or k <= 0:
+                return []
+            total = sum(len(bucket) for bucket in cells.values())
+            center_row, center_col = self._cell(lat, lng)
+
+            # Smallest ground size of one cell around here, used for the ring distance bound
+            cell_km = self.cell_deg * KM_PER_DEGREE * max(cos(radians(min(abs(lat) + self.cell_deg, 89.9))), 1e-6)
+            found = []
+            seen = 0
+            visited_cells = 0
+            ring = 0
+            while seen < total:
+                ring_cells = 8 * ring if ring else 1
+                if visited_cells + ring_cells > len(cells):
+                    # Sparse or far-away fleet: scanning the occupied cells is cheaper than more rings
+                    found = [
+                        (haversine(lat, lng, d_lat, d_lng), driver_id, d_lat, d_lng, d_status)
+                        for bucket in cells.values()
+                        for driver_id in bucket
+                        for d_lat, d_lng, d_status, _ in (self._drivers[driver_id],)
+                    ]
+                    break
+                visited_cells += ring_cells
+                for cell in self._ring(center_row, center_col, ring):
+                    for driver_id in cells.get(cell, ()):
+                        d_lat, d_lng, d_status, _ = self._drivers[driver_id]
+                        found.append((haversine(lat, lng, d_lat, d_lng), driver_id, d_lat, d_lng, d_status))
+                        seen += 1
+
+                # Anything not yet seen is at least `ring` whole cells away
+                bound_km = ring * cell_km
+                if max_km is not None and bound_km > max_km:
+                    break
+                if len(found) >= k:
+                    found.sort()
+                    if found[k - 1][0] <= bound_km:
+                        break
+                ring += 1
+
+            found.sort()
+            results = []
+            for distance_km, driver_id, d_lat, d_lng, d_status in found:
+                if max_km is not None and distance_km > max_km:
+                    break
+                results.append({
+                    'driver_id': driver_id,
+                    'lat': d_lat,
+                    'lng': d_lng,
+                    'status': d_status,
+                    'distance_km': round(distance_km, 3)
+                })
+                if len(results) == k:
+                    break
+            return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'drivers': len(self._drivers),
+                'by_status': {status: sum(len(b) for b in cells.values()) for status, cells in self._cells.items()},
+                'cell_deg': self.cell_deg
+            }
+
+
+# Shared index kept current by login, status changes and live GPS updates in app.py
+driver_index = DriverIndex()
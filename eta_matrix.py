@@ -0,0 +1,266 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from provider_client import get_client
+from route_cache import ROUTE_CACHE_TTLS
+from spatial import haversine_matrix
+
+
+# ETA MATRIX CONFIG
+MATRIX_CELL_PRECISION = int(os.getenv('MATRIX_CELL_PRECISION', 3))  # 3 decimals ~ 110 m origin/destination cells
+MATRIX_CACHE_MAX_ROWS = int(os.getenv('MATRIX_CACHE_MAX_ROWS', 4096))
+MATRIX_FALLBACK_SPEED_KMH = float(os.getenv('MATRIX_FALLBACK_SPEED_KMH', 40))  # when no speed model is set
+MATRIX_ROAD_FACTOR = float(os.getenv('MATRIX_ROAD_FACTOR', 1.3))  # road distance / straight-line distance
+OSRM_TABLE_MAX_COORDINATES = int(os.getenv('OSRM_TABLE_MAX_COORDINATES', 100))  # osrm-routed --max-table-size
+TOMTOM_MATRIX_MAX_CELLS = int(os.getenv('TOMTOM_MATRIX_MAX_CELLS', 2500))  # synchronous Matrix Routing v2 limit
+
+# Cached for pairs a provider answered without a route, so they are not asked again until the row expires
+UNROUTABLE = (float('nan'), float('nan'))
+
+
+def cell_key(lat, lng, precision=MATRIX_CELL_PRECISION):
+    return round(float(lat), precision), round(float(lng), precision)
+
+
+def estimate_matrix(origins, destinations, speed_kmh=MATRIX_FALLBACK_SPEED_KMH, road_factor=MATRIX_ROAD_FACTOR):
+    """
+    Vectorized (minutes, km) estimate from great-circle distance, a road detour factor and
+    a speed (a scalar or an origins x destinations array)
+    """
+    km = haversine_matrix(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1]) * road_factor
+    return km / speed_kmh * 60, km
+
+
+def _blocks(n_origins, n_destinations, max_cells=None, max_coordinates=None):
+    """Split an origins x destinations matrix into request-sized (origin_slice, destination_slice) blocks"""
+    if max_coordinates is not None:
+        dest_step = max(1, min(n_destinations, max_coordinates // 2))
+        origin_step = max(1, max_coordinates - dest_step)
+    else:
+        dest_step = max(1, min(n_destinations, max_cells))
+        origin_step = max(1, max_cells // dest_step)
+    for o in range(0, n_origins, origin_step):
+        for d in range(0, n_destinations, dest_step):
+            yield slice(o, min(o + origin_step, n_origins)), slice(d, min(d + dest_step, n_destinations))
+
+
+class MatrixRowCache:
+    """
+    LRU cache of matrix rows keyed by (provider, origin cell).
+    Each row maps destination cells to (minutes, km), or UNROUTABLE when the provider had no
+    route, so a later query from the same origin cell only needs the provider when it asks for
+    destinations the row has not seen. A lookup is a hit only when the row covers every
+    destination asked for; a row with gaps counts as partial.
+    """
+
+    def __init__(self, ttls=None, max_rows=MATRIX_CACHE_MAX_ROWS):
+        self.ttls = dict(ROUTE_CACHE_TTLS if ttls is None else ttls)
+        self.max_rows = max_rows
+        self._rows = OrderedDict()  # (provider, origin_cell) -> (expires_at, {dest_cell: (minutes, km)})
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.partial = 0
+        self.misses = 0
+
+    def lookup(self, provider, origin_cell, dest_cells):
+        """
+        Return [(minutes, km), UNROUTABLE or None (not seen), ...] per destination cell,
+        or None if the row is not cached
+        """
+        key = (provider, origin_cell)
+        with self._lock:
+            entry = self._rows.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._rows.pop(key, None)
+                self.misses += 1
+                return None
+            self._rows.move_to_end(key)
+            row = entry[1]
+            values = [row.get(cell) for cell in dest_cells]
+            if None in values:
+                self.partial += 1
+            else:
+                self.hits += 1
+            return values
+
+    def store(self, provider, origin_cell, dest_cells, minutes, km):
+        key = (provider, origin_cell)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._rows.pop(key, None)
+            row = entry[1] if entry is not None and entry[0] >= now else {}
+            for cell, m, k in zip(dest_cells, minutes, km):
+                row[cell] = (float(m), float(k)) if np.isfinite(m) else UNROUTABLE
+            self._rows[key] = (now + self.ttls.get(provider, 300), row)
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'rows': len(self._rows), 'hits': self.hits, 'partial': self.partial, 'misses': self.misses}
+
+
+class EtaMatrix:
+    """
+    Many-to-many ETA tables in batched provider calls: TomTom Matrix Routing (live traffic)
+    when a key is configured, then the OSRM table service, then a vectorized haversine estimate
+    for whatever is still missing. Callable with the DispatchEngine eta_matrix signature.
+    """
+
+    def __init__(self, tomtom_api_key=None, cache=None, speed_model=None):
+        self.tomtom_api_key = tomtom_api_key
+        self.speed_model = speed_model  # e.g. SpeedProfiles; None uses MATRIX_FALLBACK_SPEED_KMH
+        self.cache = cache if cache is not None else MatrixRowCache()
+        self.calls = {'tomtom': 0, 'osrm': 0}
+        self.failures = {'tomtom': 0, 'osrm': 0}
+        self.estimated_cells = 0
+
+    def providers(self):
+        return (['tomtom'] if self.tomtom_api_key else []) + ['osrm']
+
+    def compute(self, origins, destinations):
+        """
+        ETA table between two point sets given as [[lat, lng], ...].
+        Returns (minutes, km, sources): two (len(origins), len(destinations)) arrays and
+        the number of cells each source filled.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        minutes = np.full((len(origins), len(destinations)), np.nan)
+        km = np.full_like(minutes, np.nan)
+        sources = {}
+        if minutes.size == 0:
+            return minutes, km, sources
+
+        origin_cells = [cell_key(lat, lng) for lat, lng in origins]
+        dest_cells = [cell_key(lat, lng) for lat, lng in destinations]
+
+        # Preferred provider first. Each provider is only asked for the cells still open that
+        # its cached rows have not seen; cells it knows to be unroutable fall through to the next
+        for provider in self.providers():
+            wanted = {}  # tuple of destination columns -> origin rows that need exactly those
+            for i in np.flatnonzero(np.isnan(minutes).any(axis=1)).tolist():
+                cached = self.cache.lookup(provider, origin_cells[i], dest_cells)
+                columns = []
+                for j in np.flatnonzero(np.isnan(minutes[i])).tolist():
+                    value = None if cached is None else cached[j]
+                    if value is None:
+                        columns.append(j)
+                    elif value is not UNROUTABLE:
+                        minutes[i, j], km[i, j] = value
+                        sources['cache'] = sources.get('cache', 0) + 1
+                if columns:
+                    wanted.setdefault(tuple(columns), []).append(i)
+
+            # One batched fetch per distinct set of missing columns, falling through on failure
+            for columns, rows in wanted.items():
+                columns = np.array(columns)
+                fetched = self._fetch(provider, origins[rows], destinations[columns])
+                if fetched is None:
+                    continue
+                block_minutes, block_km = fetched
+                filled_cells = 0
+                for row, i in enumerate(rows):
+                    self.cache.store(provider, origin_cells[i], [dest_cells[j] for j in columns.tolist()],
+                                     block_minutes[row], block_km[row])
+                    fill = np.isfinite(block_minutes[row])
+                    minutes[i, columns[fill]] = block_minutes[row][fill]
+                    km[i, columns[fill]] = block_km[row][fill]
+                    filled_cells += int(fill.sum())
+                sources[provider] = sources.get(provider, 0) + filled_cells
+
+        unknown = np.isnan(minutes)
+        if unknown.any():
+            est_minutes, est_km = self.estimate(origins, destinations)
+            minutes[unknown] = est_minutes[unknown]
+            km[unknown] = est_km[unknown]
+            count = int(unknown.sum())
+            self.estimated_cells += count
+            sources['estimate'] = count
+        return minutes, km, sources
+
+    def estimate(self, origins, destinations):
+        """Network-free (minutes, km) estimate, using learned speed profiles when available"""
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        if self.speed_model is None:
+            return estimate_matrix(origins, destinations)
+        return estimate_matrix(origins, destinations, self.speed_model.speed_matrix_kmh(origins, destinations))
+
+    def __call__(self, origin_lats, origin_lngs, dest_lats, dest_lngs):
+        """Minutes-only matrix, the shape DispatchEngine expects"""
+        origins = np.column_stack([origin_lats, origin_lngs])
+        destinations = np.column_stack([dest_lats, dest_lngs])
+        return self.compute(origins, destinations)[0]
+
+    def _fetch(self, provider, origins, destinations):
+        """Whole (minutes, km) block from one provider; cells it could not route stay NaN. None on failure."""
+        minutes = np.full((len(origins), len(destinations)), np.nan)
+        km = np.full_like(minutes, np.nan)
+        fetch_block = self._tomtom_block if provider == 'tomtom' else self._osrm_block
+        if provider == 'tomtom':
+            blocks = _blocks(len(origins), len(destinations), max_cells=TOMTOM_MATRIX_MAX_CELLS)
+        else:
+            blocks = _blocks(len(origins), len(destinations), max_coordinates=OSRM_TABLE_MAX_COORDINATES)
+        try:
+            for origin_slice, dest_slice in blocks:
+                self.calls[provider] += 1
+                block = fetch_block(origins[origin_slice], destinations[dest_slice])
+                if block is None:
+                    self.failures[provider] += 1
+                    return None
+                minutes[origin_slice, dest_slice], km[origin_slice, dest_slice] = block
+        except Exception as e:
+            self.failures[provider] += 1
+            print(f"{provider} matrix error: {e}")
+            return None
+        return minutes, km
+
+    def _osrm_block(self, origins, destinations):
+        coordinates = ';'.join(f"{lng},{lat}" for lat, lng in np.vstack([origins, destinations]))
+        params = {
+            'sources': ';'.join(str(i) for i in range(len(origins))),
+            'destinations': ';'.join(str(len(origins) + i) for i in range(len(destinations))),
+            'annotations': 'duration,distance'
+        }
+        response = get_client('osrm').get(f"/table/v1/driving/{coordinates}", params=params)
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        if data.get('code') != 'Ok':
+            return None
+        # Unroutable pairs come back as null
+        durations = np.array(data['durations'], dtype=np.float64)
+        distances = np.array(data.get('distances') or np.full(durations.shape, np.nan), dtype=np.float64)
+        return durations / 60, distances / 1000
+
+    def _tomtom_block(self, origins, destinations):
+        body = {
+            'origins': [{'point': {'latitude': lat, 'longitude': lng}} for lat, lng in origins],
+            'destinations': [{'point': {'latitude': lat, 'longitude': lng}} for lat, lng in destinations],
+            'options': {'departAt': 'now', 'traffic': 'live', 'travelMode': 'car', 'routeType': 'fastest'}
+        }
+        response = get_client('tomtom').post('/routing/matrix/2', params={'key': self.tomtom_api_key}, json=body)
+        if response.status_code != 200:
+            return None
+        minutes = np.full((len(origins), len(destinations)), np.nan)
+        km = np.full_like(minutes, np.nan)
+        for cell in response.json().get('data', []):
+            summary = cell.get('routeSummary')
+            if summary is None:
+                continue  # detailedError for this pair
+            minutes[cell['originIndex'], cell['destinationIndex']] = summary['travelTimeInSeconds'] / 60
+            km[cell['originIndex'], cell['destinationIndex']] = summary['lengthInMeters'] / 1000
+        return minutes, km
+
+    def stats(self):
+        return dict(self.cache.stats(), calls=dict(self.calls), failures=dict(self.failures),
+                    estimated_cells=self.estimated_cells)
@@ -0,0 +1,146 @@
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from db import db
+
+
+# GEOCODE CACHE CONFIG
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv('GEOCODE_CACHE_MAX_ENTRIES', 4096))
+GEOCODE_CACHE_TTL_DAYS = int(os.getenv('GEOCODE_CACHE_TTL_DAYS', 90))
+GEOCODE_REVERSE_PRECISION = 5  # ~1 m, identical pins share an entry
+
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_address(address):
+    """
+    Normalize free-text addresses so trivially different spellings share a cache key:
+    'City Hospital,  MG Road.' and 'city hospital mg road' both map to 'city hospital mg road'
+    """
+    if not address:
+        return ''
+    text = unicodedata.normalize('NFKC', str(address)).casefold()
+    text = _PUNCTUATION.sub(' ', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def reverse_key(lat, lng):
+    return f"{round(float(lat), GEOCODE_REVERSE_PRECISION):.{GEOCODE_REVERSE_PRECISION}f},{round(float(lng), GEOCODE_REVERSE_PRECISION):.{GEOCODE_REVERSE_PRECISION}f}"
+
+
+class GeocodeCache:
+    """
+    Two-tier geocode cache: an in-process LRU in front of the geocode_cache table.
+    Forward entries ('forward') map a normalized address to lat/lng,
+    reverse entries ('reverse') map a rounded lat/lng to a formatted address.
+    """
+
+    def __init__(self, database=db, max_entries=GEOCODE_CACHE_MAX_ENTRIES, ttl_days=GEOCODE_CACHE_TTL_DAYS):
+        self.db = database
+        self.max_entries = max_entries
+        self.ttl_days = ttl_days
+        self._memory = OrderedDict()  # (kind, query) -> (lat, lng, address)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    # Public API
+
+    def get_forward(self, address):
+        """Return (lat, lng) for an address, or None when it is not cached"""
+        key = normalize_address(address)
+        if not key:
+            return None
+        entry = self._get('forward', key)
+        return (entry[0], entry[1]) if entry else None
+
+    def put_forward(self, address, lat, lng):
+        key = normalize_address(address)
+        if key and lat is not None and lng is not None:
+            self._put('forward', key, (lat, lng, None))
+
+    def get_reverse(self, lat, lng):
+        """Return the formatted address for a coordinate, or None when it is not cached"""
+        entry = self._get('reverse', reverse_key(lat, lng))
+        return entry[2] if entry else None
+
+    def put_reverse(self, lat, lng, address):
+        if address:
+            self._put('reverse', reverse_key(lat, lng), (float(lat), float(lng), address))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries
+            }
+
+    # Internals
+
+    def _get(self, kind, query):
+        with self._lock:
+            entry = self._memory.get((kind, query))
+            if entry is not None:
+                self._memory.move_to_end((kind, query))
+                self.memory_hits += 1
+                return entry
+
+        entry = self._db_get(kind, query)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.db_hits += 1
+            self._remember((kind, query), entry)
+        return entry
+
+    def _put(self, kind, query, entry):
+        with self._lock:
+            self._remember((kind, query), entry)
+        self._db_put(kind, query, entry)
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, kind, query):
+        oldest = (datetime.now() - timedelta(days=self.ttl_days)).isoformat()
+        try:
+            with self.db.transaction() as cursor:
+                cursor.execute('''
+                    SELECT lat, lng, address FROM geocode_cache
+                    WHERE kind = ? AND query = ? AND created_at >= ?
+                ''', (kind, query, oldest))
+                return cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"Geocode cache read error: {e}")
+            return None
+
+    def _db_put(self, kind, query, entry):
+        lat, lng, address = entry
+        try:
+            with self.db.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO geocode_cache (kind, query, lat, lng, address, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (kind, query, lat, lng, address, datetime.now().isoformat()))
+        except sqlite3.Error as e:
+            print(f"Geocode cache write error: {e}")
+
+
+# Shared cache used by the geocoding functions in app.py
+geocode_cache = GeocodeCache()
@@ -0,0 +1,230 @@
+from array import array
+from math import radians, cos
+
+
+# ROUTE GEOMETRY ENCODING
+# Google encoded polyline format: https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+# Leaflet pages decode it with the small decoder in templates/route_map.html.
+
+POLYLINE_PRECISION = 5  # 1e-5 degrees ~ 1.1 m
+COORDINATE_SCALE = 10 ** POLYLINE_PRECISION
+EARTH_RADIUS_M = 6371000
+
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else (value << 1)
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode_polyline(coordinates, precision=POLYLINE_PRECISION):
+    """Encode [[lat, lng], ...] as a Google polyline string"""
+    factor = 10 ** precision
+    chunks = []
+    prev_lat = prev_lng = 0
+    for lat, lng in coordinates:
+        lat_i = int(round(lat * factor))
+        lng_i = int(round(lng * factor))
+        _encode_value(lat_i - prev_lat, chunks)
+        _encode_value(lng_i - prev_lng, chunks)
+        prev_lat, prev_lng = lat_i, lng_i
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    """Decode a Google polyline string back to [[lat, lng], ...]"""
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append([lat / factor, lng / factor])
+    return coordinates
+
+
+# ARRAY-BACKED POLYLINES
+
+
+class Polyline:
+    """
+    Compact route geometry: lat/lng stored interleaved as scaled integers in one array('i')
+    (8 bytes per point instead of a [lat, lng] list per point). Behaves like a read-only
+    sequence of (lat, lng) tuples, so existing loops and indexing keep working.
+    """
+
+    __slots__ = ('values',)
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else array('i')
+
+    @classmethod
+    def from_coordinates(cls, coordinates):
+        """Build from [[lat, lng], ...] (or return an existing Polyline as-is)"""
+        if isinstance(coordinates, Polyline):
+            return coordinates
+        values = array('i')
+        for lat, lng in coordinates:
+            values.append(int(round(lat * COORDINATE_SCALE)))
+            values.append(int(round(lng * COORDINATE_SCALE)))
+        return cls(values)
+
+    @classmethod
+    def decode(cls, encoded):
+        return cls.from_coordinates(decode_polyline(encoded))
+
+    def __len__(self):
+        return len(self.values) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Polyline index out of range')
+        return self.values[2 * index] / COORDINATE_SCALE, self.values[2 * index + 1] / COORDINATE_SCALE
+
+    def __iter__(self):
+        values = self.values
+        for i in range(0, len(values), 2):
+            yield values[i] / COORDINATE_SCALE, values[i + 1] / COORDINATE_SCALE
+
+    def __add__(self, other):
+        return Polyline(self.values + Polyline.from_coordinates(other).values)
+
+    def __radd__(self, other):
+        return Polyline.from_coordinates(other) + self
+
+    def __eq__(self, other):
+        return isinstance(other, Polyline) and self.values == other.values
+
+    def to_list(self):
+        return [[lat, lng] for lat, lng in self]
+
+    def encode(self):
+        """Google encoded polyline (precision 5), straight from the integer array"""
+        chunks = []
+        prev_lat = prev_lng = 0
+        values = self.values
+        for i in range(0, len(values), 2):
+            _encode_value(values[i] - prev_lat, chunks)
+            _encode_value(values[i + 1] - prev_lng, chunks)
+            prev_lat, prev_lng = values[i], values[i + 1]
+        return ''.join(chunks)
+
+    def simplify(self, tolerance_m):
+        """Douglas-Peucker simplification; keeps points further than tolerance_m from the simplified line"""
+        if len(self) <= 2 or tolerance_m <= 0:
+            return self
+        keep = self.simplify_mask(tolerance_m)
+        values = array('i')
+        for i, kept in enumerate(keep):
+            if kept:
+                values.append(self.values[2 * i])
+                values.append(self.values[2 * i + 1])
+        return Polyline(values)
+
+    def simplify_mask(self, tolerance_m):
+        """Douglas-Peucker keep flags (bytearray, one per point), for callers that carry per-point data"""
+        count = len(self)
+        if count <= 2 or tolerance_m <= 0:
+            return bytearray(b'\x01' * count)
+
+        lat0 = self.values[0] / COORDINATE_SCALE
+        x_scale = radians(1 / COORDINATE_SCALE) * EARTH_RADIUS_M * cos(radians(lat0))
+        y_scale = radians(1 / COORDINATE_SCALE) * EARTH_RADIUS_M
+        xs = [v * x_scale for v in self.values[1::2]]
+        ys = [v * y_scale for v in self.values[0::2]]
+
+        keep = bytearray(count)
+        keep[0] = keep[-1] = 1
+        stack = [(0, count - 1)]
+        tolerance_sq = tolerance_m * tolerance_m
+        while stack:
+            first, last = stack.pop()
+            x1, y1, x2, y2 = xs[first], ys[first], xs[last], ys[last]
+            dx, dy = x2 - x1, y2 - y1
+            seg_len_sq = dx * dx + dy * dy
+            max_dist_sq = -1.0
+            index = first
+            for i in range(first + 1, last):
+                px, py = xs[i] - x1, ys[i] - y1
+                if seg_len_sq == 0:
+                    dist_sq = px * px + py * py
+                else:
+                    cross = px * dy - py * dx
+                    dist_sq = cross * cross / seg_len_sq
+                if dist_sq > max_dist_sq:
+                    max_dist_sq = dist_sq
+                    index = i
+            if max_dist_sq > tolerance_sq:
+                keep[index] = 1
+                stack.append((first, index))
+                stack.append((index, last))
+        return keep
+
+    def to_varint_bytes(self):
+        """Delta + zigzag + LEB128 varint encoding, for compact binary storage"""
+        return encode_varint_deltas(self.values, stride=2)
+
+    @classmethod
+    def from_varint_bytes(cls, blob):
+        return cls(decode_varint_deltas(blob, stride=2))
+
+
+def tolerance_for_zoom(zoom, lat=0.0, pixels=1.0):
+    """Ground distance (metres) covered by `pixels` screen pixels at a web-map zoom level"""
+    metres_per_pixel = 156543.03392 * cos(radians(lat)) / (2 ** zoom)
+    return metres_per_pixel * pixels
+
+
+# VARINT DELTA ENCODING
+
+def encode_varint_deltas(values, stride=1):
+    """
+    Encode integers as zigzag varints of the difference to the previous value in the same
+    column (`stride` interleaved columns, e.g. 2 for lat/lng pairs).
+    """
+    out = bytearray()
+    previous = [0] * stride
+    for i, value in enumerate(values):
+        column = i % stride
+        delta = value - previous[column]
+        previous[column] = value
+        zigzag = (delta << 1) ^ (delta >> 63)
+        while zigzag >= 0x80:
+            out.append((zigzag & 0x7f) | 0x80)
+            zigzag >>= 7
+        out.append(zigzag)
+    return bytes(out)
+
+
+def decode_varint_deltas(blob, stride=1, typecode='i'):
+    values = array(typecode)
+    previous = [0] * stride
+    shift = result = 0
+    column = 0
+    for byte in blob:
+        result |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        delta = (result >> 1) ^ -(result & 1)
+        previous[column] += delta
+        values.append(previous[column])
+        column = (column + 1) % stride
+        shift = result = 0
+    return values
@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from math import atan2, cos, degrees, radians, sqrt
+
+
+# GPS FILTER CONFIG
+GPS_FILTER_ENABLED = os.getenv('GPS_FILTER_ENABLED', 'true').lower() == 'true'
+GPS_ACCEL_NOISE = float(os.getenv('GPS_ACCEL_NOISE', 2.0))  # m/s^2, how hard an ambulance can change velocity
+GPS_DEFAULT_ACCURACY_M = float(os.getenv('GPS_DEFAULT_ACCURACY_M', 15))  # when a fix carries no accuracy
+GPS_OUTLIER_GATE = float(os.getenv('GPS_OUTLIER_GATE', 13.8))  # chi-square, 2 dof, 99.9%
+GPS_OUTLIER_RESET = int(os.getenv('GPS_OUTLIER_RESET', 3))  # consecutive rejected fixes before re-anchoring
+GPS_MAX_GAP_SECONDS = float(os.getenv('GPS_MAX_GAP_SECONDS', 120))  # longer silences restart the track
+GPS_FILTER_IDLE_TTL = int(os.getenv('GPS_FILTER_IDLE_TTL', 3600))  # seconds before an idle track is dropped
+
+M_PER_DEG_LAT = 111320.0
+INITIAL_SPEED_VARIANCE = 30.0 ** 2  # (m/s)^2, velocity is unknown on the first fix
+MIN_MOVING_SPEED_MS = 0.5  # below this the heading is noise and the last one is kept
+
+
+class KalmanTrack:
+    """
+    Constant-velocity Kalman filter for one vehicle in a local east/north plane (metres).
+    Both axes share the same motion model and isotropic GPS noise, so they share one
+    2x2 covariance [[p00, p01], [p01, p11]] over (position, velocity): every fix is O(1).
+    """
+
+    __slots__ = ('lat', 'lng', 've', 'vn', 'p00', 'p01', 'p11', 't', 'heading', 'rejected', 'updated_at')
+
+    def __init__(self, lat, lng, t, accuracy_m):
+        self.reset(lat, lng, t, accuracy_m)
+        self.heading = None
+
+    def reset(self, lat, lng, t, accuracy_m):
+        self.lat, self.lng = lat, lng
+        self.ve = self.vn = 0.0
+        self.p00, self.p01, self.p11 = accuracy_m ** 2, 0.0, INITIAL_SPEED_VARIANCE
+        self.t = t
+        self.rejected = 0
+        self.updated_at = time.monotonic()
+
+    def predict(self, dt, accel_noise):
+        """Advance the state dt seconds (white-acceleration process noise)"""
+        if dt <= 0:
+            return
+        m_per_deg_lng = M_PER_DEG_LAT * cos(radians(self.lat))
+        self.lat += self.vn * dt / M_PER_DEG_LAT
+        self.lng += self.ve * dt / m_per_deg_lng
+        q = accel_noise ** 2
+        p00, p01, p11 = self.p00, self.p01, self.p11
+        self.p00 = p00 + 2 * dt * p01 + dt * dt * p11 + q * dt ** 4 / 4
+        self.p01 = p01 + dt * p11 + q * dt ** 3 / 2
+        self.p11 = p11 + q * dt * dt
+
+    def innovation(self, lat, lng):
+        """Fix minus predicted position, in metres (east, north)"""
+        return (lng - self.lng) * M_PER_DEG_LAT * cos(radians(self.lat)), (lat - self.lat) * M_PER_DEG_LAT
+
+    def correct(self, de, dn, accuracy_m):
+        s = self.p00 + accuracy_m ** 2
+        k0, k1 = self.p00 / s, self.p01 / s
+        self.lat += k0 * dn / M_PER_DEG_LAT
+        self.lng += k0 * de / (M_PER_DEG_LAT * cos(radians(self.lat)))
+        self.ve += k1 * de
+        self.vn += k1 * dn
+        p00, p01, p11 = self.p00, self.p01, self.p11
+        self.p00 = (1 - k0) * p00
+        self.p01 = (1 - k0) * p01
+        self.p11 = p11 - k1 * p01
+
+    def speed_ms(self):
+        return sqrt(self.ve ** 2 + self.vn ** 2)
+
+    def estimate(self, outlier=False):
+        speed = self.speed_ms()
+        if speed >= MIN_MOVING_SPEED_MS:
+            self.heading = (degrees(atan2(self.ve, self.vn)) + 360) % 360
+        return {
+            'lat': self.lat,
+            'lng': self.lng,
+            'speed_kmh': round(speed * 3.6, 1),
+            'heading': None if self.heading is None else round(self.heading, 1),
+            'accuracy_m': round(sqrt(self.p00), 1),
+            'outlier': outlier
+        }
+
+
+class GpsFilter:
+    """
+    Per-ambulance streaming state estimator for live GPS fixes.
+    update() returns the smoothed position, speed and heading; fixes that land implausibly
+    far from the prediction are rejected (the prediction is returned instead) until
+    GPS_OUTLIER_RESET of them in a row show the vehicle really is somewhere else.
+    """
+
+    def __init__(self, accel_noise=GPS_ACCEL_NOISE, default_accuracy_m=GPS_DEFAULT_ACCURACY_M,
+                 gate=GPS_OUTLIER_GATE, outlier_reset=GPS_OUTLIER_RESET, max_gap=GPS_MAX_GAP_SECONDS,
+                 idle_ttl=GPS_FILTER_IDLE_TTL, enabled=GPS_FILTER_ENABLED):
+        self.accel_noise = accel_noise
+        self.default_accuracy_m = default_accuracy_m
+        self.gate = gate
+        self.outlier_reset = outlier_reset
+        self.max_gap = max_gap
+        self.idle_ttl = idle_ttl
+        self.enabled = enabled
+        self._tracks = {}  # ambulance_id -> KalmanTrack
+        self._lock = threading.Lock()
+        self.fixes = 0
+        self.outliers = 0
+        self.resets = 0
+
+    def update(self, ambulance_id, lat, lng, t=None, accuracy_m=None):
+        """
+        Feed one fix (t in seconds, e.g. the Geolocation timestamp / 1000; defaults to now).
+        Returns {'lat', 'lng', 'speed_kmh', 'heading', 'accuracy_m', 'outlier'}.
+        """
+        lat, lng = float(lat), float(lng)
+        t = time.time() if t is None else float(t)
+        accuracy_m = float(accuracy_m) if accuracy_m else self.default_accuracy_m
+        with self._lock:
+            self.fixes += 1
+            if not self.enabled:
+                return {'lat': lat, 'lng': lng, 'speed_kmh': None, 'heading': None,
+                        'accuracy_m': accuracy_m, 'outlier': False}
+
+            track = self._tracks.get(ambulance_id)
+            if track is None:
+                if len(self._tracks) % 256 == 0:
+                    self._evict_idle()
+                track = self._tracks[ambulance_id] = KalmanTrack(lat, lng, t, accuracy_m)
+                return track.estimate()
+
+            dt = t - track.t
+            if dt > self.max_gap:
+                self.resets += 1
+                track.reset(lat, lng, t, accuracy_m)
+                return track.estimate()
+
+            # Out-of-order fixes are applied as plain measurements at the current time
+            track.predict(dt, self.accel_noise)
+            track.t = max(track.t, t)
+            track.updated_at = time.monotonic()
+
+            de, dn = track.innovation(lat, lng)
+            if (de * de + dn * dn) / (track.p00 + accuracy_m ** 2) > self.gate:
+                self.outliers += 1
+                track.rejected += 1
+                if track.rejected < self.outlier_reset:
+                    return track.estimate(outlier=True)
+                self.resets += 1
+                track.reset(lat, lng, t, accuracy_m)
+                return track.estimate()
+
+            track.rejected = 0
+            track.correct(de, dn, accuracy_m)
+            return track.estimate()
+
+    def get(self, ambulance_id):
+        with self._lock:
+            track = self._tracks.get(ambulance_id)
+            return None if track is None else track.estimate()
+
+    def last_time(self, ambulance_id):
+        """Time (seconds) of the newest fix applied to a track, None if there is no track"""
+        with self._lock:
+            track = self._tracks.get(ambulance_id)
+            return None if track is None else track.t
+
+    def drop(self, ambulance_id):
+        with self._lock:
+            self._tracks.pop(ambulance_id, None)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for ambulance_id in [a for a, track in self._tracks.items() if track.updated_at < cutoff]:
+            del self._tracks[ambulance_id]
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'tracks': len(self._tracks), 'fixes': self.fixes,
+                    'outliers': self.outliers, 'resets': self.resets}
+
+
+gps_filter = GpsFilter()
@@ -0,0 +1,329 @@
+import json
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from spatial import haversine
+from trajectory import Track
+
+try:
+    import msgpack
+except ImportError:  # optional; MessagePack batches are refused without it
+    msgpack = None
+
+
+# GPS INGEST CONFIG
+INGEST_ENABLED = os.getenv('INGEST_ENABLED', 'true').lower() == 'true'
+INGEST_MIN_INTERVAL = float(os.getenv('INGEST_MIN_INTERVAL', 1.0))  # seconds between fully processed fixes per ambulance
+INGEST_MIN_DISTANCE_M = float(os.getenv('INGEST_MIN_DISTANCE_M', 5))  # a fix that moved less than this is skipped...
+INGEST_MAX_INTERVAL = float(os.getenv('INGEST_MAX_INTERVAL', 15))  # ...unless this long has passed since the last one
+INGEST_DEVICE_RATE = float(os.getenv('INGEST_DEVICE_RATE', 5))  # fixes per second a device may send (token refill)
+INGEST_DEVICE_BURST = float(os.getenv('INGEST_DEVICE_BURST', 20))  # token bucket size
+INGEST_IDLE_TTL = int(os.getenv('INGEST_IDLE_TTL', 600))  # seconds before an idle slot or bucket is dropped
+INGEST_BATCH_MAX_FIXES = int(os.getenv('INGEST_BATCH_MAX_FIXES', 3600))  # fixes per batch upload (an hour at 1 Hz)
+INGEST_BATCH_FIXES_PER_TOKEN = int(os.getenv('INGEST_BATCH_FIXES_PER_TOKEN', 200))  # a batch costs a token per this many fixes
+MAX_FIX_TIME_MS = 32503680000000  # 3000-01-01 UTC; keeps datetime.fromtimestamp in range in any timezone
+
+PROCESS = 'process'
+COALESCED = 'coalesced'
+LIMITED = 'limited'
+
+TRACK_CONTENT_TYPE = 'application/octet-stream'
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def fix_time_ms(timestamp):
+    """Epoch ms of a Geolocation timestamp. Raises ValueError (or TypeError) unless it is in range."""
+    ms = int(timestamp)
+    if not 0 < ms < MAX_FIX_TIME_MS:
+        raise ValueError('Timestamp out of range')
+    return ms
+
+
+def fix_isoformat(ms):
+    """History row timestamp of a fix. Live and batch fixes share it, so a retried upload finds live rows."""
+    return datetime.fromtimestamp(ms / 1000).isoformat()
+
+
+def fix_accuracy(accuracy):
+    """Accuracy in metres, or None when the fix has none. Raises ValueError unless finite and >= 0."""
+    if accuracy is None:
+        return None
+    accuracy = float(accuracy)
+    if not (math.isfinite(accuracy) and accuracy >= 0):
+        raise ValueError('Accuracy out of range')
+    return accuracy
+
+
+def parse_batch(body, content_type, max_fixes=INGEST_BATCH_MAX_FIXES):
+    """
+    Decode a batch upload into (epoch_ms, lat, lng, accuracy) tuples, oldest first, keeping the
+    last of any fixes sharing a timestamp. JSON and MessagePack bodies are a list of
+    {lat, lng, timestamp, accuracy} fixes, bare or under "fixes"; an octet-stream body is a TRK1
+    track blob (delta-packed columns at 1e-5 degrees, no accuracy). Raises ValueError.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    try:
+        if content_type == TRACK_CONTENT_TYPE:
+            track = Track.decode(body, max_count=max_fixes)
+            fixes = [(ms, lat, lng, None) for ms, lat, lng in
+                     zip(track.times_ms.tolist(), track.lats.tolist(), track.lngs.tolist())]
+        else:
+            if content_type in MSGPACK_CONTENT_TYPES:
+                if msgpack is None:
+                    raise ValueError('MessagePack batches need the msgpack package')
+                items = msgpack.unpackb(body)
+            elif content_type == 'application/json':
+                items = json.loads(body)
+            else:
+                raise ValueError(f'Unsupported batch content type {content_type!r}')
+            if isinstance(items, dict):
+                items = items.get('fixes')
+            if not isinstance(items, list):
+                raise ValueError('Expected a list of fixes')
+            fixes = [(int(item['timestamp']), float(item['lat']), float(item['lng']),
+                      fix_accuracy(item.get('accuracy')))
+                     for item in items]
+    except (KeyError, TypeError, OverflowError, struct.error, zlib.error) as e:
+        raise ValueError(f'Malformed batch: {e}')
+
+    if len(fixes) > max_fixes:
+        raise ValueError(f'At most {max_fixes} fixes per batch')
+    for ms, lat, lng, _ in fixes:
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError('Coordinates out of range')
+        if not 0 < ms < MAX_FIX_TIME_MS:
+            raise ValueError('Timestamp out of range')
+    fixes.sort(key=lambda fix: fix[0])
+    return [fix for i, fix in enumerate(fixes) if i + 1 == len(fixes) or fixes[i + 1][0] != fix[0]]
+
+
+class Slot:
+    """Per-ambulance state: the last processed fix and at most one waiting (latest-wins) fix"""
+
+    __slots__ = ('lat', 'lng', 'processed_at', 'pending', 'result', 'updated_at')
+
+    def __init__(self):
+        self.lat = self.lng = None
+        self.processed_at = None
+        self.pending = None      # (lat, lng, handler, payload) waiting for the interval to pass
+        self.result = None       # what the last processed fix returned, for coalesced callers
+        self.updated_at = time.monotonic()
+
+
+class GpsIngest:
+    """
+    Front door for GPS fixes from phones and devices, ahead of filtering, routing, DB writes
+    and Socket.IO emits.
+
+    Every fix first takes a token from its device's bucket (INGEST_DEVICE_RATE per second,
+    up to INGEST_DEVICE_BURST); a device out of tokens gets LIMITED. A fix for an ambulance
+    processed less than INGEST_MIN_INTERVAL ago goes into that ambulance's slot, replacing
+    any fix already waiting there, and is COALESCED; the background loop hands the latest
+    waiting fix to its handler once the interval has passed, so the last fix of a burst is
+    never lost. A due fix that moved less than INGEST_MIN_DISTANCE_M is skipped unless
+    INGEST_MAX_INTERVAL has passed. Otherwise submit() returns PROCESS and the caller
+    handles the fix itself.
+
+    A batch upload draws from the same bucket: one token per INGEST_BATCH_FIXES_PER_TOKEN
+    fixes (at most the whole burst, so a full batch can still pass on a full bucket).
+    """
+
+    def __init__(self, min_interval=INGEST_MIN_INTERVAL, min_distance_m=INGEST_MIN_DISTANCE_M,
+                 max_interval=INGEST_MAX_INTERVAL, device_rate=INGEST_DEVICE_RATE, device_burst=INGEST_DEVICE_BURST,
+                 idle_ttl=INGEST_IDLE_TTL, enabled=INGEST_ENABLED, batch_fixes_per_token=INGEST_BATCH_FIXES_PER_TOKEN):
+        self.min_interval = min_interval
+        self.min_distance_m = min_distance_m
+        self.max_interval = max_interval
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.batch_fixes_per_token = batch_fixes_per_token
+        self.idle_ttl = idle_ttl
+        self.enabled = enabled
+        self._slots = {}         # ambulance_id -> Slot
+        self._buckets = {}       # device -> [tokens, last refill (monotonic)]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.received = 0
+        self.processed = 0
+        self.deferred = 0        # processed later from a slot by the background loop
+        self.coalesced = 0       # waiting fixes replaced by a newer one before being processed
+        self.stationary = 0      # skipped for moving less than min_distance_m
+        self.limited = 0
+        self.handler_errors = 0
+        self.batches = 0
+        self.batch_fixes = 0
+
+    def _refill(self, device, now):
+        bucket = self._buckets.get(device)
+        if bucket is None:
+            bucket = self._buckets[device] = [self.device_burst, now]
+        bucket[0] = min(self.device_burst, bucket[0] + (now - bucket[1]) * self.device_rate)
+        bucket[1] = now
+        return bucket
+
+    def _take_token(self, device, now, tokens=1):
+        bucket = self._refill(device, now)
+        if bucket[0] < tokens:
+            return False
+        bucket[0] -= tokens
+        return True
+
+    def _moved(self, slot, lat, lng, now):
+        if slot.lat is None or now - slot.processed_at >= self.max_interval:
+            return True
+        return haversine(slot.lat, slot.lng, lat, lng) * 1000 >= self.min_distance_m
+
+    def submit(self, ambulance_id, device, lat, lng, handler=None, payload=None):
+        """
+        Admit one fix. Returns PROCESS (the caller handles it now), COALESCED (held or skipped;
+        a held fix is later passed to handler(ambulance_id, payload)) or LIMITED (dropped).
+        """
+        lat, lng = float(lat), float(lng)
+        now = time.monotonic()
+        with self._lock:
+            self.received += 1
+            if not self.enabled:
+                self.processed += 1
+                return PROCESS
+            if not self._take_token(device, now):
+                self.limited += 1
+                return LIMITED
+
+            slot = self._slots.get(ambulance_id)
+            if slot is None:
+                if len(self._slots) % 256 == 0:
+                    self._evict_idle(now)
+                slot = self._slots[ambulance_id] = Slot()
+            slot.updated_at = now
+
+            if slot.processed_at is not None and now - slot.processed_at < self.min_interval:
+                if slot.pending is not None:
+                    self.coalesced += 1
+                slot.pending = (lat, lng, handler, payload) if handler is not None else None
+                return COALESCED
+            if not self._moved(slot, lat, lng, now):
+                self.stationary += 1
+                slot.pending = None
+                return COALESCED
+
+            self._mark_processed(slot, lat, lng, now)
+            self.processed += 1
+            return PROCESS
+
+    def batch_cost(self, count):
+        """Tokens a batch of count fixes takes"""
+        return min(self.device_burst, max(1, math.ceil(count / self.batch_fixes_per_token)))
+
+    def can_batch(self, device):
+        """Cheap check before a batch body is read: False (LIMITED) when the device has no token left"""
+        with self._lock:
+            if self.enabled and self._refill(device, time.monotonic())[0] < 1:
+                self.limited += 1
+                return False
+            return True
+
+    def admit_batch(self, device, count):
+        """Charge batch_cost(count) tokens for a batch upload; False (nothing charged) means LIMITED"""
+        with self._lock:
+            if self.enabled and not self._take_token(device, time.monotonic(), self.batch_cost(count)):
+                self.limited += 1
+                return False
+            self.batches += 1
+            self.batch_fixes += count
+            return True
+
+    def _mark_processed(self, slot, lat, lng, now):
+        slot.lat, slot.lng = lat, lng
+        slot.processed_at = now
+        if slot.pending is not None:
+            self.coalesced += 1
+        slot.pending = None
+
+    def remember(self, ambulance_id, result):
+        """Keep the outcome of a processed fix for callers whose later fixes are coalesced"""
+        with self._lock:
+            slot = self._slots.get(ambulance_id)
+            if slot is not None:
+                slot.result = result
+
+    def last_result(self, ambulance_id):
+        with self._lock:
+            slot = self._slots.get(ambulance_id)
+            return None if slot is None else slot.result
+
+    def drop(self, ambulance_id):
+        with self._lock:
+            self._slots.pop(ambulance_id, None)
+
+    def flush(self, now=None):
+        """Hand every waiting fix whose interval has passed to its handler; returns how many"""
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            for ambulance_id, slot in self._slots.items():
+                if slot.pending is None or now - slot.processed_at < self.min_interval:
+                    continue
+                lat, lng, handler, payload = slot.pending
+                slot.pending = None
+                if not self._moved(slot, lat, lng, now):
+                    self.stationary += 1
+                    continue
+                self._mark_processed(slot, lat, lng, now)
+                self.deferred += 1
+                due.append((handler, ambulance_id, payload))
+        for handler, ambulance_id, payload in due:
+            try:
+                handler(ambulance_id, payload)
+            except Exception as e:
+                self.handler_errors += 1
+                print(f"Deferred GPS fix for {ambulance_id} failed: {e}")
+        return len(due)
+
+    def _evict_idle(self, now):
+        cutoff = now - self.idle_ttl
+        for ambulance_id in [a for a, slot in self._slots.items() if slot.updated_at < cutoff and slot.pending is None]:
+            del self._slots[ambulance_id]
+        for device in [d for d, bucket in self._buckets.items() if bucket[1] < cutoff]:
+            del self._buckets[device]
+
+    def _loop(self):
+        tick = max(min(self.min_interval / 4, 0.25), 0.01)
+        while not self._stop.wait(tick):
+            self.flush()
+
+    def start(self):
+        if self.enabled and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='gps-ingest', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'slots': len(self._slots),
+                'waiting': sum(1 for slot in self._slots.values() if slot.pending is not None),
+                'devices': len(self._buckets),
+                'received': self.received,
+                'processed': self.processed,
+                'deferred': self.deferred,
+                'coalesced': self.coalesced,
+                'stationary': self.stationary,
+                'limited': self.limited,
+                'handler_errors': self.handler_errors,
+                'batches': self.batches,
+                'batch_fixes': self.batch_fixes,
+                'batch_fixes_per_token': self.batch_fixes_per_token
+            }
+
+
+gps_ingest = GpsIngest()
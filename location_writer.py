@@ -0,0 +1,206 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+from db import db
+
+
+# LOCATION WRITER CONFIG
+LOCATION_WRITER_ENABLED = os.getenv('LOCATION_WRITER_ENABLED', 'true').lower() == 'true'
+LOCATION_FLUSH_ROWS = int(os.getenv('LOCATION_FLUSH_ROWS', 500))  # flush as soon as this many rows are pending
+LOCATION_FLUSH_INTERVAL = float(os.getenv('LOCATION_FLUSH_INTERVAL', 0.5))  # seconds, upper bound on write delay
+LOCATION_QUEUE_MAX = int(os.getenv('LOCATION_QUEUE_MAX', 20000))  # pending rows before producers are held back
+LOCATION_ENQUEUE_TIMEOUT = float(os.getenv('LOCATION_ENQUEUE_TIMEOUT', 2.0))  # then the producer flushes itself
+
+
+class LocationWriter:
+    """
+    Background writer for high-rate GPS writes.
+    History rows are appended; position updates (request, driver)
+    are collapsed so only the newest value per id is written. A flush writes everything
+    with executemany in one transaction, when LOCATION_FLUSH_ROWS rows are pending or
+    LOCATION_FLUSH_INTERVAL has passed.
+
+    Memory is bounded: once LOCATION_QUEUE_MAX rows are pending, producers wait for the
+    writer, and after LOCATION_ENQUEUE_TIMEOUT they flush on their own thread. Failed
+    flushes are retried; rows are only dropped if the database stays unwritable past that
+    bound. stop() (also registered with atexit) flushes what is left.
+    """
+
+    def __init__(self, database=db, flush_rows=LOCATION_FLUSH_ROWS, flush_interval=LOCATION_FLUSH_INTERVAL,
+                 max_pending=LOCATION_QUEUE_MAX, enqueue_timeout=LOCATION_ENQUEUE_TIMEOUT,
+                 enabled=LOCATION_WRITER_ENABLED):
+        self.db = database
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self.enabled = enabled
+        self._history = []          # (ambulance_id, lat, lng, timestamp, status)
+        self._requests = {}         # request_id -> (lat, lng, route_distance_km, route_duration_minutes)
+        self._drivers = {}          # driver_id -> (lat, lng)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one writer transaction at a time
+        self._stop = threading.Event()
+        self._thread = None
+        self.enqueued = 0
+        self.collapsed = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.max_batch = 0
+        self.backpressure_waits = 0
+        self.producer_flushes = 0
+        self.errors = 0
+        self.dropped = 0
+        self.last_flush_ms = None
+
+    def _pending(self):
+        return len(self._history) + len(self._requests) + len(self._drivers)
+
+    def _enqueue(self, add):
+        """Run add() under the lock once there is room; returns after a synchronous flush if disabled"""
+        with self._cond:
+            if self._pending() >= self.max_pending:
+                self.backpressure_waits += 1
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: self._pending() < self.max_pending, timeout=self.enqueue_timeout)
+            full = self._pending() >= self.max_pending
+            add()
+            self.enqueued += 1
+            if self._pending() >= self.flush_rows:
+                self._cond.notify_all()
+        if full:
+            # The writer is stuck or gone; keep memory bounded by writing on this thread
+            self.producer_flushes += 1
+            self.flush()
+        elif not self.enabled or self._thread is None or not self._thread.is_alive():
+            self.flush()
+
+    def _collapse(self, buffer, key, value):
+        if key in buffer:
+            self.collapsed += 1
+        buffer[key] = value
+
+    def add_history(self, ambulance_id, lat, lng, timestamp, status):
+        """Append one ambulance_locations history row"""
+        self._enqueue(lambda: self._history.append((ambulance_id, lat, lng, timestamp, status)))
+
+    def set_request_position(self, request_id, lat, lng, route_distance_km, route_duration_minutes):
+        """Latest driver position and remaining route on an ambulance_requests row"""
+        self._enqueue(lambda: self._collapse(self._requests, request_id,
+                                             (lat, lng, route_distance_km, route_duration_minutes)))
+
+    def set_driver_position(self, driver_id, lat, lng):
+        self._enqueue(lambda: self._collapse(self._drivers, driver_id, (lat, lng)))
+
+    def flush(self):
+        """Write everything pending in one transaction; returns the number of rows written"""
+        with self._flush_lock:
+            with self._cond:
+                history, self._history = self._history, []
+                requests, self._requests = self._requests, {}
+                drivers, self._drivers = self._drivers, {}
+                self._cond.notify_all()
+            rows = len(history) + len(requests) + len(drivers)
+            if not rows:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                with self.db.transaction() as cursor:
+                    if history:
+                        cursor.executemany('''
+                            INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status)
+                            VALUES (?, ?, ?, ?, ?)
+                        ''', history)
+                    if requests:
+                        cursor.executemany('''
+                            UPDATE ambulance_requests
+                            SET driver_lat = ?, driver_lng = ?,
+                                route_distance_km = ?, route_duration_minutes = ?
+                            WHERE id = ?
+                        ''', [(*value, request_id) for request_id, value in requests.items()])
+                    if drivers:
+                        cursor.executemany('UPDATE drivers SET current_lat = ?, current_lng = ? WHERE id = ?',
+                                           [(*value, driver_id) for driver_id, value in drivers.items()])
+            except sqlite3.Error as e:
+                print(f"Location writer flush failed ({rows} rows, will retry): {e}")
+                self.errors += 1
+                self._requeue(history, requests, drivers)
+                return 0
+
+            self.flushes += 1
+            self.rows_written += rows
+            self.max_batch = max(self.max_batch, rows)
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            return rows
+
+    def _requeue(self, history, requests, drivers):
+        """
+        Put a failed batch back without overwriting anything newer that arrived meanwhile.
+        If the database keeps failing, the oldest history rows are dropped to stay within bounds.
+        """
+        with self._cond:
+            self._history[:0] = history
+            for buffer, batch in ((self._requests, requests), (self._drivers, drivers)):
+                for key, value in batch.items():
+                    buffer.setdefault(key, value)
+            overflow = min(self._pending() - self.max_pending, len(self._history))
+            if overflow > 0:
+                del self._history[:overflow]
+                self.dropped += overflow
+                print(f"Location writer dropped {overflow} history rows")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop.is_set() or self._pending() >= self.flush_rows,
+                                    timeout=self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Location writer error: {e}")
+        self.flush()
+
+    def start(self):
+        if not self.enabled:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='location-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the background thread after a final flush"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            pending = self._pending()
+        return {
+            'enabled': self.enabled,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'pending': pending,
+            'enqueued': self.enqueued,
+            'collapsed': self.collapsed,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'avg_batch': round(self.rows_written / self.flushes, 1) if self.flushes else 0,
+            'max_batch': self.max_batch,
+            'last_flush_ms': self.last_flush_ms,
+            'backpressure_waits': self.backpressure_waits,
+            'producer_flushes': self.producer_flushes,
+            'errors': self.errors,
+            'dropped': self.dropped
+        }
+
+
+location_writer = LocationWriter()
+atexit.register(location_writer.stop)
@@ -0,0 +1,284 @@
+import os
+import sys
+from datetime import datetime
+
+from db import db
+
+
+# MIGRATION CONFIG
+MIGRATE_ON_STARTUP = os.getenv('MIGRATE_ON_STARTUP', 'true').lower() == 'true'  # else run `python migrations.py`
+
+
+def create_base_schema(cursor):
+    """Core tables. Databases created before versioning get any missing request columns added once."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ambulance_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            patient_name TEXT,
+            contact TEXT,
+            pickup_location TEXT,
+            destination TEXT,
+            ambulance_type TEXT,
+            origin_lat REAL NOT NULL,
+            origin_lng REAL NOT NULL,
+            destination_lat REAL,
+            destination_lng REAL,
+            status TEXT DEFAULT 'Pending',
+            estimated_arrival_time TEXT,
+            estimated_completion_time TEXT,
+            pickup_lat REAL,
+            pickup_lng REAL,
+            request_time TEXT,
+            estimated_time_minutes INTEGER,
+            driver_lat REAL,
+            driver_lng REAL,
+            route_distance_km REAL,
+            route_duration_minutes REAL,
+            traffic_delay_minutes REAL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # Ambulance Locations Table (for tracking history)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ambulance_locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ambulance_id INTEGER,
+            latitude REAL,
+            longitude REAL,
+            timestamp TEXT,
+            status TEXT,
+            last_updated TEXT,
+            FOREIGN KEY (ambulance_id) REFERENCES ambulance_requests(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS drivers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            current_lat REAL,
+            current_lng REAL,
+            status TEXT DEFAULT 'Available',
+            last_login TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Columns added over time to ambulance_requests (what add_columns.py / init_db used to probe for)
+    cursor.execute('PRAGMA table_info(ambulance_requests)')
+    columns = {column[1] for column in cursor.fetchall()}
+    for column, column_type in (
+        ('pickup_lat', 'REAL'),
+        ('pickup_lng', 'REAL'),
+        ('request_time', 'TEXT'),
+        ('estimated_time_minutes', 'INTEGER'),
+        ('status', 'TEXT'),
+        ('driver_lat', 'REAL'),
+        ('driver_lng', 'REAL'),
+        ('route_distance_km', 'REAL'),
+        ('route_duration_minutes', 'REAL'),
+        ('traffic_delay_minutes', 'REAL'),
+    ):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE ambulance_requests ADD COLUMN {column} {column_type}')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON ambulance_requests(status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_phone ON drivers(phone)')
+
+
+def create_geocode_cache(cursor):
+    # Normalized address / rounded coordinate -> OpenCage result
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            kind TEXT NOT NULL,
+            query TEXT NOT NULL,
+            lat REAL,
+            lng REAL,
+            address TEXT,
+            created_at TEXT,
+            PRIMARY KEY (kind, query)
+        )
+    ''')
+
+
+def create_route_geometry(cursor):
+    # Encoded polylines for each request's route
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS route_geometry (
+            request_id INTEGER PRIMARY KEY,
+            segment_1 TEXT,
+            segment_2 TEXT,
+            segment_1_distance_km REAL,
+            segment_1_duration_minutes REAL,
+            segment_2_distance_km REAL,
+            segment_2_duration_minutes REAL,
+            traffic_aware INTEGER DEFAULT 0,
+            updated_at TEXT,
+            FOREIGN KEY (request_id) REFERENCES ambulance_requests(id)
+        )
+    ''')
+
+
+def create_speed_profiles(cursor):
+    # Running sums per grid cell x hour of week, learned from location history
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS speed_profiles (
+            cell_hour INTEGER PRIMARY KEY,
+            distance_m REAL NOT NULL,
+            seconds REAL NOT NULL,
+            samples INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS speed_profile_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    ''')
+
+
+def add_hot_path_indexes(cursor):
+    # Latest fix per ambulance (tracking, history replay, speed profile rebuilds)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_locations_ambulance_time ON ambulance_locations(ambulance_id, timestamp)')
+    # Admin dashboard join (ambulance_requests.user_id holds the assigned driver)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_user ON ambulance_requests(user_id)')
+    # Driver index load and dispatch batches
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_drivers_status ON drivers(status)')
+    cursor.execute('ANALYZE')
+
+
+def create_location_retention(cursor):
+    # Columnar per-trip tracks (TRK1 blobs, see trajectory.py) for stored and archived trips (see retention.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trip_tracks (
+            request_id INTEGER PRIMARY KEY,
+            started_at TEXT,
+            ended_at TEXT,
+            points INTEGER NOT NULL,
+            last_location_id INTEGER,
+            track BLOB NOT NULL,
+            updated_at TEXT,
+            FOREIGN KEY (request_id) REFERENCES ambulance_requests(id)
+        )
+    ''')
+    # Finished trips already downsampled in the live table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS location_retention (
+            ambulance_id INTEGER PRIMARY KEY,
+            points_before INTEGER,
+            points_after INTEGER,
+            downsampled_at TEXT
+        )
+    ''')
+
+
+def add_tracking_tokens(cursor):
+    # Secret issued at booking; live tracking of a request needs it. Older requests keep NULL
+    # (admins and the assigned driver can still watch them)
+    cursor.execute('PRAGMA table_info(ambulance_requests)')
+    if 'tracking_token' not in {column[1] for column in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE ambulance_requests ADD COLUMN tracking_token TEXT')
+
+
+# Ordered steps; never edit or renumber one that has shipped, append a new one instead
+MIGRATIONS = [
+    (1, 'base schema', create_base_schema),
+    (2, 'geocode cache', create_geocode_cache),
+    (3, 'route geometry', create_route_geometry),
+    (4, 'speed profiles', create_speed_profiles),
+    (5, 'hot path indexes', add_hot_path_indexes),
+    (6, 'location retention', create_location_retention),
+    (7, 'tracking tokens', add_tracking_tokens),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'")
+    if not cursor.fetchone():
+        return 0
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+
+def pending(database=db):
+    with database.transaction() as cursor:
+        version = current_version(cursor)
+    return [(number, name) for number, name, _ in MIGRATIONS if number > version]
+
+
+def auto_vacuum_mode(database=db):
+    with database.transaction() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        return {0: 'none', 1: 'full', 2: 'incremental'}.get(cursor.fetchone()[0])
+
+
+def convert_auto_vacuum(database=db):
+    """
+    One-off VACUUM so a database created before DB_AUTO_VACUUM takes the setting. Rewrites the
+    whole file and holds the write lock while it runs; do it in a quiet window.
+    """
+    with database.connection() as conn:
+        conn.execute(f'PRAGMA auto_vacuum={database.auto_vacuum}')
+        conn.execute('VACUUM')
+    return auto_vacuum_mode(database)
+
+
+def migrate(database=db, target=LATEST_VERSION):
+    """Apply pending migrations up to `target`, each in its own transaction. Returns the applied versions."""
+    with database.transaction() as cursor:
+        if current_version(cursor) >= target:
+            return []  # the common startup path: one read, no probing
+
+    applied = []
+    for number, name, step in MIGRATIONS:
+        if number > target:
+            break
+        # BEGIN IMMEDIATE + re-check, so two workers starting together never apply a step twice
+        with database.transaction(immediate=True) as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TEXT NOT NULL
+                )
+            ''')
+            if number <= current_version(cursor):
+                continue
+            step(cursor)
+            cursor.execute('INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                           (number, name, datetime.now().isoformat()))
+        print(f"Applied migration {number}: {name}")
+        applied.append(number)
+    return applied
+
+
+if __name__ == '__main__':
+    # python migrations.py [status | upgrade [version] | vacuum]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    if command == 'status':
+        with db.transaction() as cursor:
+            print(f"{db.path}: schema version {current_version(cursor)} of {LATEST_VERSION}")
+        for number, name in pending():
+            print(f"  pending {number}: {name}")
+        print(f"  auto_vacuum: {auto_vacuum_mode()}")
+    elif command == 'upgrade':
+        target = int(sys.argv[2]) if len(sys.argv) > 2 else LATEST_VERSION
+        applied = migrate(target=target)
+        print(f"{db.path}: {'applied ' + ', '.join(map(str, applied)) if applied else 'already up to date'}")
+    elif command == 'vacuum':
+        print(f"{db.path}: auto_vacuum {auto_vacuum_mode()} -> {convert_auto_vacuum()}")
+    else:
+        sys.exit('usage: python migrations.py [status | upgrade [version] | vacuum]')
@@ -0,0 +1,271 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# PROVIDER CONFIG
+# Base URLs can be pointed at a local stub server (e.g. OSRM_BASE_URL=http://127.0.0.1:8089)
+# Routing providers don't retry timeouts: a second full timeout would make the TomTom -> OSRM
+# fallback chain slower than having no retries at all
+PROVIDER_DEFAULTS = {
+    'tomtom': {'base_url': 'https://api.tomtom.com', 'timeout': 10, 'max_retries': 1, 'retry_timeouts': False},
+    'osrm': {'base_url': 'https://router.project-osrm.org', 'timeout': 5, 'max_retries': 1, 'retry_timeouts': False},
+    'opencage': {'base_url': 'https://api.opencagedata.com', 'timeout': 5, 'max_retries': 2, 'retry_timeouts': True},
+}
+
+PROVIDER_POOL_SIZE = int(os.getenv('PROVIDER_POOL_SIZE', 16))
+PROVIDER_BACKOFF_SECONDS = float(os.getenv('PROVIDER_BACKOFF_SECONDS', 0.2))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', 30))
+
+# Status codes worth retrying: rate limiting and server-side errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Latency histogram buckets: 5 ms .. ~60 s, each bucket 25% wider than the last
+LATENCY_BUCKETS_MS = [5 * (1.25 ** i) for i in range(43)]
+LATENCY_DECAY_AFTER = int(os.getenv('LATENCY_DECAY_AFTER', 1000))
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram with exponential decay.
+    Counts are halved every `decay_after` samples so percentiles follow recent behaviour.
+    """
+
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS, decay_after=LATENCY_DECAY_AFTER):
+        self.buckets_ms = list(buckets_ms)
+        self.counts = [0.0] * (len(self.buckets_ms) + 1)  # last slot is overflow
+        self.decay_after = decay_after
+        self.total = 0.0
+        self.samples = 0
+        self._since_decay = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        index = len(self.buckets_ms)
+        for i, bound in enumerate(self.buckets_ms):
+            if ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.samples += 1
+            self._since_decay += 1
+            if self._since_decay >= self.decay_after:
+                self.counts = [c / 2 for c in self.counts]
+                self.total /= 2
+                self._since_decay = 0
+
+    def percentile(self, p):
+        """Upper bound (in seconds) of the bucket holding the p-th percentile, or None without data"""
+        with self._lock:
+            if self.total <= 0:
+                return None
+            target = self.total * p / 100.0
+            running = 0.0
+            for i, count in enumerate(self.counts):
+                running += count
+                if running >= target:
+                    bound = self.buckets_ms[min(i, len(self.buckets_ms) - 1)]
+                    return bound / 1000
+            return self.buckets_ms[-1] / 1000
+
+    def summary(self):
+        def ms(p):
+            value = self.percentile(p)
+            return round(value * 1000, 1) if value is not None else None
+        return {'samples': self.samples, 'p50_ms': ms(50), 'p95_ms': ms(95), 'p99_ms': ms(99)}
+
+
+class CircuitOpenError(Exception):
+    """Raised when a provider's circuit breaker is open and the call is skipped"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a provider after repeated failures.
+    closed -> open after `failure_threshold` consecutive failures,
+    open -> half_open after `reset_seconds`, where one trial call decides what happens next.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Free the half-open trial slot when a call ends without a success or failure verdict"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class ProviderClient:
+    """
+    Keep-alive HTTP client for one external provider.
+    Each provider gets its own connection pool, timeout, retry budget and circuit breaker.
+    """
+
+    def __init__(self, name, base_url, timeout, max_retries=1, backoff_seconds=PROVIDER_BACKOFF_SECONDS,
+                 pool_size=PROVIDER_POOL_SIZE, breaker=None, retry_timeouts=True):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_timeouts = retry_timeouts
+        self.backoff_seconds = backoff_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyHistogram()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuited = 0
+
+    def get(self, path, params=None, **kwargs):
+        return self.request('GET', path, params=params, **kwargs)
+
+    def post(self, path, params=None, json=None, **kwargs):
+        return self.request('POST', path, params=params, json=json, **kwargs)
+
+    def _retryable(self, error):
+        """Connection failures are retried; timeouts only if retry_timeouts; other errors never"""
+        if isinstance(error, requests.Timeout):
+            return self.retry_timeouts
+        return isinstance(error, requests.ConnectionError)
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request with bounded retries and jittered exponential backoff.
+        Returns the last response (callers still check status_code) or raises the last
+        requests error. Raises CircuitOpenError without touching the network when the
+        breaker is open.
+        """
+        if not self.breaker.allow_request():
+            self.short_circuited += 1
+            raise CircuitOpenError(f"{self.name} circuit is open, skipping call")
+
+        kwargs.setdefault('timeout', self.timeout)
+        url = path if path.startswith('http') else f"{self.base_url}{path}"
+        response = None
+        last_error = None
+        verdict = False
+        self.calls += 1
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self.retries += 1
+                    # Full jitter keeps retries from many workers from lining up
+                    time.sleep(random.uniform(0, self.backoff_seconds * (2 ** (attempt - 1))))
+                started = time.monotonic()
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.RequestException as e:
+                    if isinstance(e, requests.Timeout):
+                        self.latency.record(time.monotonic() - started)
+                    last_error = e
+                    response = None
+                    if self._retryable(e):
+                        continue
+                    break
+                self.latency.record(time.monotonic() - started)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    verdict = True
+                    return response
+
+            self.failures += 1
+            self.breaker.record_failure()
+            verdict = True
+            if response is not None:
+                return response
+            raise last_error
+        finally:
+            # Anything else escaping the session must not leave a half-open breaker stuck on its trial
+            if not verdict:
+                self.breaker.release_trial()
+
+    def stats(self):
+        return {
+            'base_url': self.base_url,
+            'timeout': self.timeout,
+            'max_retries': self.max_retries,
+            'retry_timeouts': self.retry_timeouts,
+            'calls': self.calls,
+            'retries': self.retries,
+            'failures': self.failures,
+            'short_circuited': self.short_circuited,
+            'circuit_state': self.breaker.state,
+            'latency': self.latency.summary()
+        }
+
+
+def _client_from_env(name):
+    """Build a provider client, letting <NAME>_BASE_URL / _TIMEOUT / _MAX_RETRIES / _RETRY_TIMEOUTS override defaults"""
+    defaults = PROVIDER_DEFAULTS[name]
+    prefix = name.upper()
+    return ProviderClient(
+        name,
+        base_url=os.getenv(f'{prefix}_BASE_URL', defaults['base_url']),
+        timeout=float(os.getenv(f'{prefix}_TIMEOUT', defaults['timeout'])),
+        max_retries=int(os.getenv(f'{prefix}_MAX_RETRIES', defaults['max_retries'])),
+        retry_timeouts=os.getenv(f'{prefix}_RETRY_TIMEOUTS', str(defaults['retry_timeouts'])).lower() == 'true'
+    )
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name):
+    """Return the shared client for a provider ('tomtom', 'osrm' or 'opencage')"""
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = _client_from_env(name)
+        return _clients[name]
+
+
+def provider_stats():
+    with _clients_lock:
+        return {name: client.stats() for name, client in _clients.items()}
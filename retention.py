@@ -0,0 +1,340 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from db import db
+from geometry import Polyline
+from trajectory import Track, trajectories
+
+
+# LOCATION RETENTION CONFIG
+RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', 'true').lower() == 'true'
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 3600))  # seconds between passes
+RETENTION_DOWNSAMPLE_AFTER_HOURS = float(os.getenv('RETENTION_DOWNSAMPLE_AFTER_HOURS', 6))  # finished trips idle this long
+RETENTION_TOLERANCE_M = float(os.getenv('RETENTION_TOLERANCE_M', 10))  # Douglas-Peucker tolerance for downsampling
+RETENTION_MAX_GAP_SECONDS = float(os.getenv('RETENTION_MAX_GAP_SECONDS', 60))  # always keep one ping per this interval
+RETENTION_ARCHIVE_AFTER_DAYS = float(os.getenv('RETENTION_ARCHIVE_AFTER_DAYS', 30))  # then clear from the live table
+RETENTION_BATCH_TRIPS = int(os.getenv('RETENTION_BATCH_TRIPS', 20))  # trips per write transaction
+RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', 0.05))  # seconds between transactions, lets writers in
+RETENTION_VACUUM_PAGES = int(os.getenv('RETENTION_VACUUM_PAGES', 500))  # pages freed per incremental_vacuum step
+# Leave rows alone until speed_profiles has folded them in; set false when speed profiles never run
+RETENTION_WAIT_FOR_SPEED_PROFILES = os.getenv('RETENTION_WAIT_FOR_SPEED_PROFILES', 'true').lower() == 'true'
+
+# Terminal request statuses: only these trips are downsampled or archived (rows of deleted requests are archived too)
+FINISHED_STATUSES = ('Patient Reached',)
+
+
+def stationary(lats, lngs):
+    """All pings on one position: a parked ambulance, or history flattened by the old live-position UPDATE"""
+    return len(set(zip(lats, lngs))) == 1
+
+
+def downsample_mask(lats, lngs, times_ms, statuses, tolerance_m=RETENTION_TOLERANCE_M,
+                    max_gap_seconds=RETENTION_MAX_GAP_SECONDS):
+    """
+    Keep flags for one trip's pings (in time order): the Douglas-Peucker shape at tolerance_m,
+    the first ping of every status, and enough pings that no gap exceeds max_gap_seconds
+    (speed and replay timing stay usable). A stationary trip keeps only the first ping of
+    every status and its last ping.
+    """
+    if stationary(lats, lngs):
+        return [1 if i == 0 or i == len(lats) - 1 or statuses[i] != statuses[i - 1] else 0
+                for i in range(len(lats))]
+    keep = Polyline.from_coordinates(zip(lats, lngs)).simplify_mask(tolerance_m)
+    max_gap_ms = max_gap_seconds * 1000
+    last_kept = times_ms[0] if times_ms else 0
+    for i in range(1, len(keep) - 1):
+        if statuses[i] != statuses[i - 1]:
+            keep[i] = 1
+        elif not keep[i] and times_ms[i + 1] - last_kept > max_gap_ms:
+            keep[i] = 1
+        if keep[i]:
+            last_kept = times_ms[i]
+    return keep
+
+
+class LocationRetention:
+    """
+    Keeps ambulance_locations from growing forever. Each pass, in small batched transactions:
+
+    1. Store and downsample: finished trips idle for RETENTION_DOWNSAMPLE_AFTER_HOURS are saved
+       at full resolution to the trajectory store (trajectory.py), then their live rows are
+       thinned to the pings needed for their shape (Douglas-Peucker at RETENTION_TOLERANCE_M),
+       status changes and one ping per RETENTION_MAX_GAP_SECONDS.
+    2. Archive: trips idle for RETENTION_ARCHIVE_AFTER_DAYS get any rows not yet stored merged
+       into their track, and their live rows are deleted.
+    3. Reclaim: freed pages are returned to the filesystem with incremental_vacuum, a few
+       hundred pages per step, then the WAL is checkpointed passively.
+
+    Only trips of requests in FINISHED_STATUSES are touched, so a running trip that has been quiet
+    for a long time is never archived. With RETENTION_WAIT_FOR_SPEED_PROFILES, a trip also waits
+    until speed_profiles has folded in all its rows, so learned speeds never miss data; trips held
+    back this way are counted in stats() and logged, since a stalled speed-profile job stalls
+    retention too. Rows without coordinates or a parseable timestamp carry no track and are not stored.
+    Stationary trips (every ping on one position) are stored and thinned like any other, down
+    to the first ping of each status and the last ping.
+    """
+
+    def __init__(self, database=db, store=trajectories, tolerance_m=RETENTION_TOLERANCE_M,
+                 max_gap_seconds=RETENTION_MAX_GAP_SECONDS, downsample_after_hours=RETENTION_DOWNSAMPLE_AFTER_HOURS,
+                 archive_after_days=RETENTION_ARCHIVE_AFTER_DAYS,
+                 batch_trips=RETENTION_BATCH_TRIPS, batch_pause=RETENTION_BATCH_PAUSE,
+                 vacuum_pages=RETENTION_VACUUM_PAGES, enabled=RETENTION_ENABLED,
+                 wait_for_speed_profiles=RETENTION_WAIT_FOR_SPEED_PROFILES):
+        self.db = database
+        self.store = store
+        self.tolerance_m = tolerance_m
+        self.max_gap_seconds = max_gap_seconds
+        self.downsample_after = timedelta(hours=downsample_after_hours)
+        self.archive_after = timedelta(days=archive_after_days)
+        self.batch_trips = batch_trips
+        self.batch_pause = batch_pause
+        self.vacuum_pages = vacuum_pages
+        self.enabled = enabled
+        self.wait_for_speed_profiles = wait_for_speed_profiles
+        self._lock = threading.Lock()  # one pass at a time
+        self._stop = threading.Event()
+        self._thread = None
+        self.passes = 0
+        self.trips_downsampled = 0
+        self.rows_downsampled = 0
+        self.trips_archived = 0
+        self.rows_archived = 0
+        self.tracks_stored = 0
+        self.pages_vacuumed = 0
+        self.waiting = {'downsample': 0, 'archive': 0}  # trips held back for speed_profiles in the last pass
+        self.errors = 0
+        self.last_run = None
+        self.last_run_ms = None
+
+    def _processed_id(self, cursor):
+        cursor.execute("SELECT value FROM speed_profile_state WHERE name = 'last_location_id'")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _ready(self, cursor, trips, step):
+        """Ids of the (ambulance_id, max row id) trips speed_profiles has caught up with; the rest wait"""
+        if not self.wait_for_speed_profiles:
+            return [ambulance_id for ambulance_id, _ in trips]
+        processed = self._processed_id(cursor)
+        ready = [ambulance_id for ambulance_id, max_id in trips if max_id <= processed]
+        self.waiting[step] = len(trips) - len(ready)
+        if self.waiting[step]:
+            print(f"Location retention: {self.waiting[step]} trips wait to {step} until speed_profiles "
+                  f"passes location id {max(max_id for _, max_id in trips)} (at {processed})")
+        return ready
+
+    def _stopping(self):
+        """stop() cuts a background pass short; explicit run() calls always finish"""
+        return self._stop.is_set() and threading.current_thread() is self._thread
+
+    def _batches(self, ids):
+        for i in range(0, len(ids), self.batch_trips):
+            if self._stopping():
+                return
+            if i:
+                time.sleep(self.batch_pause)
+            yield ids[i:i + self.batch_trips]
+
+    # Downsampling
+
+    def _merged_track(self, cursor, ambulance_id, points):
+        """Stored track plus the given live points it does not hold yet, as a trip_tracks row (None if unchanged)"""
+        track, last_id = self.store.stored(cursor, ambulance_id)
+        new = [point for point in points if point[0] > last_id]
+        if not new:
+            return None
+        _, lats, lngs, times_ms, statuses = zip(*new)
+        if stationary(lats, lngs):
+            new = [point for point, kept in zip(new, downsample_mask(lats, lngs, times_ms, statuses)) if kept]
+        new_track = Track.from_points([point[1:] for point in new])
+        track = track.merge(new_track) if track is not None else new_track
+        return self.store.encode(ambulance_id, track, max(point[0] for point in new))
+
+    def downsample(self, now=None):
+        """Store finished, idle trips and thin out their live rows. Returns the number of rows deleted."""
+        cutoff = ((now or datetime.now()) - self.downsample_after).isoformat()
+        placeholders = ', '.join('?' * len(FINISHED_STATUSES))
+        with self.db.transaction() as cursor:
+            cursor.execute(f'''
+                SELECT al.ambulance_id, MAX(al.id) FROM ambulance_locations al
+                JOIN ambulance_requests ar ON ar.id = al.ambulance_id
+                LEFT JOIN location_retention lr ON lr.ambulance_id = al.ambulance_id
+                WHERE ar.status IN ({placeholders}) AND lr.ambulance_id IS NULL
+                GROUP BY al.ambulance_id
+                HAVING MAX(al.timestamp) < ?
+            ''', (*FINISHED_STATUSES, cutoff))
+            trips = self._ready(cursor, cursor.fetchall(), 'downsample')
+
+        removed = 0
+        for batch in self._batches(trips):
+            # Encode and simplify from a read snapshot; the write transaction only inserts and deletes
+            tracks, drop, markers = [], [], []
+            with self.db.transaction() as cursor:
+                for ambulance_id in batch:
+                    points = self.store.live_points(cursor, ambulance_id)
+                    track_row = self._merged_track(cursor, ambulance_id, points)
+                    if track_row:
+                        tracks.append(track_row)
+                    dropped = 0
+                    if len(points) > 2:
+                        row_ids, lats, lngs, times_ms, statuses = zip(*points)
+                        keep = downsample_mask(lats, lngs, times_ms, statuses, self.tolerance_m, self.max_gap_seconds)
+                        trip_drop = [(row_id,) for row_id, kept in zip(row_ids, keep) if not kept]
+                        drop.extend(trip_drop)
+                        dropped = len(trip_drop)
+                    markers.append((ambulance_id, len(points), len(points) - dropped, datetime.now().isoformat()))
+            with self.db.transaction(immediate=True) as cursor:
+                self.store.save_many(cursor, tracks)
+                cursor.executemany('DELETE FROM ambulance_locations WHERE id = ?', drop)
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO location_retention (ambulance_id, points_before, points_after, downsampled_at)
+                    VALUES (?, ?, ?, ?)
+                ''', markers)
+            removed += len(drop)
+            self.tracks_stored += len(tracks)
+            self.trips_downsampled += len(batch)
+        self.rows_downsampled += removed
+        return removed
+
+    # Archiving
+
+    def archive(self, now=None):
+        """Clear idle, finished trips from ambulance_locations once their track is stored. Returns the number of rows removed."""
+        cutoff = ((now or datetime.now()) - self.archive_after).isoformat()
+        placeholders = ', '.join('?' * len(FINISHED_STATUSES))
+        with self.db.transaction() as cursor:
+            cursor.execute(f'''
+                SELECT al.ambulance_id, MAX(al.id) FROM ambulance_locations al
+                LEFT JOIN ambulance_requests ar ON ar.id = al.ambulance_id
+                WHERE ar.id IS NULL OR ar.status IN ({placeholders})
+                GROUP BY al.ambulance_id
+                HAVING MAX(al.timestamp) < ?
+            ''', (*FINISHED_STATUSES, cutoff))
+            trips = self._ready(cursor, cursor.fetchall(), 'archive')
+
+        removed = 0
+        for batch in self._batches(trips):
+            # Rows newer than the snapshot stay live until the next pass
+            tracks, cleared = [], []
+            with self.db.transaction() as cursor:
+                for ambulance_id in batch:
+                    track_row = self._merged_track(cursor, ambulance_id, self.store.live_points(cursor, ambulance_id))
+                    if track_row:
+                        tracks.append(track_row)
+                    cursor.execute('SELECT MAX(id) FROM ambulance_locations WHERE ambulance_id = ?', (ambulance_id,))
+                    cleared.append((ambulance_id, cursor.fetchone()[0]))
+            with self.db.transaction(immediate=True) as cursor:
+                self.store.save_many(cursor, tracks)
+                for ambulance_id, max_id in cleared:
+                    cursor.execute('DELETE FROM ambulance_locations WHERE ambulance_id = ? AND id <= ?',
+                                   (ambulance_id, max_id))
+                    removed += cursor.rowcount
+                cursor.executemany('DELETE FROM location_retention WHERE ambulance_id = ?',
+                                   [(ambulance_id,) for ambulance_id, _ in cleared])
+            self.tracks_stored += len(tracks)
+            self.trips_archived += len(batch)
+        self.rows_archived += removed
+        return removed
+
+    # Space reclamation
+
+    def _space(self):
+        with self.db.transaction() as cursor:
+            cursor.execute('PRAGMA auto_vacuum')
+            mode = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            page_size = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_count')
+            page_count = cursor.fetchone()[0]
+            cursor.execute('PRAGMA freelist_count')
+            free = cursor.fetchone()[0]
+        return mode, page_size, page_count, free
+
+    def vacuum(self):
+        """Release free pages a step at a time (auto_vacuum=INCREMENTAL only). Returns pages freed."""
+        mode, _, _, free = self._space()
+        if mode != 2:
+            return 0
+        freed = 0
+        while free and not self._stopping():
+            with self.db.connection() as conn:
+                # executescript steps the pragma to completion; execute() would free a single page
+                conn.executescript(f'PRAGMA incremental_vacuum({self.vacuum_pages})')
+            remaining = self._space()[3]
+            if remaining >= free:
+                break
+            freed += free - remaining
+            free = remaining
+            time.sleep(self.batch_pause)
+        with self.db.connection() as conn:
+            conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+        self.pages_vacuumed += freed
+        return freed
+
+    # Scheduling
+
+    def run(self, now=None):
+        """One full pass: downsample, archive, reclaim. Returns a summary dict."""
+        with self._lock:
+            started = time.perf_counter()
+            summary = {
+                'rows_downsampled': self.downsample(now),
+                'rows_archived': self.archive(now),
+                'pages_vacuumed': self.vacuum()
+            }
+            self.passes += 1
+            self.last_run = datetime.now().isoformat()
+            self.last_run_ms = round((time.perf_counter() - started) * 1000, 1)
+            return summary
+
+    def _loop(self):
+        while not self._stop.wait(RETENTION_INTERVAL):
+            try:
+                self.run()
+            except Exception as e:
+                self.errors += 1
+                print(f"Location retention pass failed: {e}")
+
+    def start(self):
+        if not self.enabled:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='location-retention', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        mode, page_size, page_count, free = self._space()
+        return {
+            'enabled': self.enabled,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'passes': self.passes,
+            'trips_downsampled': self.trips_downsampled,
+            'rows_downsampled': self.rows_downsampled,
+            'trips_archived': self.trips_archived,
+            'rows_archived': self.rows_archived,
+            'tracks_stored': self.tracks_stored,
+            'pages_vacuumed': self.pages_vacuumed,
+            'wait_for_speed_profiles': self.wait_for_speed_profiles,
+            'trips_waiting_for_speed_profiles': dict(self.waiting),
+            'auto_vacuum': {0: 'none', 1: 'full', 2: 'incremental'}.get(mode),
+            'db_size_mb': round(page_size * page_count / 1e6, 2),
+            'free_pages': free,
+            'errors': self.errors,
+            'last_run': self.last_run,
+            'last_run_ms': self.last_run_ms
+        }
+
+
+retention = LocationRetention()
+
+
+if __name__ == '__main__':
+    # python retention.py  (one pass now, e.g. from cron when RETENTION_ENABLED=false)
+    print(retention.run())
+    print(retention.stats())
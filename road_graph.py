@@ -0,0 +1,488 @@
+import bz2
+import gzip
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from math import floor, inf, radians, cos
+
+import numpy as np
+
+from geometry import Polyline
+from spatial import haversine_np
+
+
+# ROAD GRAPH CONFIG
+ROAD_GRAPH_PATH = os.getenv('ROAD_GRAPH_PATH')  # .npz built with `python road_graph.py build`, or a raw .osm extract
+ROAD_GRAPH_LANDMARKS = int(os.getenv('ROAD_GRAPH_LANDMARKS', 16))
+ROAD_GRAPH_ACTIVE_LANDMARKS = int(os.getenv('ROAD_GRAPH_ACTIVE_LANDMARKS', 4))  # best landmarks used per query
+ROAD_GRAPH_SNAP_MAX_M = float(os.getenv('ROAD_GRAPH_SNAP_MAX_M', 500))  # points further from the graph are not routed
+ROAD_GRAPH_ACCESS_SPEED_KMH = float(os.getenv('ROAD_GRAPH_ACCESS_SPEED_KMH', 20))  # off-graph leg to the snapped node
+ROAD_GRAPH_CELL_DEG = 0.005  # snapping grid (~550 m)
+
+# Free-flow speeds (km/h) by OSM highway class; ways with other highway values are not drivable
+HIGHWAY_SPEEDS_KMH = {
+    'motorway': 90, 'motorway_link': 50,
+    'trunk': 70, 'trunk_link': 40,
+    'primary': 55, 'primary_link': 35,
+    'secondary': 45, 'secondary_link': 30,
+    'tertiary': 35, 'tertiary_link': 25,
+    'unclassified': 30, 'residential': 25,
+    'living_street': 10, 'service': 15, 'road': 25,
+}
+ONEWAY_BY_DEFAULT = {'motorway', 'motorway_link'}
+
+
+class RoadGraph:
+    """
+    Directed road graph in compressed sparse row form: the out-edges of node v are
+    targets[indptr[v]:indptr[v + 1]], with travel time (seconds) and length (metres) per edge.
+    Optional ALT landmarks (distances to and from a few far-apart nodes) give A* a tight lower bound.
+    """
+
+    def __init__(self, lat, lng, indptr, targets, seconds, meters, lm_from=None, lm_to=None):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.seconds = np.asarray(seconds, dtype=np.float32)
+        self.meters = np.asarray(meters, dtype=np.float32)
+        self.lm_from = lm_from  # (nodes, landmarks) seconds from each landmark
+        self.lm_to = lm_to      # (nodes, landmarks) seconds to each landmark
+        self._build_search_arrays()
+        self._build_landmark_arrays()
+        self._build_snap_grid()
+
+    @property
+    def node_count(self):
+        return len(self.lat)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    # Construction
+
+    @classmethod
+    def from_edges(cls, lat, lng, sources, targets, meters, seconds):
+        """Build the CSR arrays from a directed edge list"""
+        sources = np.asarray(sources, dtype=np.int64)
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(len(lat) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(lat)), out=indptr[1:])
+        return cls(lat, lng, indptr, np.asarray(targets)[order],
+                   np.asarray(seconds)[order], np.asarray(meters)[order])
+
+    @classmethod
+    def grid(cls, rows, cols, spacing_m=200, origin=(12.9, 77.5), speeds_kmh=(30, 50, 70), seed=1):
+        """
+        Synthetic rows x cols street grid with two-way streets and a random speed per block,
+        for tests and benchmarks without an OSM extract.
+        """
+        rng = np.random.default_rng(seed)
+        dlat = np.degrees(spacing_m / 6371000)
+        dlng = dlat / cos(radians(origin[0]))
+        r, c = np.divmod(np.arange(rows * cols), cols)
+        lat = origin[0] + r * dlat
+        lng = origin[1] + c * dlng
+
+        ids = np.arange(rows * cols).reshape(rows, cols)
+        pairs = np.concatenate([
+            np.column_stack([ids[:, :-1].ravel(), ids[:, 1:].ravel()]),
+            np.column_stack([ids[:-1, :].ravel(), ids[1:, :].ravel()]),
+        ])
+        speeds = rng.choice(speeds_kmh, size=len(pairs)).astype(np.float64)
+        meters = haversine_np(lat[pairs[:, 0]], lng[pairs[:, 0]], lat[pairs[:, 1]], lng[pairs[:, 1]]) * 1000
+        seconds = meters / (speeds / 3.6)
+        sources = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        targets = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        return cls.from_edges(lat, lng, sources, targets, np.tile(meters, 2), np.tile(seconds, 2))
+
+    @classmethod
+    def from_osm(cls, path):
+        """Parse drivable ways from an OSM XML extract (.osm, .osm.gz or .osm.bz2)"""
+        opener = gzip.open if path.endswith('.gz') else bz2.open if path.endswith('.bz2') else open
+        node_coords = {}
+        ways = []
+        with opener(path, 'rb') as f:
+            for _, element in ET.iterparse(f, events=('end',)):
+                if element.tag == 'node':
+                    node_coords[int(element.get('id'))] = (float(element.get('lat')), float(element.get('lon')))
+                    element.clear()
+                elif element.tag == 'way':
+                    tags = {t.get('k'): t.get('v') for t in element.iter('tag')}
+                    highway = tags.get('highway')
+                    if highway in HIGHWAY_SPEEDS_KMH and tags.get('access') not in ('no', 'private'):
+                        refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+                        ways.append((refs, _way_speed(tags, highway), _way_direction(tags, highway)))
+                    element.clear()
+                elif element.tag == 'relation':
+                    element.clear()
+
+        # Keep only nodes used by drivable ways, numbered densely
+        index = {}
+        lat, lng = [], []
+        sources, targets, speeds = array('q'), array('q'), array('d')
+        for refs, speed_kmh, direction in ways:
+            refs = [ref for ref in refs if ref in node_coords]
+            for a, b in zip(refs, refs[1:]):
+                for ref in (a, b):
+                    if ref not in index:
+                        index[ref] = len(lat)
+                        lat.append(node_coords[ref][0])
+                        lng.append(node_coords[ref][1])
+                if direction >= 0:
+                    sources.append(index[a])
+                    targets.append(index[b])
+                    speeds.append(speed_kmh)
+                if direction <= 0:
+                    sources.append(index[b])
+                    targets.append(index[a])
+                    speeds.append(speed_kmh)
+
+        lat = np.array(lat)
+        lng = np.array(lng)
+        sources = np.frombuffer(sources, dtype=np.int64)
+        targets = np.frombuffer(targets, dtype=np.int64)
+        meters = haversine_np(lat[sources], lng[sources], lat[targets], lng[targets]) * 1000
+        seconds = meters / (np.frombuffer(speeds, dtype=np.float64) / 3.6)
+        return cls.from_edges(lat, lng, sources, targets, meters, seconds)
+
+    def save(self, path):
+        arrays = dict(lat=self.lat, lng=self.lng, indptr=self.indptr, targets=self.targets,
+                      seconds=self.seconds, meters=self.meters)
+        if self.lm_from is not None:
+            arrays.update(lm_from=self.lm_from, lm_to=self.lm_to)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a graph saved with save(), or parse an OSM extract"""
+        if not path.endswith('.npz'):
+            graph = cls.from_osm(path)
+            graph.add_landmarks()
+            return graph
+        with np.load(path) as data:
+            return cls(data['lat'], data['lng'], data['indptr'], data['targets'], data['seconds'], data['meters'],
+                       data['lm_from'] if 'lm_from' in data else None,
+                       data['lm_to'] if 'lm_to' in data else None)
+
+    def _build_search_arrays(self):
+        # Plain arrays index to Python numbers much faster than numpy inside the search loops
+        self._indptr = array('q', self.indptr.tobytes())
+        self._targets = array('i', self.targets.tobytes())
+        self._seconds = array('f', self.seconds.tobytes())
+
+        # Reverse graph for distances *to* landmarks
+        order = np.argsort(self.targets, kind='stable')
+        sources = np.repeat(np.arange(self.node_count, dtype=np.int32), np.diff(self.indptr))
+        rev_indptr = np.zeros(self.node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.targets, minlength=self.node_count), out=rev_indptr[1:])
+        self._rev_indptr = array('q', rev_indptr.tobytes())
+        self._rev_targets = array('i', sources[order].astype(np.int32).tobytes())
+        self._rev_seconds = array('f', self.seconds[order].tobytes())
+
+    def _build_landmark_arrays(self):
+        if self.lm_from is None:
+            return
+        self.lm_from = np.ascontiguousarray(self.lm_from, dtype=np.float32)
+        self.lm_to = np.ascontiguousarray(self.lm_to, dtype=np.float32)
+        self._lm_from = array('f', self.lm_from.tobytes())
+        self._lm_to = array('f', self.lm_to.tobytes())
+
+    def _build_snap_grid(self):
+        rows = np.floor(self.lat / ROAD_GRAPH_CELL_DEG).astype(np.int64)
+        cols = np.floor(self.lng / ROAD_GRAPH_CELL_DEG).astype(np.int64)
+        order = np.lexsort((cols, rows))
+        self._snap_order = order
+        self._snap_cells = {}
+        if len(order):
+            keys = np.column_stack([rows[order], cols[order]])
+            boundaries = np.nonzero(np.any(np.diff(keys, axis=0) != 0, axis=1))[0] + 1
+            starts = np.concatenate([[0], boundaries])
+            ends = np.concatenate([boundaries, [len(order)]])
+            for start, end in zip(starts, ends):
+                self._snap_cells[(int(keys[start, 0]), int(keys[start, 1]))] = (int(start), int(end))
+
+    # Search
+
+    def _dijkstra_all(self, source, reverse=False):
+        """Travel seconds from (or, reversed, to) one node to every node; inf where unreachable"""
+        indptr, targets, seconds = (
+            (self._rev_indptr, self._rev_targets, self._rev_seconds) if reverse
+            else (self._indptr, self._targets, self._seconds)
+        )
+        dist = [float('inf')] * self.node_count
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > dist[v]:
+                continue
+            for e in range(indptr[v], indptr[v + 1]):
+                w = targets[e]
+                nd = d + seconds[e]
+                if nd < dist[w]:
+                    dist[w] = nd
+                    heapq.heappush(heap, (nd, w))
+        return np.array(dist, dtype=np.float32)
+
+    def add_landmarks(self, count=ROAD_GRAPH_LANDMARKS, seed=1):
+        """
+        Pick `count` landmarks by farthest-point selection and store travel times to and from
+        each of them (ALT preprocessing: 2 * count Dijkstra runs).
+        """
+        if self.node_count == 0:
+            return
+        count = min(count, self.node_count)
+        landmarks = []
+        lm_from = np.empty((self.node_count, count), dtype=np.float32)
+        lm_to = np.empty((self.node_count, count), dtype=np.float32)
+        closest = np.full(self.node_count, np.inf, dtype=np.float32)
+        candidate = random.Random(seed).randrange(self.node_count)
+        for i in range(count):
+            landmarks.append(candidate)
+            lm_from[:, i] = self._dijkstra_all(candidate)
+            lm_to[:, i] = self._dijkstra_all(candidate, reverse=True)
+            # Next landmark: the reachable node farthest from all landmarks so far
+            both = np.minimum(lm_from[:, i], lm_to[:, i])
+            closest = np.minimum(closest, both)
+            reachable = np.where(np.isfinite(closest), closest, -1)
+            candidate = int(np.argmax(reachable))
+        self.lm_from = lm_from
+        self.lm_to = lm_to
+        self._build_landmark_arrays()
+
+    def shortest_path(self, source, target, use_landmarks=True):
+        """
+        A* over travel time, with the ALT lower bound when landmarks are available
+        (plain Dijkstra otherwise). Returns (seconds, [node, ...], settled_nodes) or None if unreachable.
+        """
+        indptr, targets, seconds = self._indptr, self._targets, self._seconds
+        heuristic = self._alt_heuristic(source, target) if use_landmarks and self.lm_from is not None else None
+
+        g = {source: 0.0}
+        parent = {source: -1}
+        closed = set()
+        heap = [(heuristic(source) if heuristic else 0.0, 0.0, source)]
+        while heap:
+            _, d, v = heapq.heappop(heap)
+            if v in closed:
+                continue
+            if v == target:
+                path = []
+                while v != -1:
+                    path.append(v)
+                    v = parent[v]
+                return d, path[::-1], len(closed) + 1
+            closed.add(v)
+            for e in range(indptr[v], indptr[v + 1]):
+                w = targets[e]
+                nd = d + seconds[e]
+                if nd < g.get(w, float('inf')):
+                    g[w] = nd
+                    parent[w] = v
+                    if heuristic:
+                        h = heuristic(w)
+                        if h == float('inf'):
+                            continue  # w cannot reach the target
+                        heapq.heappush(heap, (nd + h, nd, w))
+                    else:
+                        heapq.heappush(heap, (nd, nd, w))
+        return None
+
+    def _alt_heuristic(self, source, target):
+        """Lower bound on seconds from a node to `target` using the landmarks that bound source->target best"""
+        from_t = self.lm_from[target]
+        to_t = self.lm_to[target]
+        bounds = np.maximum(from_t - self.lm_from[source], self.lm_to[source] - to_t)
+        usable = np.isfinite(from_t) & np.isfinite(to_t) & np.isfinite(bounds)
+        active = [int(i) for i in np.argsort(-np.where(usable, bounds, -np.inf))[:ROAD_GRAPH_ACTIVE_LANDMARKS]
+                  if usable[i]]
+        if not active:
+            return lambda v: 0.0
+
+        landmark_count = self.lm_from.shape[1]
+        flat_from = self._lm_from
+        flat_to = self._lm_to
+        targets_from = [float(from_t[i]) for i in active]
+        targets_to = [float(to_t[i]) for i in active]
+        pairs = list(zip(active, targets_from, targets_to))
+
+        def heuristic(v):
+            base = v * landmark_count
+            best = 0.0
+            for i, f_t, t_t in pairs:
+                bound = f_t - flat_from[base + i]
+                if bound > best:
+                    best = bound
+                bound = flat_to[base + i] - t_t
+                if bound > best:
+                    best = bound
+            return best
+        return heuristic
+
+    def nearest_node(self, lat, lng, max_m=ROAD_GRAPH_SNAP_MAX_M):
+        """(node, metres) of the closest graph node within max_m, or None"""
+        row, col = floor(lat / ROAD_GRAPH_CELL_DEG), floor(lng / ROAD_GRAPH_CELL_DEG)
+        reach = int(max_m / (ROAD_GRAPH_CELL_DEG * 111320 * max(cos(radians(lat)), 0.1))) + 1
+        best = None
+        for ring in range(reach + 1):
+            candidates = []
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) != ring:
+                        continue
+                    span = self._snap_cells.get((r, c))
+                    if span:
+                        candidates.append(self._snap_order[span[0]:span[1]])
+            if candidates:
+                nodes = np.concatenate(candidates)
+                distances = haversine_np(lat, lng, self.lat[nodes], self.lng[nodes]) * 1000
+                i = int(np.argmin(distances))
+                if best is None or distances[i] < best[1]:
+                    best = (int(nodes[i]), float(distances[i]))
+            # Nothing in a further ring can beat a node closer than the ring's inner edge
+            if best is not None and best[1] <= ring * ROAD_GRAPH_CELL_DEG * 111320 * cos(radians(lat)):
+                break
+        if best is None or best[1] > max_m:
+            return None
+        return best
+
+    def route(self, start_lat, start_lng, end_lat, end_lng):
+        """Route dict shaped like the TomTom/OSRM providers, or {'success': False, 'error': ...}"""
+        start = self.nearest_node(start_lat, start_lng)
+        end = self.nearest_node(end_lat, end_lng)
+        if start is None or end is None:
+            return {'success': False, 'error': 'Point outside the local road graph'}
+        found = self.shortest_path(start[0], end[0])
+        if found is None:
+            return {'success': False, 'error': 'No local road path'}
+        seconds, path, _ = found
+
+        path_array = np.array(path, dtype=np.int64)
+        meters = float(haversine_np(self.lat[path_array[:-1]], self.lng[path_array[:-1]],
+                                    self.lat[path_array[1:]], self.lng[path_array[1:]]).sum() * 1000)
+        access_m = start[1] + end[1]
+        meters += access_m
+        seconds += access_m / (ROAD_GRAPH_ACCESS_SPEED_KMH / 3.6)
+        coordinates = Polyline.from_coordinates(
+            [(start_lat, start_lng)] + list(zip(self.lat[path_array], self.lng[path_array])) + [(end_lat, end_lng)]
+        )
+        return {
+            'coordinates': coordinates,
+            'distance_km': round(meters / 1000, 2),
+            'duration_minutes': round(seconds / 60, 2),
+            'traffic_aware': False,
+            'success': True
+        }
+
+    def stats(self):
+        return {
+            'nodes': self.node_count,
+            'edges': self.edge_count,
+            'landmarks': 0 if self.lm_from is None else self.lm_from.shape[1],
+            'bytes': int(sum(a.nbytes for a in (self.lat, self.lng, self.indptr, self.targets, self.seconds, self.meters))
+                         + (0 if self.lm_from is None else self.lm_from.nbytes + self.lm_to.nbytes))
+        }
+
+
+def _way_speed(tags, highway):
+    """Tagged maxspeed in km/h; missing, unparsable or non-positive values fall back to the class default"""
+    maxspeed = tags.get('maxspeed', '')
+    try:
+        if maxspeed.endswith('mph'):
+            speed = float(maxspeed[:-3]) * 1.609
+        else:
+            speed = float(maxspeed)
+    except ValueError:
+        return HIGHWAY_SPEEDS_KMH[highway]
+    return speed if 0 < speed < inf else HIGHWAY_SPEEDS_KMH[highway]
+
+
+def _way_direction(tags, highway):
+    """1 = forward only, -1 = backward only, 0 = both directions"""
+    oneway = tags.get('oneway')
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway == '-1':
+        return -1
+    if oneway == 'no':
+        return 0
+    if highway in ONEWAY_BY_DEFAULT or tags.get('junction') == 'roundabout':
+        return 1
+    return 0
+
+
+class LocalRouter:
+    """Holds the road graph once it has loaded in the background; routes fail fast until then"""
+
+    def __init__(self):
+        self.graph = None
+        self.error = None
+        self.routes = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.graph is not None
+
+    def load_async(self, path=ROAD_GRAPH_PATH):
+        if not path:
+            return
+        def load():
+            try:
+                started = time.perf_counter()
+                self.graph = RoadGraph.load(path)
+                print(f"Local road graph loaded: {self.graph.node_count} nodes in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                self.error = str(e)
+                print(f"Local road graph failed to load: {e}")
+        threading.Thread(target=load, name='road-graph-loader', daemon=True).start()
+
+    def route(self, start_lat, start_lng, end_lat, end_lng):
+        if self.graph is None:
+            return {'success': False, 'error': 'Local road graph not loaded'}
+        started = time.perf_counter()
+        result = self.graph.route(start_lat, start_lng, end_lat, end_lng)
+        with self._lock:
+            self.routes += 1
+            self.total_ms += (time.perf_counter() - started) * 1000
+            if not result['success']:
+                self.failures += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'ready': self.ready,
+                'error': self.error,
+                'routes': self.routes,
+                'failures': self.failures,
+                'avg_ms': round(self.total_ms / self.routes, 2) if self.routes else None
+            }
+        if self.graph is not None:
+            stats.update(self.graph.stats())
+        return stats
+
+
+local_router = LocalRouter()
+
+
+if __name__ == '__main__':
+    # python road_graph.py build <extract.osm[.gz|.bz2]> <graph.npz>
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print("Usage: python road_graph.py build <extract.osm> <graph.npz>")
+        sys.exit(1)
+    started = time.perf_counter()
+    road_graph = RoadGraph.from_osm(sys.argv[2])
+    print(f"Parsed {road_graph.node_count} nodes, {road_graph.edge_count} edges in {time.perf_counter() - started:.1f}s")
+    road_graph.add_landmarks()
+    road_graph.save(sys.argv[3])
+    print(f"Saved {sys.argv[3]} with {ROAD_GRAPH_LANDMARKS} landmarks in {time.perf_counter() - started:.1f}s")
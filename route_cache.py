@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# ROUTE CACHE CONFIG
+# TomTom results carry live traffic, so they go stale quickly.
+# OSRM geometry never changes for the same road network, so it can live much longer.
+ROUTE_CACHE_TTLS = {
+    'tomtom': int(os.getenv('ROUTE_CACHE_TOMTOM_TTL', 120)),      # seconds
+    'osrm': int(os.getenv('ROUTE_CACHE_OSRM_TTL', 6 * 3600)),     # seconds
+}
+ROUTE_CACHE_DEFAULT_TTL = 300
+ROUTE_CACHE_PRECISION = int(os.getenv('ROUTE_CACHE_PRECISION', 4))  # 4 decimals ~ 11 m
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv('ROUTE_CACHE_MAX_ENTRIES', 2048))
+ROUTE_CACHE_MAX_POINTS = int(os.getenv('ROUTE_CACHE_MAX_POINTS', 500000))
+
+
+def quantize(value, precision=ROUTE_CACHE_PRECISION):
+    """Round a coordinate so nearby GPS fixes share a cache key"""
+    return round(float(value), precision)
+
+
+def route_key(provider, start_lat, start_lng, end_lat, end_lng):
+    """Build the cache key for a provider and a start/end pair"""
+    return (
+        provider,
+        quantize(start_lat), quantize(start_lng),
+        quantize(end_lat), quantize(end_lng)
+    )
+
+
+class RouteCache:
+    """
+    Thread-safe LRU cache for routing results with per-provider TTLs.
+    Memory is capped by entry count and by the total number of route points held.
+    """
+
+    def __init__(self, ttls=None, max_entries=ROUTE_CACHE_MAX_ENTRIES, max_points=ROUTE_CACHE_MAX_POINTS):
+        self.ttls = dict(ROUTE_CACHE_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.max_points = max_points
+        self._entries = OrderedDict()  # key -> (expires_at, points, route)
+        self._points = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, provider, start_lat, start_lng, end_lat, end_lng):
+        """Return a cached route dict or None"""
+        key = route_key(provider, start_lat, start_lng, end_lat, end_lng)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, points, route = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(route, cached=True)
+
+    def put(self, provider, start_lat, start_lng, end_lat, end_lng, route):
+        """Store a successful route dict"""
+        if not route or not route.get('success'):
+            return
+        key = route_key(provider, start_lat, start_lng, end_lat, end_lng)
+        points = len(route.get('coordinates') or [])
+        if points > self.max_points:
+            return
+        expires_at = time.monotonic() + self.ttls.get(provider, ROUTE_CACHE_DEFAULT_TTL)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, points, route)
+            self._points += points
+            while len(self._entries) > self.max_entries or self._points > self.max_points:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, points, _ = self._entries.pop(key)
+        self._points -= points
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._points = 0
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'points': self._points,
+                'max_entries': self.max_entries,
+                'max_points': self.max_points,
+                'ttls': dict(self.ttls)
+            }
+
+
+# Shared cache used by the routing functions in app.py
+route_cache = RouteCache()
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from math import radians, cos, sqrt
+
+from geometry import Polyline
+
+
+# ACTIVE ROUTE CONFIG
+ROUTE_CORRIDOR_METERS = float(os.getenv('ROUTE_CORRIDOR_METERS', 75))
+ACTIVE_ROUTE_TTL = int(os.getenv('ACTIVE_ROUTE_TTL', 120))  # seconds before traffic data is refreshed
+ACTIVE_ROUTE_TOLERANCE_M = float(os.getenv('ACTIVE_ROUTE_TOLERANCE_M', 5))  # simplification before snapping
+
+EARTH_RADIUS_M = 6371000
+
+
+class SegmentPolyline:
+    """
+    One route segment projected to a local flat plane (metres) so GPS fixes
+    can be snapped onto it cheaply. Accurate enough for city-scale routes.
+    """
+
+    def __init__(self, coordinates, distance_km, duration_minutes):
+        self.distance_km = distance_km
+        self.duration_minutes = duration_minutes
+        self.lat0 = coordinates[0][0]
+        self.lng0 = coordinates[0][1]
+        self.cos_lat0 = cos(radians(self.lat0))
+        self.points = [self._to_xy(lat, lng) for lat, lng in coordinates]
+
+        # Cumulative distance along the polyline at every vertex
+        self.cumulative = [0.0]
+        for (x1, y1), (x2, y2) in zip(self.points, self.points[1:]):
+            self.cumulative.append(self.cumulative[-1] + sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2))
+        self.length_m = self.cumulative[-1]
+
+    def _to_xy(self, lat, lng):
+        x = radians(lng - self.lng0) * EARTH_RADIUS_M * self.cos_lat0
+        y = radians(lat - self.lat0) * EARTH_RADIUS_M
+        return x, y
+
+    def project(self, lat, lng):
+        """Return (offset_m, along_m): distance from the polyline and distance travelled along it"""
+        px, py = self._to_xy(lat, lng)
+        if len(self.points) == 1:
+            x, y = self.points[0]
+            return sqrt((px - x) ** 2 + (py - y) ** 2), 0.0
+
+        best_offset = float('inf')
+        best_along = 0.0
+        for i in range(len(self.points) - 1):
+            x1, y1 = self.points[i]
+            x2, y2 = self.points[i + 1]
+            dx, dy = x2 - x1, y2 - y1
+            seg_len_sq = dx * dx + dy * dy
+            t = 0.0 if seg_len_sq == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / seg_len_sq))
+            cx, cy = x1 + t * dx, y1 + t * dy
+            offset = sqrt((px - cx) ** 2 + (py - cy) ** 2)
+            if offset < best_offset:
+                best_offset = offset
+                best_along = self.cumulative[i] + t * sqrt(seg_len_sq)
+        return best_offset, best_along
+
+    def remaining(self, lat, lng, corridor_m):
+        """
+        Remaining (distance_km, duration_minutes) from a fix to the end of the segment,
+        or None if the fix is outside the corridor.
+        """
+        offset, along = self.project(lat, lng)
+        if offset > corridor_m:
+            return None
+        if self.length_m <= 0:
+            return 0.0, 0.0
+        fraction_left = max(0.0, self.length_m - along) / self.length_m
+        return self.distance_km * fraction_left, self.duration_minutes * fraction_left
+
+
+class ActiveRoute:
+    """Route computed for a request in a given status (phase), reused until it goes stale"""
+
+    def __init__(self, route_info, status, ttl=ACTIVE_ROUTE_TTL):
+        self.status = status
+        self.fetched_at = time.monotonic()
+        self.ttl = ttl
+        self.traffic_aware = route_info.get('traffic_aware', False)
+        self.traffic_delay_minutes = route_info.get('traffic_delay_minutes', 0)
+        self.segments = {}
+        for key in ('segment_1', 'segment_2'):
+            segment = route_info.get(key) or {}
+            if segment.get('coordinates'):
+                # Fewer vertices make every snap cheaper; 5 m of error is well inside the corridor
+                coordinates = Polyline.from_coordinates(segment['coordinates']).simplify(ACTIVE_ROUTE_TOLERANCE_M)
+                self.segments[key] = SegmentPolyline(
+                    coordinates, segment['distance_km'], segment['duration_minutes']
+                )
+
+    def is_fresh(self, status):
+        return status == self.status and time.monotonic() - self.fetched_at < self.ttl
+
+    def progress(self, lat, lng, corridor_m=ROUTE_CORRIDOR_METERS):
+        """
+        Build a calculate_route_info-shaped dict for a new fix without calling any provider.
+        Returns None when the fix is off-route or the geometry is unavailable. After 'Started'
+        only segment_2 is needed (a phase-2 route has no first segment).
+        """
+        segment_1 = self.segments.get('segment_1')
+        segment_2 = self.segments.get('segment_2')
+        if segment_2 is None or (self.status == 'Started' and segment_1 is None):
+            return None
+
+        if self.status == 'Started':
+            remaining = segment_1.remaining(lat, lng, corridor_m)
+            if remaining is None:
+                return None
+            seg1_km, seg1_min = remaining
+            seg2_km, seg2_min = segment_2.distance_km, segment_2.duration_minutes
+        else:
+            remaining = segment_2.remaining(lat, lng, corridor_m)
+            if remaining is None:
+                return None
+            seg1_km, seg1_min = 0.0, 0.0
+            seg2_km, seg2_min = remaining
+
+        return {
+            'total_distance_km': round(seg1_km + seg2_km, 2),
+            'total_duration_minutes': round(seg1_min + seg2_min, 2),
+            'traffic_delay_minutes': self.traffic_delay_minutes,
+            'traffic_aware': self.traffic_aware,
+            'from_active_route': True,
+            'segment_1': {
+                'from': 'Driver',
+                'to': 'Patient',
+                'distance_km': round(seg1_km, 2),
+                'duration_minutes': round(seg1_min, 2)
+            },
+            'segment_2': {
+                'from': 'Patient',
+                'to': 'Hospital',
+                'distance_km': round(seg2_km, 2),
+                'duration_minutes': round(seg2_min, 2)
+            }
+        }
+
+
+class ActiveRouteStore:
+    """Active route per request id, shared across request threads"""
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.rerouted = 0
+
+    def get(self, request_id):
+        with self._lock:
+            return self._routes.get(request_id)
+
+    def set(self, request_id, route):
+        with self._lock:
+            self._routes[request_id] = route
+
+    def drop(self, request_id):
+        with self._lock:
+            self._routes.pop(request_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'active_routes': len(self._routes), 'reused': self.reused, 'rerouted': self.rerouted}
+
+
+active_routes = ActiveRouteStore()
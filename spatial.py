@@ -0,0 +1,75 @@
+from math import radians, sin, cos, sqrt, atan2
+
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371
+
+
+# Haversine formula for distance calculation
+def haversine(lat1, lon1, lat2, lon2):
+    """Calculate distance between two coordinates using Haversine formula"""
+    R = EARTH_RADIUS_KM  # Earth radius in kilometers
+
+    lat1 = radians(lat1)
+    lon1 = radians(lon1)
+    lat2 = radians(lat2)
+    lon2 = radians(lon2)
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+
+    distance = R * c
+    return distance
+
+
+def haversine_np(lat, lng, lats, lngs):
+    """
+    Vectorized haversine: distance in km from one point to every point in `lats`/`lngs`.
+    Works on any array-like; NaN coordinates give NaN distances.
+    """
+    lat1 = np.radians(lat)
+    lng1 = np.radians(lng)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lng2 = np.radians(np.asarray(lngs, dtype=np.float64))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(lats1, lngs1, lats2, lngs2):
+    """Pairwise distances (km) between two point sets, shape (len(lats1), len(lats2))"""
+    lat1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, None]
+    lng1 = np.radians(np.asarray(lngs1, dtype=np.float64))[:, None]
+    lat2 = np.radians(np.asarray(lats2, dtype=np.float64))[None, :]
+    lng2 = np.radians(np.asarray(lngs2, dtype=np.float64))[None, :]
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) of a box that contains the circle around a point"""
+    dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = max(cos(radians(lat)), 1e-6)
+    dlng = min(180.0, dlat / cos_lat)
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+def nearest_k(distances, k):
+    """
+    Indices of the k smallest distances, nearest first.
+    Uses argpartition so only the selected k are fully sorted.
+    """
+    distances = np.asarray(distances)
+    n = len(distances)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(distances, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(distances[candidates], kind='stable')]
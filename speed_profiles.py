@@ -0,0 +1,319 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from db import db
+from spatial import haversine_np
+
+
+# SPEED PROFILE CONFIG
+SPEED_PROFILE_CELL_DEG = float(os.getenv('SPEED_PROFILE_CELL_DEG', 0.01))  # ~1.1 km grid cells
+SPEED_PROFILE_MIN_SAMPLES = int(os.getenv('SPEED_PROFILE_MIN_SAMPLES', 5))  # fewer segments fall back to a coarser profile
+SPEED_PROFILE_DEFAULT_KMH = float(os.getenv('SPEED_PROFILE_DEFAULT_KMH', 40))  # used until any history exists
+SPEED_PROFILE_REBUILD_INTERVAL = int(os.getenv('SPEED_PROFILE_REBUILD_INTERVAL', 600))  # seconds
+SPEED_PROFILE_BATCH = int(os.getenv('SPEED_PROFILE_BATCH', 50000))  # location rows read per incremental step
+
+# Segments between consecutive pings outside these bounds are GPS noise, parking or gaps
+MIN_SEGMENT_SECONDS = 5
+MAX_SEGMENT_SECONDS = 300
+MIN_SPEED_KMH = 2
+MAX_SPEED_KMH = 150
+
+HOURS_PER_WEEK = 168
+EPOCH = datetime(1970, 1, 1)
+CELL_OFFSET_ROW = 10000   # keeps cell rows/cols positive when packed into one integer
+CELL_OFFSET_COL = 20000
+CELL_COLS = 40000
+
+
+def hour_of_week(when=None):
+    """0 = Monday 00:00-01:00 ... 167 = Sunday 23:00-24:00 (server local time, like the stored timestamps)"""
+    when = when or datetime.now()
+    return when.weekday() * 24 + when.hour
+
+
+def wall_clock_seconds(when):
+    """
+    Seconds since 1970-01-01 on the local wall clock (not UTC), so hour-of-week buckets computed
+    from it line up with hour_of_week(). Aware timestamps are converted to local time first.
+    """
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)
+    return (when - EPOCH).total_seconds()
+
+
+def cell_ids(lats, lngs, cell_deg=SPEED_PROFILE_CELL_DEG):
+    rows = np.floor(np.asarray(lats, dtype=np.float64) / cell_deg).astype(np.int64) + CELL_OFFSET_ROW
+    cols = np.floor(np.asarray(lngs, dtype=np.float64) / cell_deg).astype(np.int64) + CELL_OFFSET_COL
+    return rows * CELL_COLS + cols
+
+
+def segment_aggregates(ambulance_ids, epoch_s, lats, lngs, cell_deg=SPEED_PROFILE_CELL_DEG):
+    """
+    Turn pings into per (cell, hour-of-week) sums. Pings must be sorted by ambulance then time,
+    with times in wall_clock_seconds().
+    Returns (keys, distance_m, seconds, samples) with key = cell_id * 168 + hour_of_week.
+    """
+    ambulance_ids = np.asarray(ambulance_ids)
+    epoch_s = np.asarray(epoch_s, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    if len(epoch_s) < 2:
+        empty = np.empty(0)
+        return empty.astype(np.int64), empty, empty, empty.astype(np.int64)
+
+    same_trip = ambulance_ids[1:] == ambulance_ids[:-1]
+    seconds = np.diff(epoch_s)
+    meters = haversine_np(lats[:-1], lngs[:-1], lats[1:], lngs[1:]) * 1000
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kmh = meters / seconds * 3.6
+    valid = (same_trip & (seconds >= MIN_SEGMENT_SECONDS) & (seconds <= MAX_SEGMENT_SECONDS)
+             & (kmh >= MIN_SPEED_KMH) & (kmh <= MAX_SPEED_KMH))
+    if not valid.any():
+        empty = np.empty(0)
+        return empty.astype(np.int64), empty, empty, empty.astype(np.int64)
+
+    # Attribute each segment to the cell of its midpoint and the hour it started in
+    mid_cells = cell_ids((lats[:-1] + lats[1:]) / 2, (lngs[:-1] + lngs[1:]) / 2, cell_deg)[valid]
+    start = epoch_s[:-1][valid].astype('datetime64[s]')
+    days = start.astype('datetime64[D]')
+    weekday = (days.astype(np.int64) + 3) % 7   # 1970-01-01 was a Thursday
+    hour = (start - days).astype('timedelta64[h]').astype(np.int64)
+    keys = mid_cells * HOURS_PER_WEEK + weekday * 24 + hour
+
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return (unique,
+            np.bincount(inverse, weights=meters[valid]),
+            np.bincount(inverse, weights=seconds[valid]),
+            np.bincount(inverse).astype(np.int64))
+
+
+class SpeedProfiles:
+    """
+    Observed driving speed per grid cell and hour of week, learned from ambulance_locations.
+    Stored in the speed_profiles table as running sums (distance, time, segment count) so new
+    pings are folded in incrementally; held in memory as sorted NumPy arrays for vectorized lookups.
+    Lookups fall back from (cell, hour) to the cell's all-week speed, to the city-wide speed for
+    that hour, to the overall speed, and finally to SPEED_PROFILE_DEFAULT_KMH.
+    """
+
+    def __init__(self, database=db, cell_deg=SPEED_PROFILE_CELL_DEG, min_samples=SPEED_PROFILE_MIN_SAMPLES,
+                 default_kmh=SPEED_PROFILE_DEFAULT_KMH):
+        self.db = database
+        self.cell_deg = cell_deg
+        self.min_samples = min_samples
+        self.default_kmh = default_kmh
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._set_arrays(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+        self.last_rebuild = None
+        self.rows_processed = 0
+
+    # Model
+
+    def _set_arrays(self, keys, meters, seconds, samples):
+        def speeds(m, s):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(s > 0, m / s * 3.6, np.nan)
+
+        # Sparse (cell, hour) buckets are dropped but still count towards their cell and hour totals
+        cells, cell_inverse = np.unique(keys // HOURS_PER_WEEK, return_inverse=True)
+        cell_samples = np.bincount(cell_inverse, weights=samples, minlength=len(cells))
+        cell_speeds = speeds(np.bincount(cell_inverse, weights=meters, minlength=len(cells)),
+                             np.bincount(cell_inverse, weights=seconds, minlength=len(cells)))
+        trusted_cells = cell_samples >= self.min_samples
+        hours = keys % HOURS_PER_WEEK
+        hour_samples = np.bincount(hours, weights=samples, minlength=HOURS_PER_WEEK)
+        hour_speeds = speeds(np.bincount(hours, weights=meters, minlength=HOURS_PER_WEEK),
+                             np.bincount(hours, weights=seconds, minlength=HOURS_PER_WEEK))
+        hour_speeds[hour_samples < self.min_samples] = np.nan
+        total_seconds = seconds.sum()
+        trusted = samples >= self.min_samples
+        with self._lock:
+            self._keys = keys[trusted]
+            self._speeds = speeds(meters[trusted], seconds[trusted])
+            self._cells = cells[trusted_cells]
+            self._cell_speeds = cell_speeds[trusted_cells]
+            self._hour_speeds = hour_speeds
+            self._overall = float(meters.sum() / total_seconds * 3.6) if total_seconds > 0 else self.default_kmh
+            self._samples = int(samples.sum())
+
+    def load(self):
+        """Reload the in-memory model from the speed_profiles table"""
+        try:
+            with self.db.transaction() as cursor:
+                cursor.execute('SELECT cell_hour, distance_m, seconds, samples FROM speed_profiles ORDER BY cell_hour')
+                rows = cursor.fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        data = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        self._set_arrays(data[:, 0].astype(np.int64), data[:, 1], data[:, 2], data[:, 3].astype(np.int64))
+
+    @staticmethod
+    def _lookup(sorted_keys, values, keys):
+        index = np.searchsorted(sorted_keys, keys)
+        index = np.minimum(index, max(len(sorted_keys) - 1, 0))
+        found = (sorted_keys[index] == keys) if len(sorted_keys) else np.zeros(np.shape(keys), dtype=bool)
+        out = np.full(np.shape(keys), np.nan)
+        if len(sorted_keys):
+            out[found] = values[index[found]]
+        return out
+
+    def speeds_kmh(self, lats, lngs, when=None):
+        """Vectorized expected speed (km/h) at each point for the hour of week of `when` (default now)"""
+        how = hour_of_week(when)
+        cells = cell_ids(np.atleast_1d(lats), np.atleast_1d(lngs), self.cell_deg)
+        with self._lock:
+            speeds = self._lookup(self._keys, self._speeds, cells * HOURS_PER_WEEK + how)
+            missing = np.isnan(speeds)
+            if missing.any():
+                speeds[missing] = self._lookup(self._cells, self._cell_speeds, cells[missing])
+                missing = np.isnan(speeds)
+            if missing.any():
+                hour_speed = self._hour_speeds[how]
+                speeds[missing] = hour_speed if np.isfinite(hour_speed) else self._overall
+        return speeds
+
+    def speed_kmh(self, lat, lng, when=None):
+        return float(self.speeds_kmh([lat], [lng], when)[0])
+
+    def segment_speed_kmh(self, lat1, lng1, lat2, lng2, when=None):
+        """Harmonic mean of the speeds at the start, middle and end of a straight segment"""
+        speeds = self.speeds_kmh([lat1, (lat1 + lat2) / 2, lat2], [lng1, (lng1 + lng2) / 2, lng2], when)
+        return float(len(speeds) / np.sum(1.0 / speeds))
+
+    def segment_minutes(self, lat1, lng1, lat2, lng2, distance_km, when=None):
+        return distance_km / self.segment_speed_kmh(lat1, lng1, lat2, lng2, when) * 60
+
+    def speed_matrix_kmh(self, origins, destinations, when=None):
+        """(origins x destinations) harmonic mean of origin and destination speeds"""
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        origin_speeds = self.speeds_kmh(origins[:, 0], origins[:, 1], when)
+        dest_speeds = self.speeds_kmh(destinations[:, 0], destinations[:, 1], when)
+        return 2.0 / (1.0 / origin_speeds[:, None] + 1.0 / dest_speeds[None, :])
+
+    # Incremental rebuild
+
+    def rebuild(self, full=False):
+        """
+        Fold location rows newer than the last processed id into speed_profiles and reload.
+        full=True starts over from the whole history. Returns the number of location rows read.
+        """
+        if full:
+            with self.db.transaction() as cursor:
+                cursor.execute('DELETE FROM speed_profiles')
+                cursor.execute("DELETE FROM speed_profile_state WHERE name = 'last_location_id'")
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT value FROM speed_profile_state WHERE name = 'last_location_id'")
+            row = cursor.fetchone()
+        last_id = row[0] if row else 0
+
+        # One transaction per batch, so the write lock is never held for the whole history
+        total = 0
+        while True:
+            with self.db.transaction() as cursor:
+                cursor.execute('''
+                    SELECT id, ambulance_id, latitude, longitude, timestamp FROM ambulance_locations
+                    WHERE id > ? AND latitude IS NOT NULL AND longitude IS NOT NULL AND timestamp IS NOT NULL
+                    ORDER BY id LIMIT ?
+                ''', (last_id, SPEED_PROFILE_BATCH))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                new_last_id = rows[-1][0]
+
+                # Each trip's last already-processed ping joins the first new one into a segment
+                ambulances = sorted({r[1] for r in rows})
+                previous = []
+                for ambulance_id in ambulances:
+                    cursor.execute('''
+                        SELECT id, ambulance_id, latitude, longitude, timestamp FROM ambulance_locations
+                        WHERE ambulance_id = ? AND id <= ? AND latitude IS NOT NULL AND timestamp IS NOT NULL
+                        ORDER BY id DESC LIMIT 1
+                    ''', (ambulance_id, last_id))
+                    prev = cursor.fetchone()
+                    if prev:
+                        previous.append(prev)
+
+                self._fold(cursor, previous + rows)
+                cursor.execute('''
+                    INSERT INTO speed_profile_state (name, value) VALUES ('last_location_id', ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                ''', (new_last_id,))
+            last_id = new_last_id
+            total += len(rows)
+            if len(rows) < SPEED_PROFILE_BATCH:
+                break
+
+        self.load()
+        self.rows_processed += total
+        self.last_rebuild = datetime.now().isoformat()
+        return total
+
+    def _fold(self, cursor, rows):
+        parsed = []
+        for _, ambulance_id, lat, lng, timestamp in rows:
+            try:
+                parsed.append((ambulance_id, wall_clock_seconds(datetime.fromisoformat(str(timestamp))), lat, lng))
+            except ValueError:
+                continue
+        if len(parsed) < 2:
+            return
+        parsed.sort()
+        ambulance_ids, epoch_s, lats, lngs = (np.array(column) for column in zip(*parsed))
+        keys, meters, seconds, samples = segment_aggregates(ambulance_ids, epoch_s, lats, lngs, self.cell_deg)
+        cursor.executemany('''
+            INSERT INTO speed_profiles (cell_hour, distance_m, seconds, samples) VALUES (?, ?, ?, ?)
+            ON CONFLICT(cell_hour) DO UPDATE SET
+                distance_m = distance_m + excluded.distance_m,
+                seconds = seconds + excluded.seconds,
+                samples = samples + excluded.samples
+        ''', zip(keys.tolist(), meters.tolist(), seconds.tolist(), samples.tolist()))
+
+    def _loop(self):
+        while True:
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"Speed profile rebuild failed: {e}")
+            if self._stop.wait(SPEED_PROFILE_REBUILD_INTERVAL):
+                break
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='speed-profiles', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cell_hours': len(self._keys),
+                'cells': len(self._cells),
+                'segments': self._samples,
+                'overall_kmh': round(self._overall, 1),
+                'current_hour_kmh': None if np.isnan(self._hour_speeds[hour_of_week()])
+                else round(float(self._hour_speeds[hour_of_week()]), 1),
+                'rows_processed': self.rows_processed,
+                'last_rebuild': self.last_rebuild
+            }
+
+
+speed_profiles = SpeedProfiles()
+
+
+if __name__ == '__main__':
+    # python speed_profiles.py [--full]
+    import sys
+    started = time.perf_counter()
+    processed = speed_profiles.rebuild(full='--full' in sys.argv)
+    print(f"Processed {processed} location rows in {time.perf_counter() - started:.1f}s: {speed_profiles.stats()}")
@@ -2,7 +2,7 @@
 if ('serviceWorker' in navigator) {
   window.addEventListener('load', () => {
     navigator.serviceWorker
-      .register('/static/js/service-worker.js')
+      .register('/service_worker.js')
       .then((registration) => {
         console.log('✅ Service Worker registered successfully:', registration.scope);
       })
@@ -10,6 +10,15 @@ if ('serviceWorker' in navigator) {
         console.error('❌ Service Worker registration failed:', error);
       });
   });
+
+  // Upload GPS fixes the service worker queued while the connection was down
+  window.addEventListener('online', () => {
+    navigator.serviceWorker.ready.then((registration) => {
+      if (registration.active) {
+        registration.active.postMessage({ type: 'flush-gps' });
+      }
+    });
+  });
 }
 
 // Install prompt for PWA
@@ -43,8 +43,180 @@ self.addEventListener('activate', (event) => {
   );
 });
 
+// Offline GPS queue - driver fixes that fail to post are kept in IndexedDB
+// and uploaded later to /api/driver/location/<id>/batch as one delta-packed track
+const GPS_DB_NAME = 'firstaid-gps';
+const GPS_STORE = 'fixes';
+const GPS_SYNC_TAG = 'gps-queue';
+const GPS_BATCH_SIZE = 600;
+const DRIVER_LOCATION_URL = /^\/api\/driver\/location\/(\d+)$/;
+let gpsFlushing = null;
+
+function openGpsDb() {
+  return new Promise((resolve, reject) => {
+    const open = indexedDB.open(GPS_DB_NAME, 1);
+    open.onupgradeneeded = () => open.result.createObjectStore(GPS_STORE, { autoIncrement: true });
+    open.onsuccess = () => resolve(open.result);
+    open.onerror = () => reject(open.error);
+  });
+}
+
+function gpsStore(db, mode) {
+  return db.transaction(GPS_STORE, mode).objectStore(GPS_STORE);
+}
+
+function queueFix(fix) {
+  return openGpsDb().then((db) => new Promise((resolve, reject) => {
+    const add = gpsStore(db, 'readwrite').add(fix);
+    add.onsuccess = () => resolve();
+    add.onerror = () => reject(add.error);
+  }));
+}
+
+function queuedFixes(db) {
+  return new Promise((resolve, reject) => {
+    const fixes = [];
+    const cursor = gpsStore(db, 'readonly').openCursor();
+    cursor.onsuccess = () => {
+      if (!cursor.result) {
+        return resolve(fixes);
+      }
+      fixes.push({ key: cursor.result.key, fix: cursor.result.value });
+      cursor.result.continue();
+    };
+    cursor.onerror = () => reject(cursor.error);
+  });
+}
+
+function deleteFixes(db, keys) {
+  return new Promise((resolve, reject) => {
+    const store = gpsStore(db, 'readwrite');
+    keys.forEach((key) => store.delete(key));
+    store.transaction.oncomplete = () => resolve();
+    store.transaction.onerror = () => reject(store.transaction.error);
+  });
+}
+
+// TRK1 track blob (see trajectory.py): header, status names, then raw columns of
+// time deltas (int64 ms), lat/lng deltas (int32, 1e-5 degrees) and status codes
+function encodeTrack(fixes) {
+  fixes.sort((a, b) => a.timestamp - b.timestamp);
+  const names = new TextEncoder().encode('[]');
+  const count = fixes.length;
+  const buffer = new ArrayBuffer(12 + names.length + 17 * count);
+  const view = new DataView(buffer);
+  const bytes = new Uint8Array(buffer);
+  bytes.set([84, 82, 75, 49], 0);  // 'TRK1'
+  view.setUint8(4, 1);  // version
+  view.setUint8(5, 0);  // flags: uncompressed
+  view.setUint16(6, names.length, true);
+  view.setUint32(8, count, true);
+  bytes.set(names, 12);
+  let offset = 12 + names.length;
+  let time = 0, lat = 0, lng = 0;
+  fixes.forEach((fix, i) => {
+    const t = Math.round(fix.timestamp);
+    const la = Math.round(fix.lat * 1e5);
+    const ln = Math.round(fix.lng * 1e5);
+    view.setBigInt64(offset + 8 * i, BigInt(t - time), true);
+    view.setInt32(offset + 8 * count + 4 * i, la - lat, true);
+    view.setInt32(offset + 12 * count + 4 * i, ln - lng, true);
+    time = t;
+    lat = la;
+    lng = ln;
+  });
+  return buffer;
+}
+
+// Upload queued fixes per request, oldest first; a batch stays queued if the upload fails
+function flushFixes() {
+  if (!gpsFlushing) {
+    gpsFlushing = openGpsDb()
+      .then((db) => queuedFixes(db).then(async (entries) => {
+        const byRequest = new Map();
+        entries.forEach((entry) => {
+          const requestId = entry.fix.request_id;
+          if (!byRequest.has(requestId)) {
+            byRequest.set(requestId, []);
+          }
+          byRequest.get(requestId).push(entry);
+        });
+        for (const [requestId, queued] of byRequest) {
+          for (let start = 0; start < queued.length; start += GPS_BATCH_SIZE) {
+            const batch = queued.slice(start, start + GPS_BATCH_SIZE);
+            const response = await fetch(`/api/driver/location/${requestId}/batch`, {
+              method: 'POST',
+              credentials: 'same-origin',
+              headers: { 'Content-Type': 'application/octet-stream' },
+              body: encodeTrack(batch.map((entry) => entry.fix))
+            });
+            // Signed out, rate limited or a server error: keep the fixes for the next attempt
+            if (response.status === 401 || response.status === 429 || response.status >= 500) {
+              throw new Error(`GPS batch upload failed: ${response.status}`);
+            }
+            // Accepted, or rejected for good (e.g. the request no longer exists)
+            await deleteFixes(db, batch.map((entry) => entry.key));
+          }
+        }
+      }))
+      .catch((err) => console.log('Service Worker: GPS queue kept', err))
+      .finally(() => {
+        gpsFlushing = null;
+      });
+  }
+  return gpsFlushing;
+}
+
+function postDriverLocation(request, requestId) {
+  return request.clone().json().then((fix) => fetch(request)
+    .then((response) => {
+      flushFixes();
+      return response;
+    })
+    .catch(() => queueFix({
+      request_id: Number(requestId),
+      lat: Number(fix.lat),
+      lng: Number(fix.lng),
+      timestamp: fix.timestamp || Date.now(),
+      accuracy: fix.accuracy || null
+    }).then(() => {
+      if (self.registration.sync) {
+        self.registration.sync.register(GPS_SYNC_TAG).catch(() => {});
+      }
+      return new Response(JSON.stringify({ queued: true }), {
+        status: 202,
+        headers: { 'Content-Type': 'application/json' }
+      });
+    })));
+}
+
+self.addEventListener('sync', (event) => {
+  if (event.tag === GPS_SYNC_TAG) {
+    event.waitUntil(flushFixes());
+  }
+});
+
+// Pages post {type: 'flush-gps'} when the browser comes back online
+self.addEventListener('message', (event) => {
+  if (event.data && event.data.type === 'flush-gps') {
+    event.waitUntil(flushFixes());
+  }
+});
+
 // Fetch event - serve from cache, fallback to network
 self.addEventListener('fetch', (event) => {
+  const url = new URL(event.request.url);
+  if (event.request.method === 'POST' && url.origin === self.location.origin) {
+    const match = url.pathname.match(DRIVER_LOCATION_URL);
+    if (match) {
+      event.respondWith(postDriverLocation(event.request, match[1]));
+    }
+    return;
+  }
+  // Only static GETs are cached; API and Socket.IO traffic always goes to the network
+  if (event.request.method !== 'GET' || url.pathname.startsWith('/api/') || url.pathname.startsWith('/socket.io/')) {
+    return;
+  }
   event.respondWith(
     caches.match(event.request)
       .then((response) => {
@@ -0,0 +1,214 @@
+"""Assignment solvers against brute force, and DispatchEngine commits racing manual accepts"""
+import itertools
+
+import numpy as np
+import pytest
+
+from db import Database
+from dispatch import DispatchEngine, greedy_assignment, hungarian, solve_assignment, straight_line_eta
+from migrations import migrate
+
+
+def brute_force(cost, allowed=None):
+    """(pairs, total) of the best assignment: most allowed pairs first, then least total cost"""
+    cost = np.asarray(cost, dtype=np.float64)
+    allowed = np.isfinite(cost) if allowed is None else allowed
+    n, m = cost.shape
+    best = (0, 0.0)
+    if n <= m:
+        choices = (list(zip(range(n), cols)) for cols in itertools.permutations(range(m), n))
+    else:
+        choices = (list(zip(rows, range(m))) for rows in itertools.permutations(range(n), m))
+    for pairs in choices:
+        kept = [(r, c) for r, c in pairs if allowed[r, c]]
+        score = (len(kept), sum(cost[r, c] for r, c in kept))
+        if score[0] > best[0] or (score[0] == best[0] and score[1] < best[1]):
+            best = score
+    return best
+
+
+def check_matching(rows, cols, shape):
+    assert len(set(rows.tolist())) == len(rows) and len(set(cols.tolist())) == len(cols)
+    assert all(0 <= r < shape[0] for r in rows) and all(0 <= c < shape[1] for c in cols)
+
+
+def random_fleet(seed, drivers, requests):
+    """Straight-line ETAs between random drivers and patients around one city"""
+    rng = np.random.default_rng(seed)
+    d = rng.uniform([12.8, 77.4], [13.1, 77.8], (drivers, 2))
+    p = rng.uniform([12.8, 77.4], [13.1, 77.8], (requests, 2))
+    return straight_line_eta(d[:, 0], d[:, 1], p[:, 0], p[:, 1])
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_hungarian_matches_brute_force_on_rectangular_matrices(seed):
+    rng = np.random.default_rng(seed)
+    shape = tuple(rng.integers(1, 7, size=2))
+    cost = rng.uniform(0, 100, shape).round(1)  # rounding makes ties common
+    rows, cols = hungarian(cost)
+    check_matching(rows, cols, shape)
+    assert len(rows) == min(shape)
+    assert cost[rows, cols].sum() == pytest.approx(brute_force(cost)[1])
+    assert (np.diff(rows) > 0).all()
+
+
+def test_hungarian_on_empty_and_degenerate_matrices():
+    rows, cols = hungarian(np.empty((0, 4)))
+    assert rows.size == cols.size == 0
+    rows, cols = hungarian(np.full((3, 3), 7.0))
+    assert sorted(cols.tolist()) == [0, 1, 2]
+
+
+def test_greedy_is_a_maximal_matching_that_takes_the_cheapest_pair_first():
+    cost = random_fleet(0, 30, 45)
+    rows, cols = greedy_assignment(cost, candidates=4)
+    check_matching(rows, cols, cost.shape)
+    assert len(rows) == 30  # rows left over after the candidate round are matched in the next
+    cheapest = np.unravel_index(np.argmin(cost), cost.shape)
+    assert cols[rows.tolist().index(cheapest[0])] == cheapest[1]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_greedy_stays_within_its_quality_bound_of_optimal(seed):
+    rng = np.random.default_rng(seed)
+    cost = random_fleet(seed, *rng.integers(20, 80, size=2))
+    optimal = cost[hungarian(cost)].sum()
+    greedy = cost[greedy_assignment(cost)].sum()
+    assert optimal <= greedy + 1e-9
+    assert greedy <= 1.5 * optimal
+
+
+def test_greedy_is_close_to_optimal_on_average():
+    # Square fleets are greedy's worst case (every driver competes for every request); ~1.22 observed
+    ratios = []
+    for seed in range(20):
+        cost = random_fleet(seed, 60, 60)
+        ratios.append(cost[greedy_assignment(cost)].sum() / cost[hungarian(cost)].sum())
+    assert np.mean(ratios) <= 1.3
+
+
+def test_greedy_never_matches_infinite_costs():
+    cost = np.array([[1.0, np.inf], [np.inf, np.inf]])
+    rows, cols = greedy_assignment(cost)
+    assert rows.tolist() == [0] and cols.tolist() == [0]
+
+
+def test_max_cost_pairs_are_dropped_rather_than_assigned():
+    cost = np.array([[1.0, 100.0], [2.0, 100.0]])
+    rows, cols, method = solve_assignment(cost, max_cost=50)
+    assert method == 'hungarian'
+    assert list(zip(rows.tolist(), cols.tolist())) == [(0, 0)]
+
+
+def test_forbidden_penalty_never_trades_an_allowed_pair_for_a_cheaper_total():
+    # Keeping only the cheap (0,0) costs 1 but leaves a patient unserved ((1,1) is over max_cost);
+    # the allowed (0,1) + (1,0) costs 42 and serves both, so it must win
+    cost = np.array([[1.0, 40.0], [2.0, 60.0]])
+    rows, cols, _ = solve_assignment(cost, max_cost=45)
+    assert list(zip(rows.tolist(), cols.tolist())) == [(0, 1), (1, 0)]
+    cost = np.array([[1.0, 2.0], [1.0, np.inf]])
+    rows, cols, _ = solve_assignment(cost)
+    assert list(zip(rows.tolist(), cols.tolist())) == [(0, 1), (1, 0)]
+
+
+@pytest.mark.parametrize('seed', range(150))
+def test_solve_assignment_matches_brute_force_with_forbidden_pairs(seed):
+    rng = np.random.default_rng(1000 + seed)
+    shape = tuple(rng.integers(1, 6, size=2))
+    cost = rng.uniform(0, 100, shape).round(1)
+    cost[rng.random(shape) < 0.2] = np.inf
+    max_cost = 70.0
+    rows, cols, method = solve_assignment(cost, max_cost=max_cost)
+    assert method == 'hungarian'
+    check_matching(rows, cols, shape)
+    assert (cost[rows, cols] <= max_cost).all()
+    pairs, total = brute_force(cost, np.isfinite(cost) & (cost <= max_cost))
+    assert len(rows) == pairs
+    assert cost[rows, cols].sum() == pytest.approx(total)
+
+
+def test_large_batches_use_greedy_and_respect_max_cost():
+    cost = random_fleet(5, 40, 50)
+    rows, cols, method = solve_assignment(cost, max_cost=10, greedy_threshold=30)
+    assert method == 'greedy'
+    check_matching(rows, cols, cost.shape)
+    assert (cost[rows, cols] <= 10).all()
+
+
+# DispatchEngine._commit
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'dispatch.db'))
+    migrate(database)
+    return database
+
+
+def add_fleet(database, drivers, patients):
+    with database.transaction() as cursor:
+        driver_ids, request_ids = [], []
+        for lat, lng in drivers:
+            cursor.execute("INSERT INTO drivers (name, phone, current_lat, current_lng, status) VALUES ('d', '1', ?, ?, 'Available')",
+                           (lat, lng))
+            driver_ids.append(cursor.lastrowid)
+        for lat, lng in patients:
+            cursor.execute('''
+                INSERT INTO ambulance_requests (patient_name, contact, origin_lat, origin_lng, destination_lat, destination_lng, status)
+                VALUES ('p', '1', ?, ?, 13.0, 77.7, 'Pending')
+            ''', (lat, lng))
+            request_ids.append(cursor.lastrowid)
+    return driver_ids, request_ids
+
+
+def statuses(database, table, ids):
+    with database.transaction() as cursor:
+        cursor.execute(f"SELECT status FROM {table} WHERE id IN ({', '.join('?' * len(ids))}) ORDER BY id", ids)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def test_cycle_commits_the_optimal_assignment(database):
+    drivers, requests = add_fleet(database, [(12.90, 77.50), (12.99, 77.60)], [(12.98, 77.60), (12.91, 77.50)])
+    assigned = []
+    engine = DispatchEngine(database, on_assign=assigned.extend)
+    result = engine.run_cycle()
+    assert {(a['driver_id'], a['request_id']) for a in result} == {(drivers[0], requests[1]), (drivers[1], requests[0])}
+    assert assigned == result
+    assert statuses(database, 'drivers', drivers) == ['On Trip', 'On Trip']
+    assert statuses(database, 'ambulance_requests', requests) == ['Started', 'Started']
+
+
+def claiming(database, sql, params):
+    """ETA function that claims a driver or request (a manual accept) after the batch was loaded"""
+    def eta(*coords):
+        with database.transaction() as cursor:
+            cursor.execute(sql, params)
+        return straight_line_eta(*coords)
+    return eta
+
+
+def test_driver_taken_between_solve_and_commit_is_skipped(database):
+    drivers, requests = add_fleet(database, [(12.90, 77.50), (12.99, 77.60)], [(12.98, 77.60), (12.91, 77.50)])
+    engine = DispatchEngine(database, eta_matrix=claiming(
+        database, "UPDATE drivers SET status = 'On Trip' WHERE id = ?", (drivers[0],)))
+    result = engine.run_cycle()
+    assert [(a['driver_id'], a['request_id']) for a in result] == [(drivers[1], requests[0])]
+    assert engine.conflicts == 1
+    assert statuses(database, 'ambulance_requests', requests) == ['Started', 'Pending']
+
+
+def test_request_taken_between_solve_and_commit_releases_its_driver(database):
+    drivers, requests = add_fleet(database, [(12.90, 77.50), (12.99, 77.60)], [(12.98, 77.60), (12.91, 77.50)])
+    engine = DispatchEngine(database, eta_matrix=claiming(
+        database, "UPDATE ambulance_requests SET status = 'Started' WHERE id = ?", (requests[1],)))
+    result = engine.run_cycle()
+    assert [(a['driver_id'], a['request_id']) for a in result] == [(drivers[1], requests[0])]
+    assert engine.conflicts == 1
+    # The driver solved for the taken request is Available again, not stuck On Trip
+    assert statuses(database, 'drivers', drivers) == ['Available', 'On Trip']
+
+
+def test_pairs_beyond_max_eta_are_left_pending(database):
+    drivers, requests = add_fleet(database, [(12.90, 77.50)], [(12.91, 77.50), (14.50, 79.00)])
+    result = DispatchEngine(database, max_eta_minutes=30).run_cycle()
+    assert [(a['driver_id'], a['request_id']) for a in result] == [(drivers[0], requests[0])]
+    assert statuses(database, 'ambulance_requests', requests) == ['Started', 'Pending']
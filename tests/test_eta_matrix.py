@@ -0,0 +1,163 @@
+"""EtaMatrix row cache hits and misses and provider fallthrough, with stubbed matrix providers (no network)"""
+import numpy as np
+import pytest
+
+from eta_matrix import EtaMatrix, MatrixRowCache, cell_key
+
+ORIGINS = [[12.970, 77.590], [12.980, 77.600]]
+DESTINATIONS = [[12.930, 77.620], [12.990, 77.550], [13.010, 77.580]]
+
+
+class StubProvider:
+    """Matrix provider stand-in: minutes = 10 * provider offset + origin index + destination index / 10"""
+
+    def __init__(self, offset, fail=False, holes=()):
+        self.offset = offset
+        self.fail = fail
+        self.holes = set(holes)  # (origin_lat, dest_lat) pairs it cannot route
+        self.calls = []
+
+    def __call__(self, origins, destinations):
+        self.calls.append((np.array(origins), np.array(destinations)))
+        if self.fail:
+            return None
+        minutes = np.array([[10 * self.offset + o[0] + d[0] / 10 for d in destinations] for o in origins])
+        for i, o in enumerate(origins):
+            for j, d in enumerate(destinations):
+                if (o[0], d[0]) in self.holes:
+                    minutes[i, j] = np.nan
+        return minutes, minutes / 2
+
+
+@pytest.fixture
+def osrm(monkeypatch):
+    provider = StubProvider(1)
+    monkeypatch.setattr(EtaMatrix, '_osrm_block', lambda self, o, d: provider(o, d))
+    return provider
+
+
+@pytest.fixture
+def tomtom(monkeypatch):
+    provider = StubProvider(2)
+    monkeypatch.setattr(EtaMatrix, '_tomtom_block', lambda self, o, d: provider(o, d))
+    return provider
+
+
+def expected(offset, origins=ORIGINS, destinations=DESTINATIONS):
+    return np.array([[10 * offset + o[0] + d[0] / 10 for d in destinations] for o in origins])
+
+
+def test_first_call_misses_then_rows_are_cached(osrm):
+    matrix = EtaMatrix()
+    minutes, km, sources = matrix.compute(ORIGINS, DESTINATIONS)
+    np.testing.assert_allclose(minutes, expected(1))
+    np.testing.assert_allclose(km, expected(1) / 2)
+    assert sources == {'osrm': 6}
+    assert len(osrm.calls) == 1
+
+    minutes, _, sources = matrix.compute(ORIGINS, DESTINATIONS)
+    np.testing.assert_allclose(minutes, expected(1))
+    assert sources == {'cache': 6}
+    assert len(osrm.calls) == 1
+    assert matrix.cache.stats()['hits'] == 2
+
+
+def test_nearby_origin_shares_the_cached_row(osrm):
+    matrix = EtaMatrix()
+    matrix.compute(ORIGINS[:1], DESTINATIONS)
+    nearby = [[ORIGINS[0][0] + 0.0001, ORIGINS[0][1] + 0.0001]]
+    assert cell_key(*nearby[0]) == cell_key(*ORIGINS[0])
+    _, _, sources = matrix.compute(nearby, DESTINATIONS)
+    assert sources == {'cache': 3}
+    assert len(osrm.calls) == 1
+
+
+def test_new_destination_refetches_only_that_origin_row(osrm):
+    matrix = EtaMatrix()
+    matrix.compute(ORIGINS, DESTINATIONS[:2])
+    matrix.compute(ORIGINS[:1], DESTINATIONS)
+    assert len(osrm.calls) == 2
+    np.testing.assert_array_equal(osrm.calls[1][0], ORIGINS[:1])
+    np.testing.assert_array_equal(osrm.calls[1][1], DESTINATIONS[2:])
+    assert matrix.cache.stats()['partial'] == 1
+
+    # The row now covers all three destinations
+    _, _, sources = matrix.compute(ORIGINS[:1], DESTINATIONS)
+    assert sources == {'cache': 3}
+    assert len(osrm.calls) == 2
+
+
+def test_changed_destination_set_fetches_only_the_new_column_for_all_origins(osrm):
+    # Dispatch: the pending patients change between cycles, the drivers mostly do not
+    matrix = EtaMatrix()
+    matrix.compute(ORIGINS, DESTINATIONS[:2])
+    minutes, _, sources = matrix.compute(ORIGINS, DESTINATIONS[1:])
+    np.testing.assert_allclose(minutes, expected(1, destinations=DESTINATIONS[1:]))
+    assert sources == {'cache': 2, 'osrm': 2}
+    assert len(osrm.calls) == 2
+    np.testing.assert_array_equal(osrm.calls[1][0], ORIGINS)
+    np.testing.assert_array_equal(osrm.calls[1][1], DESTINATIONS[2:])
+    assert matrix.cache.stats()['hits'] == 0
+
+
+def test_unroutable_pairs_are_cached_and_not_refetched(monkeypatch):
+    provider = StubProvider(1, holes={(ORIGINS[0][0], DESTINATIONS[0][0])})
+    monkeypatch.setattr(EtaMatrix, '_osrm_block', lambda self, o, d: provider(o, d))
+    matrix = EtaMatrix()
+    matrix.compute(ORIGINS, DESTINATIONS)
+    minutes, _, sources = matrix.compute(ORIGINS, DESTINATIONS)
+    assert sources == {'cache': 5, 'estimate': 1}
+    assert np.isfinite(minutes).all()
+    assert len(provider.calls) == 1
+    assert matrix.cache.stats()['hits'] == 2
+
+
+def test_expired_rows_are_misses(osrm):
+    matrix = EtaMatrix(cache=MatrixRowCache(ttls={'osrm': -1}))
+    matrix.compute(ORIGINS, DESTINATIONS)
+    matrix.compute(ORIGINS, DESTINATIONS)
+    assert len(osrm.calls) == 2
+    assert matrix.cache.stats()['hits'] == 0
+
+
+def test_least_recently_used_row_is_evicted(osrm):
+    matrix = EtaMatrix(cache=MatrixRowCache(max_rows=1))
+    matrix.compute(ORIGINS[:1], DESTINATIONS)
+    matrix.compute(ORIGINS[1:], DESTINATIONS)
+    matrix.compute(ORIGINS[:1], DESTINATIONS)
+    assert len(osrm.calls) == 3
+
+
+def test_failed_provider_falls_back_to_estimate(monkeypatch):
+    provider = StubProvider(1, fail=True)
+    monkeypatch.setattr(EtaMatrix, '_osrm_block', lambda self, o, d: provider(o, d))
+    matrix = EtaMatrix()
+    minutes, _, sources = matrix.compute(ORIGINS, DESTINATIONS)
+    assert sources == {'estimate': 6}
+    assert np.isfinite(minutes).all() and (minutes > 0).all()
+    assert matrix.failures['osrm'] == 1
+    assert matrix.cache.stats()['rows'] == 0
+
+
+def test_tomtom_preferred_and_gaps_filled_by_osrm(tomtom, osrm):
+    tomtom.holes = {(ORIGINS[1][0], DESTINATIONS[2][0])}
+    matrix = EtaMatrix(tomtom_api_key='stub')
+    minutes, _, sources = matrix.compute(ORIGINS, DESTINATIONS)
+    want = expected(2)
+    want[1, 2] = expected(1)[1, 2]
+    np.testing.assert_allclose(minutes, want)
+    assert sources == {'tomtom': 5, 'osrm': 1}
+    np.testing.assert_array_equal(osrm.calls[0][0], ORIGINS[1:])
+    np.testing.assert_array_equal(osrm.calls[0][1], DESTINATIONS[2:])
+
+    # TomTom's unroutable pair is remembered, so the repeat is served from both caches
+    minutes, _, sources = matrix.compute(ORIGINS, DESTINATIONS)
+    np.testing.assert_allclose(minutes, want)
+    assert sources == {'cache': 6}
+    assert len(tomtom.calls) == 1 and len(osrm.calls) == 1
+
+
+def test_callable_returns_minutes_for_dispatch(osrm):
+    matrix = EtaMatrix()
+    o, d = np.array(ORIGINS), np.array(DESTINATIONS)
+    np.testing.assert_allclose(matrix(o[:, 0], o[:, 1], d[:, 0], d[:, 1]), expected(1))
@@ -0,0 +1,68 @@
+"""parse_batch decoding and validation (bad timestamps and accuracies are ValueErrors, so 400s) and batch rate limiting"""
+import json
+import zlib
+
+import pytest
+
+from ingest import MAX_FIX_TIME_MS, TRACK_CONTENT_TYPE, GpsIngest, fix_isoformat, fix_time_ms, parse_batch
+from trajectory import FLAG_ZLIB, TRACK_HEADER, TRACK_MAGIC, TRACK_VERSION, Track
+
+MS = 1700000000123
+
+
+def body(*fixes):
+    return json.dumps([dict({'lat': 12.97, 'lng': 77.59, 'timestamp': MS}, **fix) for fix in fixes])
+
+
+def test_json_fixes_are_sorted_and_deduplicated_by_timestamp():
+    fixes = parse_batch(body({'timestamp': MS + 2000, 'accuracy': 8}, {'timestamp': MS, 'lat': 1},
+                             {'timestamp': MS, 'lat': 2, 'accuracy': '5'}), 'application/json')
+    assert fixes == [(MS, 2.0, 77.59, 5.0), (MS + 2000, 12.97, 77.59, 8.0)]
+
+
+def test_missing_accuracy_stays_none():
+    assert parse_batch(body({}), 'application/json') == [(MS, 12.97, 77.59, None)]
+
+
+@pytest.mark.parametrize('timestamp', [0, -1, MAX_FIX_TIME_MS, 10 ** 30, 'soon', None])
+def test_out_of_range_or_malformed_timestamp_is_rejected(timestamp):
+    with pytest.raises(ValueError):
+        parse_batch(body({'timestamp': timestamp}), 'application/json')
+
+
+@pytest.mark.parametrize('accuracy', ['good', -3, 'nan', 'inf', [5]])
+def test_non_numeric_or_negative_accuracy_is_rejected(accuracy):
+    with pytest.raises(ValueError):
+        parse_batch(body({'accuracy': accuracy}), 'application/json')
+
+
+def test_coordinates_out_of_range_are_rejected():
+    with pytest.raises(ValueError):
+        parse_batch(body({'lat': 91}), 'application/json')
+
+
+def test_live_and_batch_paths_stamp_the_same_history_timestamp():
+    # The live path parses the posted timestamp with fix_time_ms; the batch path stores parse_batch's ms
+    (ms, _, _, _), = parse_batch(body({}), 'application/json')
+    assert fix_isoformat(fix_time_ms(str(MS))) == fix_isoformat(ms)
+
+
+def test_batch_is_charged_per_fix_and_refused_when_the_bucket_cannot_cover_it():
+    ingest = GpsIngest(device_rate=0.001, device_burst=20, batch_fixes_per_token=100)
+    assert ingest.batch_cost(1) == 1 and ingest.batch_cost(101) == 2 and ingest.batch_cost(10 ** 6) == 20
+    assert ingest.admit_batch('driver:1', 1500)      # 15 tokens
+    assert not ingest.admit_batch('driver:1', 600)   # 6 tokens, 5 left: refused, nothing charged
+    assert ingest.admit_batch('driver:1', 500)
+    assert not ingest.can_batch('driver:1')
+    assert ingest.can_batch('driver:2')
+    assert ingest.stats()['limited'] == 2 and ingest.stats()['batch_fixes'] == 2000
+
+
+def test_track_blob_over_the_point_limit_or_inflating_past_its_count_is_rejected():
+    blob = Track.from_points([(12.97 + i * 1e-4, 77.59, MS + i * 1000, 'Started') for i in range(10)]).encode()
+    assert len(parse_batch(blob, TRACK_CONTENT_TYPE)) == 10
+    with pytest.raises(ValueError):
+        parse_batch(blob, TRACK_CONTENT_TYPE, max_fixes=9)
+    bomb = TRACK_HEADER.pack(TRACK_MAGIC, TRACK_VERSION, FLAG_ZLIB, 2, 10) + b'[]' + zlib.compress(bytes(10 ** 7), 9)
+    with pytest.raises(ValueError):
+        parse_batch(bomb, TRACK_CONTENT_TYPE)
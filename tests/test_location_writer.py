@@ -0,0 +1,171 @@
+"""LocationWriter against a scratch database: collapsing, failed-flush requeue, backpressure and flush ordering"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from db import Database
+from location_writer import LocationWriter
+from migrations import migrate
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'writer.db'))
+    migrate(database)
+    with database.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO ambulance_requests (id, patient_name, contact, origin_lat, origin_lng, destination_lat, destination_lng, status)
+            VALUES (1, 'p', '1', 12.9, 77.6, 13.0, 77.7, 'Started')
+        ''')
+        cursor.execute("INSERT INTO drivers (id, name, phone, status) VALUES (7, 'd', '1', 'On Trip')")
+    return database
+
+
+class FlakyDatabase:
+    """Wraps a Database; transaction() raises while `failing` is set, and can be held open by `gate`"""
+
+    def __init__(self, database):
+        self.database = database
+        self.failing = False
+        self.gate = None       # threading.Event the next transaction waits on before committing
+        self.entered = threading.Event()
+
+    @contextmanager
+    def transaction(self, **kwargs):
+        if self.failing:
+            raise sqlite3.OperationalError('database is locked')
+        with self.database.transaction(**kwargs) as cursor:
+            yield cursor
+            gate, self.gate = self.gate, None
+            if gate is not None:
+                self.entered.set()
+                gate.wait(5)
+
+
+@pytest.fixture
+def buffered():
+    """Writers whose background thread is running but never flushes on its own during a test"""
+    writers = []
+
+    def make(database, **kwargs):
+        kwargs = dict({'flush_rows': 10 ** 6, 'flush_interval': 60}, **kwargs)
+        writer = LocationWriter(database, **kwargs)
+        writer.start()
+        writers.append(writer)
+        return writer
+    yield make
+    for writer in writers:
+        writer.stop(timeout=5)
+
+
+def history(database):
+    with database.transaction() as cursor:
+        cursor.execute('SELECT latitude, timestamp FROM ambulance_locations ORDER BY id')
+        return cursor.fetchall()
+
+
+def request_position(database):
+    with database.transaction() as cursor:
+        cursor.execute('SELECT driver_lat, driver_lng, route_distance_km, route_duration_minutes FROM ambulance_requests WHERE id = 1')
+        return cursor.fetchone()
+
+
+def test_position_updates_collapse_to_the_newest_and_history_is_appended(database, buffered):
+    writer = buffered(database)
+    for i in range(5):
+        writer.set_request_position(1, 12.9 + i, 77.6, 10 - i, 20 - i)
+        writer.set_driver_position(7, 12.9 + i, 77.6)
+        writer.add_history(1, 12.9 + i, 77.6, f'2026-01-01T00:00:0{i}', 'Started')
+    stats = writer.stats()
+    assert stats['pending'] == 7 and stats['collapsed'] == 8 and stats['flushes'] == 0
+
+    assert writer.flush() == 7
+    assert request_position(database) == (16.9, 77.6, 6, 16)
+    assert [lat for lat, _ in history(database)] == [12.9, 13.9, 14.9, 15.9, 16.9]
+    with database.transaction() as cursor:
+        cursor.execute('SELECT current_lat FROM drivers WHERE id = 7')
+        assert cursor.fetchone()[0] == 16.9
+
+
+def test_failed_flush_is_requeued_without_overwriting_newer_updates(database, buffered):
+    flaky = FlakyDatabase(database)
+    writer = buffered(flaky)
+    writer.add_history(1, 1.0, 77.6, '2026-01-01T00:00:01', 'Started')
+    writer.set_request_position(1, 1.0, 77.6, 5, 5)
+
+    flaky.failing = True
+    assert writer.flush() == 0
+    assert writer.stats()['errors'] == 1 and writer.stats()['pending'] == 2
+
+    # Arrives while the failed batch waits: history goes after it, the newer position wins
+    writer.add_history(1, 2.0, 77.6, '2026-01-01T00:00:02', 'Started')
+    writer.set_request_position(1, 2.0, 77.6, 4, 4)
+    flaky.failing = False
+    assert writer.flush() == 3
+    assert [lat for lat, _ in history(database)] == [1.0, 2.0]
+    assert request_position(database)[0] == 2.0
+
+
+def test_unwritable_database_drops_oldest_history_past_the_bound(database, buffered):
+    flaky = FlakyDatabase(database)
+    writer = buffered(flaky, max_pending=3, enqueue_timeout=0.01)
+    flaky.failing = True
+    for i in range(5):
+        writer.add_history(1, float(i), 77.6, f'2026-01-01T00:00:0{i}', 'Started')
+    assert writer.stats()['dropped'] > 0
+    assert writer.stats()['pending'] <= 3
+    flaky.failing = False
+    writer.flush()
+    kept = [lat for lat, _ in history(database)]
+    assert kept == sorted(kept) and kept[-1] == 4.0  # the newest rows survive, in order
+
+
+def test_full_queue_makes_the_producer_flush_itself(database, buffered):
+    writer = buffered(database, max_pending=5, enqueue_timeout=0.05)
+    for i in range(6):
+        writer.add_history(1, float(i), 77.6, f'2026-01-01T00:00:0{i}', 'Started')
+    stats = writer.stats()
+    assert stats['backpressure_waits'] == 1 and stats['producer_flushes'] == 1
+    assert len(history(database)) == 6 and stats['pending'] == 0
+
+
+def test_flush_returns_only_after_an_in_flight_flush_has_committed(database, buffered):
+    # The batch upload's duplicate check calls flush() and then reads ambulance_locations
+    flaky = FlakyDatabase(database)
+    writer = buffered(flaky)
+    writer.add_history(1, 1.0, 77.6, '2026-01-01T00:00:01', 'Started')
+    gate = flaky.gate = threading.Event()
+    background = threading.Thread(target=writer.flush)
+    background.start()
+    assert flaky.entered.wait(5)
+
+    writer.add_history(1, 2.0, 77.6, '2026-01-01T00:00:02', 'Started')
+    done = threading.Event()
+    caller = threading.Thread(target=lambda: (writer.flush(), done.set()))
+    caller.start()
+    time.sleep(0.05)
+    assert not done.is_set()  # held behind the in-flight transaction
+
+    gate.set()
+    caller.join(5)
+    background.join(5)
+    assert done.is_set()
+    assert [lat for lat, _ in history(database)] == [1.0, 2.0]
+
+
+def test_without_a_running_thread_every_write_is_flushed_synchronously(database):
+    writer = LocationWriter(database, enabled=False)
+    writer.add_history(1, 1.0, 77.6, '2026-01-01T00:00:01', 'Started')
+    assert history(database) == [(1.0, '2026-01-01T00:00:01')]
+    assert writer.stats()['pending'] == 0
+
+
+def test_stop_flushes_what_is_left(database, buffered):
+    writer = buffered(database)
+    writer.add_history(1, 1.0, 77.6, '2026-01-01T00:00:01', 'Started')
+    writer.stop(timeout=5)
+    assert writer.stats()['running'] is False
+    assert len(history(database)) == 1
@@ -0,0 +1,160 @@
+"""Retry, timeout and circuit breaker behaviour of provider_client against a local stub HTTP server"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from provider_client import CircuitBreaker, CircuitOpenError, ProviderClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers by path: /ok, /slow (sleeps past the client timeout), /error (503), /loop (endless redirect)"""
+
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        if self.path == '/slow':
+            time.sleep(0.5)
+        if self.path == '/loop':
+            self.send_response(302)
+            self.send_header('Location', '/loop')
+            self.end_headers()
+            return
+        self.send_response(503 if self.path == '/error' else 200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.hits = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **kwargs):
+    options = dict(timeout=0.2, max_retries=2, backoff_seconds=0, breaker=CircuitBreaker(2, 0.1))
+    options.update(kwargs)
+    return ProviderClient('stub', f'http://127.0.0.1:{server.server_port}', **options)
+
+
+def test_success_closes_without_retry(stub):
+    client = make_client(stub)
+    assert client.get('/ok').status_code == 200
+    assert stub.hits == ['/ok']
+    assert client.retries == 0
+    assert client.breaker.state == 'closed'
+
+
+def test_retryable_status_is_retried_then_returned(stub):
+    client = make_client(stub)
+    response = client.get('/error')
+    assert response.status_code == 503
+    assert len(stub.hits) == 3
+    assert client.retries == 2
+    assert client.breaker.failures == 1
+
+
+def test_timeouts_not_retried_when_disabled(stub):
+    client = make_client(stub, retry_timeouts=False)
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        client.get('/slow')
+    assert time.monotonic() - started < 0.45
+    assert stub.hits == ['/slow']
+    assert client.breaker.failures == 1
+
+
+def test_timeouts_retried_when_enabled(stub):
+    client = make_client(stub, max_retries=1, retry_timeouts=True)
+    with pytest.raises(requests.Timeout):
+        client.get('/slow')
+    assert stub.hits == ['/slow', '/slow']
+
+
+def test_connection_errors_are_retried():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    port = server.server_port
+    server.server_close()  # nothing listens on the port any more
+    client = ProviderClient('stub', f'http://127.0.0.1:{port}', timeout=0.2, max_retries=2, backoff_seconds=0)
+    with pytest.raises(requests.ConnectionError):
+        client.get('/ok')
+    assert client.retries == 2
+    assert client.breaker.failures == 1
+
+
+def test_other_request_errors_count_as_failures(stub):
+    client = make_client(stub)
+    with pytest.raises(requests.TooManyRedirects):
+        client.get('/loop')
+    assert client.retries == 0
+    assert client.breaker.failures == 1
+
+
+def test_breaker_opens_and_short_circuits(stub):
+    client = make_client(stub, max_retries=0)
+    client.get('/error')
+    client.get('/error')
+    assert client.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        client.get('/ok')
+    assert client.short_circuited == 1
+    assert stub.hits == ['/error', '/error']
+
+
+def test_half_open_trial_success_closes(stub):
+    client = make_client(stub, max_retries=0)
+    client.get('/error')
+    client.get('/error')
+    time.sleep(0.15)
+    assert client.get('/ok').status_code == 200
+    assert client.breaker.state == 'closed'
+
+
+def test_half_open_trial_failure_reopens(stub):
+    client = make_client(stub, max_retries=0)
+    client.get('/error')
+    client.get('/error')
+    time.sleep(0.15)
+    client.get('/error')
+    assert client.breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        client.get('/ok')
+
+
+@pytest.mark.parametrize('path, error', [('/loop', requests.TooManyRedirects), ('/slow', requests.Timeout)])
+def test_half_open_trial_error_does_not_stick(stub, path, error):
+    client = make_client(stub, max_retries=0)
+    client.get('/error')
+    client.get('/error')
+    time.sleep(0.15)
+    with pytest.raises(error):
+        client.get(path)
+    time.sleep(0.15)
+    assert client.get('/ok').status_code == 200
+    assert client.breaker.state == 'closed'
+
+
+def test_unexpected_error_releases_trial(stub, monkeypatch):
+    client = make_client(stub, max_retries=0)
+    client.get('/error')
+    client.get('/error')
+    time.sleep(0.15)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('not a requests error')
+    monkeypatch.setattr(client.session, 'request', broken)
+    with pytest.raises(RuntimeError):
+        client.get('/ok')
+    monkeypatch.undo()
+    assert client.get('/ok').status_code == 200
+    assert client.breaker.state == 'closed'
@@ -0,0 +1,93 @@
+"""Retention passes on a scratch database: stationary trips, terminal statuses and the speed-profile gate"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from db import Database
+from migrations import migrate
+from retention import LocationRetention
+from trajectory import TrajectoryStore
+
+NOW = datetime(2026, 3, 1)
+LONG_AGO = NOW - timedelta(days=40)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'retention.db'))
+    migrate(database)
+    return database
+
+
+def add_trip(database, status, pings=50, moving=True):
+    """A request in `status` with one ping every 5 s from LONG_AGO, status changing halfway"""
+    with database.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO ambulance_requests (patient_name, contact, origin_lat, origin_lng, destination_lat, destination_lng, status)
+            VALUES ('p', '1', 12.9, 77.6, 13.0, 77.7, ?)
+        ''', (status,))
+        request_id = cursor.lastrowid
+        cursor.executemany('''
+            INSERT INTO ambulance_locations (ambulance_id, latitude, longitude, timestamp, status) VALUES (?, ?, ?, ?, ?)
+        ''', [(request_id, 12.9 + (i * 1e-3 if moving else 0), 77.6, (LONG_AGO + timedelta(seconds=5 * i)).isoformat(),
+               'Started' if i < pings // 2 else 'Patient Received') for i in range(pings)])
+    return request_id
+
+
+def processed_up_to(database, location_id):
+    with database.transaction() as cursor:
+        cursor.execute("INSERT OR REPLACE INTO speed_profile_state (name, value) VALUES ('last_location_id', ?)",
+                       (location_id,))
+
+
+def live_rows(database, request_id):
+    with database.transaction() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM ambulance_locations WHERE ambulance_id = ?', (request_id,))
+        return cursor.fetchone()[0]
+
+
+def stored_points(database, request_id):
+    with database.transaction() as cursor:
+        track, _ = TrajectoryStore(database).stored(cursor, request_id)
+    return None if track is None else len(track)
+
+
+def retention_for(database, **kwargs):
+    return LocationRetention(database, TrajectoryStore(database), batch_pause=0, **kwargs)
+
+
+def test_stationary_trip_is_archived_as_first_ping_per_status_and_last(database):
+    moving = add_trip(database, 'Patient Reached')
+    parked = add_trip(database, 'Patient Reached', moving=False)
+    processed_up_to(database, 10 ** 6)
+    retention_for(database).run(NOW)
+    assert live_rows(database, moving) == 0 and live_rows(database, parked) == 0
+    assert stored_points(database, moving) == 50
+    assert stored_points(database, parked) == 3
+
+
+def test_running_trip_is_not_archived_however_quiet(database):
+    running = add_trip(database, 'Started')
+    processed_up_to(database, 10 ** 6)
+    retention_for(database).run(NOW)
+    assert live_rows(database, running) == 50 and stored_points(database, running) is None
+
+
+def test_trips_wait_for_speed_profiles_and_are_counted(database):
+    trip = add_trip(database, 'Patient Reached')
+    processed_up_to(database, 10)
+    retention = retention_for(database)
+    retention.run(NOW)
+    assert live_rows(database, trip) == 50
+    assert retention.stats()['trips_waiting_for_speed_profiles'] == {'downsample': 1, 'archive': 1}
+
+    processed_up_to(database, 10 ** 6)
+    retention.run(NOW)
+    assert live_rows(database, trip) == 0
+    assert retention.stats()['trips_waiting_for_speed_profiles'] == {'downsample': 0, 'archive': 0}
+
+
+def test_gate_can_be_turned_off(database):
+    trip = add_trip(database, 'Patient Reached')
+    retention_for(database, wait_for_speed_profiles=False).run(NOW)
+    assert live_rows(database, trip) == 0 and stored_points(database, trip) == 50
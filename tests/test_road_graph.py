@@ -0,0 +1,139 @@
+"""ALT (A* with landmarks) against plain Dijkstra on synthetic grid graphs"""
+import random
+
+import numpy as np
+import pytest
+
+from road_graph import HIGHWAY_SPEEDS_KMH, RoadGraph
+
+ROWS, COLS = 25, 30
+
+
+def path_seconds(graph, path):
+    """Sum of edge travel times along a node path, checking every hop is a real edge"""
+    total = 0.0
+    for v, w in zip(path, path[1:]):
+        edges = range(graph.indptr[v], graph.indptr[v + 1])
+        costs = [float(graph.seconds[e]) for e in edges if graph.targets[e] == w]
+        assert costs, f'{v} -> {w} is not an edge'
+        total += min(costs)
+    return total
+
+
+def one_way_grid(seed=3):
+    """The grid with a third of its streets made one-way, so travel times are asymmetric"""
+    base = RoadGraph.grid(ROWS, COLS, seed=seed)
+    rng = np.random.default_rng(seed)
+    sources = np.repeat(np.arange(base.node_count), np.diff(base.indptr))
+    keep = np.ones(base.edge_count, dtype=bool)
+    seen = {}
+    for e, (v, w) in enumerate(zip(sources.tolist(), base.targets.tolist())):
+        key = (min(v, w), max(v, w))
+        if key in seen:
+            # Drop one direction of some streets, keeping the grid's outer ring two-way (stays connected)
+            r1, c1 = divmod(v, COLS)
+            r2, c2 = divmod(w, COLS)
+            inner = all(0 < r < ROWS - 1 for r in (r1, r2)) and all(0 < c < COLS - 1 for c in (c1, c2))
+            if inner and rng.random() < 0.33:
+                keep[e] = False
+        seen[key] = e
+    return RoadGraph.from_edges(base.lat, base.lng, sources[keep], base.targets[keep],
+                                base.meters[keep], base.seconds[keep])
+
+
+@pytest.fixture(scope='module', params=['two_way', 'one_way'])
+def graph(request):
+    graph = RoadGraph.grid(ROWS, COLS) if request.param == 'two_way' else one_way_grid()
+    graph.add_landmarks(8)
+    return graph
+
+
+def random_pairs(graph, count=60, seed=7):
+    rng = random.Random(seed)
+    return [(rng.randrange(graph.node_count), rng.randrange(graph.node_count)) for _ in range(count)]
+
+
+def test_alt_matches_dijkstra(graph):
+    for source, target in random_pairs(graph):
+        dijkstra = graph.shortest_path(source, target, use_landmarks=False)
+        alt = graph.shortest_path(source, target)
+        assert (dijkstra is None) == (alt is None)
+        if dijkstra is None:
+            continue
+        assert alt[0] == pytest.approx(dijkstra[0], rel=1e-5)
+        assert alt[1][0] == source and alt[1][-1] == target
+        assert path_seconds(graph, alt[1]) == pytest.approx(alt[0], rel=1e-5)
+
+
+def test_dijkstra_matches_full_search(graph):
+    source = 0
+    everywhere = graph._dijkstra_all(source)
+    for target in random.Random(1).sample(range(graph.node_count), 40):
+        found = graph.shortest_path(source, target, use_landmarks=False)
+        assert found[0] == pytest.approx(float(everywhere[target]), rel=1e-5)
+
+
+def test_landmarks_are_a_lower_bound(graph):
+    for source, target in random_pairs(graph, 20, seed=11):
+        heuristic = graph._alt_heuristic(source, target)
+        exact = graph._dijkstra_all(target, reverse=True)  # seconds from every node to target
+        for v in random.Random(source).sample(range(graph.node_count), 50):
+            assert heuristic(v) <= exact[v] * (1 + 1e-5) + 1e-3
+
+
+def test_alt_settles_fewer_nodes(graph):
+    dijkstra_settled = alt_settled = 0
+    for source, target in random_pairs(graph):
+        dijkstra_settled += graph.shortest_path(source, target, use_landmarks=False)[2]
+        alt_settled += graph.shortest_path(source, target)[2]
+    assert alt_settled < dijkstra_settled
+
+
+def test_unreachable_target():
+    lat, lng = [12.90, 12.91, 12.92], [77.50, 77.50, 77.50]
+    graph = RoadGraph.from_edges(lat, lng, [0, 1], [1, 0], [1000, 1000], [60, 60])
+    graph.add_landmarks(2)
+    assert graph.shortest_path(0, 2) is None
+    assert graph.shortest_path(0, 2, use_landmarks=False) is None
+
+
+def test_route_snaps_and_reports_provider_shape():
+    graph = RoadGraph.grid(10, 10)
+    graph.add_landmarks(4)
+    start = (graph.lat[0] + 1e-5, graph.lng[0])
+    end = (graph.lat[99], graph.lng[99] - 1e-5)
+    route = graph.route(*start, *end)
+    assert route['success']
+    assert route['distance_km'] > 0 and route['duration_minutes'] > 0
+    assert not graph.route(13.5, 78.5, *end)['success']
+
+
+def test_save_load_round_trip(tmp_path):
+    graph = RoadGraph.grid(8, 8)
+    graph.add_landmarks(4)
+    path = str(tmp_path / 'graph.npz')
+    graph.save(path)
+    loaded = RoadGraph.load(path)
+    assert loaded.stats() == graph.stats()
+    assert loaded.shortest_path(0, 63)[0] == pytest.approx(graph.shortest_path(0, 63)[0])
+
+
+OSM = '''<osm>
+  <node id="1" lat="12.970" lon="77.590"/>
+  <node id="2" lat="12.971" lon="77.590"/>
+  <node id="3" lat="12.972" lon="77.590"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><tag k="highway" v="residential"/><tag k="maxspeed" v="{}"/></way>
+  <way id="11"><nd ref="2"/><nd ref="3"/><tag k="highway" v="residential"/><tag k="maxspeed" v="30 mph"/></way>
+</osm>'''
+
+
+@pytest.mark.parametrize('maxspeed', ['0', '-20', '0 mph', 'nan', 'inf', 'walk', ''])
+def test_unusable_maxspeed_falls_back_to_the_highway_default(tmp_path, maxspeed):
+    path = tmp_path / 'city.osm'
+    path.write_text(OSM.format(maxspeed))
+    graph = RoadGraph.from_osm(str(path))
+    assert np.isfinite(graph.seconds).all() and (graph.seconds > 0).all()
+    edge = graph.indptr[0]  # node 0's only edge, along the way under test
+    assert graph.meters[edge] / graph.seconds[edge] * 3.6 == pytest.approx(HIGHWAY_SPEEDS_KMH['residential'])
+    edge = graph.indptr[2]  # the 30 mph way is untouched
+    assert graph.meters[edge] / graph.seconds[edge] * 3.6 == pytest.approx(30 * 1.609)
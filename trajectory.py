@@ -0,0 +1,339 @@
+import csv
+import io
+import json
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from db import db
+from geometry import COORDINATE_SCALE
+from speed_profiles import EPOCH, wall_clock_seconds
+
+
+# TRAJECTORY STORE CONFIG
+TRAJECTORY_COMPRESS_LEVEL = int(os.getenv('TRAJECTORY_COMPRESS_LEVEL', 6))  # zlib level for track blobs, 0 = raw columns
+TRAJECTORY_EXPORT_BATCH = int(os.getenv('TRAJECTORY_EXPORT_BATCH', 500))  # tracks read per query when exporting
+
+TRACK_MAGIC = b'TRK1'
+TRACK_HEADER = struct.Struct('<4sBBHI')  # magic, version, flags, status-name bytes, point count
+TRACK_VERSION = 1
+TRACK_POINT_BYTES = 17  # time (8), lat (4), lng (4), status code (1)
+FLAG_ZLIB = 1
+EXPORT_CHUNK_ROWS = 2000
+
+
+def epoch_ms(timestamp):
+    """Stored ISO timestamp -> wall-clock epoch milliseconds (None if unparseable)"""
+    try:
+        return int(round(wall_clock_seconds(datetime.fromisoformat(str(timestamp))) * 1000))
+    except ValueError:
+        return None
+
+
+def iso_timestamp(ms):
+    return (EPOCH + timedelta(milliseconds=int(ms))).isoformat()
+
+
+class Track:
+    """
+    One trip's GPS track as parallel NumPy columns, in time order:
+    times_ms (int64 wall-clock epoch ms), lat_e5 / lng_e5 (int32, geometry.COORDINATE_SCALE)
+    and codes (uint8 index into statuses).
+
+    encode() packs it into one blob: a fixed header, the status names as JSON, then the columns
+    delta-encoded as typed arrays (int64 time deltas, int32 lat and lng deltas, uint8 codes),
+    zlib-compressed unless TRAJECTORY_COMPRESS_LEVEL is 0. decode() is a frombuffer + cumsum per
+    column, so thousands of tracks load without per-point Python work.
+    """
+
+    __slots__ = ('times_ms', 'lat_e5', 'lng_e5', 'codes', 'statuses')
+
+    def __init__(self, times_ms, lat_e5, lng_e5, codes, statuses):
+        self.times_ms = times_ms
+        self.lat_e5 = lat_e5
+        self.lng_e5 = lng_e5
+        self.codes = codes
+        self.statuses = statuses
+
+    @classmethod
+    def from_points(cls, points):
+        """Build from (lat, lng, epoch_ms, status) tuples in any order"""
+        index = {}
+        codes = [index.setdefault(status, len(index)) for _, _, _, status in points]
+        if len(index) > 255:
+            raise ValueError('A track supports at most 255 distinct statuses')
+        times_ms = np.array([point[2] for point in points], dtype=np.int64)
+        order = np.argsort(times_ms, kind='stable')
+        coordinates = np.array([(point[0], point[1]) for point in points], dtype=np.float64).reshape(-1, 2)
+        scaled = np.round(coordinates * COORDINATE_SCALE).astype(np.int32)
+        return cls(times_ms[order], scaled[order, 0], scaled[order, 1],
+                   np.array(codes, dtype=np.uint8)[order], list(index))
+
+    def __len__(self):
+        return len(self.times_ms)
+
+    @property
+    def lats(self):
+        return self.lat_e5 / COORDINATE_SCALE
+
+    @property
+    def lngs(self):
+        return self.lng_e5 / COORDINATE_SCALE
+
+    @property
+    def started_at(self):
+        return iso_timestamp(self.times_ms[0]) if len(self) else None
+
+    @property
+    def ended_at(self):
+        return iso_timestamp(self.times_ms[-1]) if len(self) else None
+
+    def merge(self, other):
+        """This track plus another one's points (e.g. late pings), in time order"""
+        if not len(other):
+            return self
+        statuses = list(self.statuses)
+        remap = []
+        for status in other.statuses:
+            if status not in statuses:
+                statuses.append(status)
+            remap.append(statuses.index(status))
+        if len(statuses) > 255:
+            raise ValueError('A track supports at most 255 distinct statuses')
+        remap = np.array(remap, dtype=np.uint8)
+        times_ms = np.concatenate([self.times_ms, other.times_ms])
+        order = np.argsort(times_ms, kind='stable')
+        return Track(times_ms[order], np.concatenate([self.lat_e5, other.lat_e5])[order],
+                     np.concatenate([self.lng_e5, other.lng_e5])[order],
+                     np.concatenate([self.codes, remap[other.codes]])[order], statuses)
+
+    def window(self, start_ms=None, end_ms=None):
+        """Points with start_ms <= time <= end_ms"""
+        lo = 0 if start_ms is None else int(np.searchsorted(self.times_ms, start_ms, side='left'))
+        hi = len(self) if end_ms is None else int(np.searchsorted(self.times_ms, end_ms, side='right'))
+        return Track(self.times_ms[lo:hi], self.lat_e5[lo:hi], self.lng_e5[lo:hi], self.codes[lo:hi], self.statuses)
+
+    def encode(self, level=TRAJECTORY_COMPRESS_LEVEL):
+        names = json.dumps(self.statuses).encode()
+        columns = b''.join([
+            np.diff(self.times_ms, prepend=np.int64(0)).astype('<i8').tobytes(),
+            np.diff(self.lat_e5, prepend=np.int32(0)).astype('<i4').tobytes(),
+            np.diff(self.lng_e5, prepend=np.int32(0)).astype('<i4').tobytes(),
+            self.codes.astype(np.uint8).tobytes()
+        ])
+        flags = FLAG_ZLIB if level else 0
+        if level:
+            columns = zlib.compress(columns, level)
+        return TRACK_HEADER.pack(TRACK_MAGIC, TRACK_VERSION, flags, len(names), len(self)) + names + columns
+
+    @classmethod
+    def decode(cls, blob, max_count=None):
+        """
+        Inverse of encode. max_count bounds untrusted blobs: the header's point count is checked
+        before anything is inflated, and the columns are never inflated past what it declares.
+        """
+        magic, version, flags, names_len, count = TRACK_HEADER.unpack_from(blob)
+        if magic != TRACK_MAGIC or version != TRACK_VERSION:
+            raise ValueError('Not a version 1 track blob')
+        if max_count is not None and count > max_count:
+            raise ValueError(f'At most {max_count} points per track')
+        offset = TRACK_HEADER.size
+        statuses = json.loads(bytes(blob[offset:offset + names_len]))
+        columns = blob[offset + names_len:]
+        size = TRACK_POINT_BYTES * count
+        if flags & FLAG_ZLIB:
+            # One byte of headroom: a stream that still has output left after it is too long
+            inflater = zlib.decompressobj()
+            columns = inflater.decompress(columns, size + 1)
+            if not inflater.eof or inflater.unused_data:
+                raise ValueError('Track columns do not match the point count')
+        if len(columns) != size:
+            raise ValueError('Track columns do not match the point count')
+        times_ms = np.frombuffer(columns, '<i8', count, 0).cumsum()
+        lat_e5 = np.frombuffer(columns, '<i4', count, 8 * count).cumsum(dtype=np.int32)
+        lng_e5 = np.frombuffer(columns, '<i4', count, 12 * count).cumsum(dtype=np.int32)
+        codes = np.frombuffer(columns, np.uint8, count, 16 * count)
+        return cls(times_ms, lat_e5, lng_e5, codes, statuses)
+
+    def rows(self):
+        """(iso timestamp, lat, lng, status) per point"""
+        statuses = self.statuses
+        for ms, lat, lng, code in zip(self.times_ms.tolist(), self.lats.tolist(), self.lngs.tolist(),
+                                      self.codes.tolist()):
+            yield iso_timestamp(ms), lat, lng, statuses[code]
+
+    def to_columns(self):
+        """JSON-ready columns (statuses once, then a code per point)"""
+        return {
+            'points': len(self),
+            'started_at': self.started_at,
+            'ended_at': self.ended_at,
+            'statuses': self.statuses,
+            'time_ms': self.times_ms.tolist(),
+            'lat': self.lats.tolist(),
+            'lng': self.lngs.tolist(),
+            'status': self.codes.tolist()
+        }
+
+
+# STREAMING EXPORT
+
+def csv_chunks(tracks, header=True):
+    """CSV text in chunks of EXPORT_CHUNK_ROWS rows for (request_id, Track) pairs"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(['request_id', 'timestamp', 'lat', 'lng', 'status'])
+    rows = 0
+    for request_id, track in tracks:
+        for timestamp, lat, lng, status in track.rows():
+            writer.writerow([request_id, timestamp, lat, lng, status])
+            rows += 1
+            if rows % EXPORT_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(tracks):
+    """One JSON line of columns per (request_id, Track) pair"""
+    for request_id, track in tracks:
+        yield json.dumps({'request_id': request_id, **track.to_columns()}) + '\n'
+
+
+def geojson_feature(request_id, track):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'LineString',
+                     'coordinates': np.column_stack([track.lngs, track.lats]).tolist()},
+        'properties': {'request_id': request_id, 'started_at': track.started_at, 'ended_at': track.ended_at,
+                       'time_ms': track.times_ms.tolist(), 'statuses': track.statuses,
+                       'status': track.codes.tolist()}
+    }
+
+
+class TrajectoryStore:
+    """
+    Columnar per-trip tracks in trip_tracks, one Track blob per request. The location retention
+    pass fills it as trips finish (see retention.py); last_location_id records the newest
+    ambulance_locations row folded into a track, so live rows are never counted twice.
+    get() serves any trip, merging live rows that are not stored yet.
+    """
+
+    def __init__(self, database=db, compress_level=TRAJECTORY_COMPRESS_LEVEL, export_batch=TRAJECTORY_EXPORT_BATCH):
+        self.db = database
+        self.compress_level = compress_level
+        self.export_batch = export_batch
+        self._lock = threading.Lock()
+        self.saved = 0
+        self.loaded = 0
+
+    def live_points(self, cursor, request_id, after_id=0):
+        """(id, lat, lng, epoch_ms, status) of a trip's ambulance_locations rows that carry a position"""
+        cursor.execute('''
+            SELECT id, latitude, longitude, timestamp, status FROM ambulance_locations
+            WHERE ambulance_id = ? AND id > ? AND latitude IS NOT NULL AND longitude IS NOT NULL
+            ORDER BY timestamp, id
+        ''', (request_id, after_id))
+        points = []
+        for row_id, lat, lng, timestamp, status in cursor.fetchall():
+            ms = epoch_ms(timestamp)
+            if ms is not None:
+                points.append((row_id, lat, lng, ms, status))
+        return points
+
+    def stored(self, cursor, request_id):
+        """(Track, last_location_id) from trip_tracks, or (None, 0)"""
+        cursor.execute('SELECT track, last_location_id FROM trip_tracks WHERE request_id = ?', (request_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None, 0
+        with self._lock:
+            self.loaded += 1
+        return Track.decode(row[0]), row[1] or 0
+
+    def encode(self, request_id, track, last_location_id):
+        """trip_tracks row values for save_many()"""
+        return (request_id, track.started_at, track.ended_at, len(track), last_location_id,
+                track.encode(self.compress_level), datetime.now().isoformat())
+
+    def save_many(self, cursor, rows):
+        cursor.executemany('''
+            INSERT OR REPLACE INTO trip_tracks
+                (request_id, started_at, ended_at, points, last_location_id, track, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        with self._lock:
+            self.saved += len(rows)
+
+    def get(self, request_id):
+        """A trip's full track (stored columns plus newer live rows), or None if it has no points"""
+        with self.db.transaction() as cursor:
+            track, last_id = self.stored(cursor, request_id)
+            live = self.live_points(cursor, request_id, last_id)
+        if live:
+            live_track = Track.from_points([point[1:] for point in live])
+            track = track.merge(live_track) if track is not None else live_track
+        return track if track is not None and len(track) else None
+
+    def iter_tracks(self, request_ids=None, since=None, until=None):
+        """
+        (request_id, Track) for stored trips in request order, filtered by id list or by trip start
+        (ISO since/until). Reads export_batch blobs per query and holds no connection between batches.
+        """
+        if request_ids is not None:
+            ids = sorted(set(request_ids))
+            for i in range(0, len(ids), self.export_batch):
+                batch = ids[i:i + self.export_batch]
+                with self.db.transaction() as cursor:
+                    cursor.execute(f'''
+                        SELECT request_id, track FROM trip_tracks
+                        WHERE request_id IN ({', '.join('?' * len(batch))}) ORDER BY request_id
+                    ''', batch)
+                    rows = cursor.fetchall()
+                yield from self._decode_rows(rows)
+            return
+
+        after = 0
+        while True:
+            with self.db.transaction() as cursor:
+                cursor.execute('''
+                    SELECT request_id, track FROM trip_tracks
+                    WHERE request_id > ? AND started_at >= ? AND started_at < ?
+                    ORDER BY request_id LIMIT ?
+                ''', (after, since or '', until or '9999', self.export_batch))
+                rows = cursor.fetchall()
+            if not rows:
+                return
+            yield from self._decode_rows(rows)
+            after = rows[-1][0]
+
+    def _decode_rows(self, rows):
+        with self._lock:
+            self.loaded += len(rows)
+        for request_id, blob in rows:
+            yield request_id, Track.decode(blob)
+
+    def stats(self):
+        with self.db.transaction() as cursor:
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(points), 0), COALESCE(SUM(LENGTH(track)), 0) FROM trip_tracks')
+            tracks, points, size = cursor.fetchone()
+        with self._lock:
+            return {
+                'tracks': tracks,
+                'points': points,
+                'bytes': size,
+                'bytes_per_point': round(size / points, 2) if points else None,
+                'compress_level': self.compress_level,
+                'saved': self.saved,
+                'loaded': self.loaded
+            }
+
+
+trajectories = TrajectoryStore()